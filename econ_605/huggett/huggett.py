@@ -1,247 +1,1074 @@
 import numpy as np
-import scipy as sp
-from numba import jit
+import time
+from functools import partial
+from numba import njit, prange, vectorize
+from scipy.sparse import csr_matrix, identity
+from scipy.sparse.linalg import eigs, gmres
 from scipy.stats import uniform
 
 
-# Define a function to iterate over value functions (unfortunately, some of the Numpy methods in here cause Numba's
-# JIT compilation to fail; then again, Numpy is probably faster than the alternatives at those operations, so maybe
-# it's not obviously a speed loss? It probably is though)
-def v_iter(r, b, u, P, A, Y, v_0, tol=.001, i_max_v=1000, get_g=True):
-    # Take the n x 1 Y vector, make an m x n matrix which has one income in each column
-    # S = np.tile(Y.transpose(), (A.shape[0], 1))
+# Define a function that sets up buffers for the utility calculations in v_iter(), which can be passed to it as buf and
+# reused across calls (e.g. for different r), so that the large arrays only get allocated once
+# These are the part of consumption which does not depend on r, y - a' (n x 1 x m), and arrays for consumption,
+# utility, and utility plus continuation values for n_rows income states at a time (n_rows x m x m each), which should
+# have the same type as the utility function's output (if no type is given, they use the type of A and Y, which is what
+# crra() returns)
+def u_buffers(A, Y, n_rows, dtype=None):
+    # Get the number of asset choices m
+    m = A.shape[0]
 
-    # Flatten that matrix to an m*n x 1 vector
-    # S = np.array(np.tile(Y.transpose(), (A.shape[0], 1)).flatten(order='F'), ndmin=2).transpose()
+    # Get the part of consumption which does not depend on r, and use its type if none was specified
+    c_0 = Y[:, 0, None, None] - A[None, None, :, 0]
+    if dtype is None:
+        dtype = np.result_type(c_0, 1.0)
 
-    # Repeat that vector m times, to create an m*n x m matrix of incomes
-    # The previous two steps and the next stept are now all done in one move, to preserve memory; the old code is still
-    # in the comments for ease of understanding
-    S = np.tile(np.array(np.tile(Y.transpose(), (A.shape[0], 1)).flatten(order='F'), ndmin=2).transpose(),
-                (1, A.shape[0]))
+    # Set up the buffers
+    return {'c_0': c_0, 'c': np.empty((n_rows, m, m), dtype=dtype), 'U': np.empty((n_rows, m, m), dtype=dtype),
+            'T': np.empty((n_rows, m, m), dtype=dtype)}
 
-    # Make an m*n x m matrix of assets, for the initial assets people enter a period with; these have to be equal across
-    # columns, so it just repeats the array as-is
-    B = np.tile(A, (Y.shape[0], A.shape[0]))
 
-    # Make a vector like that for next period's assets, which have to be equal within columns (hence the transpose)
-    B_prime = np.tile(A.transpose(), (A.shape[0] * Y.shape[0], 1))
+# Define a function that calculates in-period utility for a block of income states, as an (income states in block) x
+# m x m array, where the (i, j, k) element refers to income i, current assets j, and next period's assets k
+# Here, c_0 is the part of consumption which does not depend on r, y - a', for the income states in the block; if
+# buffers from u_buffers() are provided, everything gets written into those (this requires u to take an out argument,
+# like crra() does), so no new arrays are set up
+def u_block(r, u, A, c_0, buf=None):
+    # Consumption is (1 + r)a + y - a', which is set up via broadcasting, so none of the inputs get tiled
+    if buf is None:
+        return u((1 + r) * A[None, :, 0, None] + c_0)
+    else:
+        # Get the buffers for this block
+        c = buf['c'][:c_0.shape[0]]
+        U = buf['U'][:c_0.shape[0]]
+
+        # Calculate consumption and utility in place
+        np.add(c_0, ((1 + r) * A[:, 0])[None, :, None], out=c)
+        return u(c, out=U)
+
+
+# Define a compiled version of the maximization step in bellman(), for a block of utilities U (income states in block x
+# m x m) and the matching continuation values W (income states in block x m), which adds them up, picks the optimal
+# asset choice for each (s, a), and keeps the associated value, all in a single pass that never sets up the block of
+# sums (so there is no buffer to write into and read back from)
+# The (s, a) pairs get split across cores via prange, so this runs in parallel even if the block only holds a single
+# income state (the number of threads can be set via numba.set_num_threads() or NUMBA_NUM_THREADS)
+# Each sum is the same as in bellman(), and ties go to the first asset choice, like they do for np.argmax(), so as long
+# as there are no NaNs, the results are exactly the same as for the Numpy version
+@njit(parallel=True)
+def bellman_nb(U, W):
+    # Get the number of income states in the block and the number of asset choices
+    n_s, m, _ = U.shape
+
+    # Set up the value function and the policy function indices for the block
+    v = np.empty((n_s, m), dtype=U.dtype)
+    g_i = np.empty((n_s, m), dtype=np.int64)
+
+    # Go through all (s, a) pairs in parallel
+    for i in prange(n_s * m):
+        # Get the income state and current asset
+        s = i // m
+        j = i % m
+
+        # Start with the first asset choice, and go through all other ones, keeping the best one so far (using a
+        # strict inequality, so ties go to the first one)
+        k_max = 0
+        v_max = U[s, j, 0] + W[s, 0]
+        for k in range(1, m):
+            v_k = U[s, j, k] + W[s, k]
+            if v_k > v_max:
+                k_max = k
+                v_max = v_k
+
+        # Store the optimal choice and its value
+        v[s, j] = v_max
+        g_i[s, j] = k_max
+
+    # Return the value function and optimal asset choices
+    return v, g_i
+
+
+# Define the Bellman operator, which takes a value function v_in (n x m, the (i, j) element refers to income i and asset
+# choice j) and returns the updated value function and the index of the optimal asset choice for each (s, a)
+# This goes through the income states in blocks of n_block, so at most an n_block x m x m array is set up at a time; if
+# the full n x m x m array of utilities U is provided, it is used instead of recalculating utilities for each block
+# If buffers from u_buffers() are provided, all of the n_block x m x m arrays are written into those
+# If kernel is 'numba', the maximization step for each block uses bellman_nb() instead of Numpy (the utilities and the
+# continuation values P @ v are still calculated the same way, so the results are identical)
+def bellman(r, b, u, P, A, Y, v_in, U=None, n_block=None, buf=None, kernel='numpy'):
+    # Get the number of incomes n
+    n = v_in.shape[0]
+
+    # Get the part of consumption which does not depend on r, y - a'
+    if buf is None:
+        c_0 = Y[:, 0, None, None] - A[None, None, :, 0]
+    else:
+        c_0 = buf['c_0']
+
+    # If no block size is specified, do everything in one go
+    if n_block is None:
+        n_block = n
+
+    # Calculate next-period continuation values, which only depend on income and next period's assets, so this is n x m
+    # (this used to be repeated m times, to get an m*n x m matrix)
+    W = b * (P @ v_in)
+
+    # Set up lists for the value and policy functions of each block
+    v_out = []
+    g_i = []
+
+    # Go through all blocks of income states
+    for i in range(0, n, n_block):
+        # Get the utilities for the current block, either from U or by calculating them
+        if U is None:
+            U_s = u_block(r, u, A, c_0[i:i + n_block], buf=buf)
+        else:
+            U_s = U[i:i + n_block]
+
+        # Check whether to use the compiled kernel
+        if kernel == 'numba':
+            # If so, add the utilities to the continuation values, pick the optimal asset choice for each (s, a), and
+            # get the associated values in one go (this needs both to have the type their sum would have anyway)
+            t = np.result_type(U_s, W)
+            v_s, g_s = bellman_nb(U_s.astype(t, copy=False), W[i:i + n_block].astype(t, copy=False))
+        else:
+            # Add the utilities to the continuation values, and pick the optimal asset choice for each (s, a)
+            if buf is None:
+                g_s = np.argmax(U_s + W[i:i + n_block, None, :], axis=2)
+            else:
+                g_s = np.argmax(np.add(U_s, W[i:i + n_block, None, :], out=buf['T'][:U_s.shape[0]]), axis=2)
+
+            # Get the associated values (this only adds up the elements that were chosen, rather than running a second
+            # reduction over the whole block)
+            v_s = (np.take_along_axis(U_s, g_s[:, :, None], axis=2)[:, :, 0]
+                   + np.take_along_axis(W[i:i + n_block], g_s, axis=1))
+
+        # Store the results
+        v_out.append(v_s)
+        g_i.append(g_s)
+
+    # Put the blocks together
+    return np.concatenate(v_out, axis=0), np.concatenate(g_i, axis=0)
+
+
+# Define a function that sets up the order in which the monotone Bellman operator goes through the asset grid, which
+# is by repeatedly bisecting it: first the midpoint, then the midpoints of the lower and upper halves, and so on
+# Each element of the resulting list is one such level, as a tuple of three arrays: the asset indices on that level, and
+# the indices of the closest asset on each side that was handled on an earlier level (-1 if there is none)
+def mon_levels(m):
+    # Set up the list of levels, and the intervals of asset indices which still need to be handled, together with their
+    # neighbors on either side
+    lev = []
+    ints = [(0, m - 1, -1, -1)]
+
+    # Keep going until all asset indices have been handled
+    while ints:
+        # Get the midpoint of each interval, and split it into a lower and upper part
+        mids = [(lo + hi) // 2 for lo, hi, _, _ in ints]
+        lev.append((np.array(mids), np.array([l for _, _, l, _ in ints]), np.array([h for _, _, _, h in ints])))
+        ints = ([(lo, mid - 1, l, mid) for (lo, _, l, _), mid in zip(ints, mids) if lo < mid]
+                + [(mid + 1, hi, mid, h) for (_, hi, _, h), mid in zip(ints, mids) if mid < hi])
+
+    # Return the levels
+    return lev
+
+
+# Define a version of the Bellman operator which exploits that the policy function is monotone in current assets, and
+# that the objective is concave in next period's assets wherever the continuation values are
+# It goes through the asset grid in the order set up by mon_levels(), so the best affordable asset choice at a is
+# bracketed by the choices at the closest lower and upper assets which have already been handled (this only needs
+# 1 + r > 0, since then utility has increasing differences in current and next period's assets); within that bracket, it
+# uses binary search for the peak of the objective for income states where the continuation values are concave in next
+# period's assets, and checks the whole bracket for all others (e.g. while the value function is still close to a
+# non-concave initial guess)
+# Since u assigns some (very low) utility to non-positive consumption, an unaffordable choice can still be the best one
+# if continuation values vary enough, so those get checked at the end for the few states where that is possible
+# This is done for all income states at once, and never sets up anything larger than n x m (plus the brackets, if they
+# have to be checked in full), so each application costs roughly O(n*m*log(m)) instead of O(n*m^2), but only for income
+# states with concave continuation values; checking the brackets in full is not cheaper than checking the whole grid
+# (the brackets on the first levels span most of the grid, and get padded to the widest one), and is usually slower
+# (e.g. for n = 10, m = 1000, and r = -.5, where continuation values are never concave, one application takes about
+# .25 instead of .16 seconds)
+# So if no income state has concave continuation values, and T_grid (the Bellman operator checking the whole grid, see
+# v_iter()) is provided, this just returns T_grid(v_in), which gives the same results
+def bellman_mon(r, b, u, P, A, Y, v_in, lev, T_grid=None):
+    # Get the number of incomes n and the number of asset choices m
+    n, m = v_in.shape
+
+    # Calculate next-period continuation values (this is n x m)
+    W = b * (P @ v_in)
+
+    # Calculate cash on hand (1 + r)a + y for each (s, a) (this is also n x m)
+    x = (1 + r) * A[None, :, 0] + Y[:, 0, None]
+
+    # Since consumption is decreasing in next period's assets, the affordable choices for each (s, a) are the ones below
+    # the first asset choice that leaves non-positive consumption, so get the index of that choice
+    k_0 = np.searchsorted(A[:, 0], x, side='left')
+
+    # Get the income states for which continuation values are concave in next period's assets, for which binary search
+    # can be used, and all others
+    conc = np.all(np.diff(W, n=2, axis=1) <= 0, axis=1)
+
+    # If there aren't any, check the whole grid instead
+    if T_grid is not None and not np.any(conc):
+        return T_grid(v_in)
+    s_c = np.flatnonzero(conc)[:, None]
+    s_n = np.flatnonzero(~conc)[:, None]
+
+    # Set up the policy function, as indices of the best affordable asset choices
+    g_i = np.zeros((n, m), dtype=int)
+
+    # Go through all levels of the asset grid
+    for a, a_l, a_h in lev:
+        # Get the bracket for the optimal choice, which is the choice for the closest lower asset which has been handled
+        # (if there is one, and it could afford anything) and the choice for the closest higher one (if there is one)
+        lo = np.where((a_l >= 0) & (k_0[:, a_l] > 0), g_i[:, a_l], 0)
+        hi = np.where(a_h >= 0, g_i[:, a_h], m - 1)
+
+        # Get cash on hand and the first unaffordable choice for these assets
+        x_a = x[:, a]
+        k_0a = k_0[:, a]
+
+        # For income states with concave continuation values, use binary search to find the peak of the objective within
+        # the bracket
+        if s_c.size > 0:
+            # Get the brackets, cash on hand, and first unaffordable choice for these states
+            lo_c, hi_c, x_c, k_0c = lo[s_c[:, 0]], hi[s_c[:, 0]], x_a[s_c[:, 0]], k_0a[s_c[:, 0]]
+
+            # Keep going until all brackets have been narrowed down to one choice
+            while np.any(lo_c < hi_c):
+                # Get the midpoint of the bracket, and the next asset choice after it
+                mid = (lo_c + hi_c) // 2
+                mid_1 = np.minimum(mid + 1, m - 1)
+
+                # Move up if the higher choice is affordable and the objective is still increasing, otherwise move down
+                up = ((lo_c < hi_c) & (mid_1 < k_0c)
+                      & (u(x_c - A[mid, 0]) + W[s_c, mid] < u(x_c - A[mid_1, 0]) + W[s_c, mid_1]))
+                down = (lo_c < hi_c) & ~up
+                lo_c = np.where(up, mid + 1, lo_c)
+                hi_c = np.where(down, mid, hi_c)
+
+            # Store the results
+            lo[s_c[:, 0]] = lo_c
+
+        # For all other income states, check every affordable choice within the bracket
+        if s_n.size > 0:
+            # Get the brackets, cash on hand, and first unaffordable choice for these states
+            lo_n, hi_n, x_n, k_0n = lo[s_n[:, 0]], hi[s_n[:, 0]], x_a[s_n[:, 0]], k_0a[s_n[:, 0]]
 
-    # Calculate in-period utility (which will be m*n x m also)
-    U = u((1 + r) * B + S - B_prime)
+            # Set up all choices within each bracket, padded to the width of the widest one by repeating the upper end
+            # of the bracket (since np.argmax picks the first maximum, that doesn't change anything)
+            K = np.minimum(lo_n[:, :, None] + np.arange(np.amax(hi_n - lo_n) + 1), hi_n[:, :, None])
+
+            # Pick the best affordable one (if nothing is affordable, this doesn't matter, since it gets replaced below)
+            i_n = np.argmax(np.where(K < k_0n[:, :, None], u(x_n[:, :, None] - A[K, 0]) + W[s_n[:, :, None], K],
+                                     -np.inf), axis=2)
+            lo[s_n[:, 0]] = np.take_along_axis(K, i_n[:, :, None], axis=2)[:, :, 0]
+
+        # Store the optimal choices
+        g_i[:, a] = lo
+
+    # Calculate the new value function, given the optimal choices (states which cannot afford anything get minus
+    # infinity for now)
+    v_out = np.where(k_0 > 0, u(x - A[g_i, 0]) + np.take_along_axis(W, g_i, axis=1), -np.inf)
+
+    # Unaffordable choices give at most the utility of zero consumption, so get the best continuation value among them
+    # (this is the running maximum of W from the right), and find the states for which they might beat the best
+    # affordable choice
+    W_max = np.concatenate([np.maximum.accumulate(W[:, ::-1], axis=1)[:, ::-1], np.full((n, 1), -np.inf)], axis=1)
+    s_u, a_u = np.nonzero(u(np.zeros(1))[0] + np.take_along_axis(W_max, k_0, axis=1) >= v_out)
+
+    # For those states, check all choices
+    if s_u.size > 0:
+        # Get the objective for all choices
+        V_u = u(x[s_u, a_u, None] - A[None, :, 0]) + W[s_u, :]
+
+        # Pick the best one, and update the policy and value functions
+        g_i[s_u, a_u] = np.argmax(V_u, axis=1)
+        v_out[s_u, a_u] = np.amax(V_u, axis=1)
+
+    # Return the value function and optimal asset choices
+    return v_out, g_i
+
+
+# Define a function that evaluates a given policy (indices of the optimal asset choices g_i, n x m) k times, starting
+# from the value function v, i.e. this applies v <- u(c(g)) + b * E[v(s', g(a, s))] k times without maximizing
+def pol_eval(r, b, u, P, A, Y, v, g_i, k):
+    # Calculate in-period utility under the policy (this is just n x m)
+    u_g = u((1 + r) * A[None, :, 0] + Y[:, 0, None] - A[g_i, 0])
+
+    # Apply the policy's Bellman operator k times (the continuation value for (s, a) is the element of P @ v for income
+    # s and asset choice g(a, s))
+    for j in range(k):
+        v = u_g + b * np.take_along_axis(P @ v, g_i, axis=1)
+
+    # Return the resulting value function
+    return v
+
+
+# Define a function to iterate over value functions (some of the Numpy methods in here cause Numba's JIT compilation to
+# fail, so this stays in Numpy, but the maximization step, which is where almost all of the time goes, can use the
+# compiled and parallel bellman_nb() instead, see kernel below)
+# The block argument is the maximum number of elements of the n_block x m x m utility array the Bellman operator works
+# on at a time; if all n x m x m utilities fit into one block, they are only calculated once, otherwise they get
+# recalculated for each block in each iteration, which is slower, but keeps memory use down to O(n*m) plus the block
+# The method argument can be 'vfi' for plain value function iteration, or 'mpi' for modified policy iteration (Howard's
+# improvement), which evaluates the current policy k_pol times after each maximization step; setting mqp=True stops
+# based on the MacQueen-Porteus error bounds instead of the change in the value function, and returns the midpoint of
+# those bounds
+# If get_i is True, this also returns the number of maximization steps it took (after the value/policy functions)
+# The search argument can be 'grid' to check all asset choices for each (s, a), or 'monotone' to use bellman_mon(),
+# which is much faster for large m once continuation values are concave in next period's assets (it needs 1 + r > 0,
+# since otherwise the policy function isn't monotone, so it falls back to checking the full grid if that isn't the
+# case, and it also checks the full grid in any iteration where no income state has concave continuation values, e.g.
+# while the value function is still close to a non-concave initial guess, or for very low r, where the grid search is
+# faster)
+# The buf argument can be a dictionary, which gets filled with buffers from u_buffers() the first time (or whenever the
+# grid changes), and then reused; passing the same one for every r means the large arrays for consumption and utility
+# are only ever allocated once, and each new r just needs an axpy and the utility function (this requires u to take
+# an out argument, like crra() does)
+# The kernel argument can be 'numpy' or 'numba', which uses bellman_nb() to check the full grid on all cores, with
+# exactly the same results (this applies whenever the full grid gets checked, and since Numba doesn't do long doubles,
+# it falls back to Numpy for those)
+def v_iter(r, b, u, P, A, Y, v_0, tol=.001, i_max_v=1000, get_g=True, block=2**22, method='vfi', k_pol=20,
+           mqp=False, get_i=False, search='grid', buf=None, kernel='numpy'):
+    # Check whether the method, search, and kernel are recognized
+    if method not in ['vfi', 'mpi']:
+        raise ValueError('Value function iteration method ' + str(method) + ' not recognized')
+    if search not in ['grid', 'monotone']:
+        raise ValueError('Search method ' + str(search) + ' not recognized')
+    if kernel not in ['numpy', 'numba']:
+        raise ValueError('Bellman kernel ' + str(kernel) + ' not recognized')
+
+    # Get the number of incomes n and the number of asset choices m
+    n, m = v_0.shape
+
+    # Check whether to use the monotone search
+    mono = search == 'monotone' and 1 + r > 0
+
+    # Get the number of income states per block (at least one, at most n)
+    n_block = min(max(block // m**2, 1), n)
+
+    # If buffers are provided, make sure they exist and fit the grid, block size, and the types of consumption and the
+    # utility function's output (which follow the precision of r, A, and Y, so switching precision between calls sets up
+    # new buffers)
+    c_type = np.result_type(r, A, Y)
+    u_type = u(np.ones(1, dtype=c_type)).dtype
+    if buf is not None and (buf.get('c_0') is None or buf['c_0'].shape != (n, 1, m) or buf['c_0'].dtype != c_type
+                            or buf['c'].shape[0] != n_block or buf['U'].dtype != u_type):
+        buf.update(u_buffers(A, Y, n_block, dtype=u_type))
+
+    # Use Numpy for long doubles, which Numba can't handle
+    if np.result_type(u_type, P, v_0) == np.longdouble:
+        kernel = 'numpy'
+
+    # Check whether all utilities fit into one block (the monotone search only checks the whole grid as a fallback, see
+    # bellman_mon(), so it doesn't calculate them in advance)
+    if n_block == n and not mono:
+        # If so, calculate in-period utility once (this is n x m x m)
+        U = u_block(r, u, A, Y[:, 0, None, None] - A[None, None, :, 0] if buf is None else buf['c_0'], buf=buf)
+    else:
+        # Otherwise, utilities are calculated block by block
+        U = None
+
+    # Set up the Bellman operator which checks the whole grid
+    def T_grid(v_in):
+        return bellman(r, b, u, P, A, Y, v_in, U=U, n_block=n_block, buf=buf, kernel=kernel)
+
+    # Check whether to use the monotone search
+    if mono:
+        # Set up the order in which to go through the asset grid
+        lev = mon_levels(m)
+
+        # Set up the monotone Bellman operator, which falls back to checking the whole grid if that's cheaper
+        def T(v_in):
+            return bellman_mon(r, b, u, P, A, Y, v_in, lev, T_grid=T_grid)
+    else:
+        # Otherwise, always check the whole grid
+        T = T_grid
+
+    # Define a function that checks whether the value function has converged, given the output and input of the last
+    # maximization step
+    def conv(v_out, v_in):
+        # Check whether to use the MacQueen-Porteus bounds
+        if mqp:
+            # The fixed point lies between v_out + b/(1-b) * min(v_out - v_in) and v_out + b/(1-b) * max(v_out - v_in),
+            # so stop once those bounds are close enough
+            return b / (1 - b) * (np.amax(v_out - v_in) - np.amin(v_out - v_in)) <= tol
+        else:
+            # Otherwise, stop once the largest change in either direction is small enough (this used to only look at
+            # the largest increase, so an initial guess that was too high everywhere, e.g. the value function of a
+            # nearby economy, could pass right away)
+            return np.amax(np.abs(v_out - v_in)) <= tol
 
     # Set first input value function to v_0
     # Note that everything is set up so the (i, j) element of v refers to income i and asset choice j, so v is n x m
     v_in = v_0
 
-    # Calculate next-period continuation values, also as an m*n x m vector
-    # W = np.repeat(P @ v_in, A.shape[0], axis=0)
+    # Get the new value function (and the optimal asset choices, which are only needed once this converges)
+    v_out, g_i = T(v_in)
+
+    # Count the iterations, to be able to stop if this takes too long to converge
+    i = 1
+    while not conv(v_out, v_in) and i <= i_max_v:
+        # For modified policy iteration, evaluate the current policy a couple of times, which is a lot cheaper than
+        # maximizing again
+        if method == 'mpi':
+            v_out = pol_eval(r, b, u, P, A, Y, v_out, g_i, k_pol)
+
+        v_in = v_out
+
+        # Get the new value function (its precision is whatever utilities and P @ v come out as, so this follows the
+        # precision of the inputs, see prec below)
+        v_out, g_i = T(v_in)
+
+        # Increase iteration counter
+        i += 1
+
+    # If the maximum number of iterations was reached, print an error message
+    if i > i_max_v:
+        print('Value function failed to converge after', i_max_v, 'iterations', '\n',
+              'Deviation:', np.amax(np.abs(v_out - v_in)))
+
+    # When using the MacQueen-Porteus bounds, use the midpoint between them as the value function (this only shifts
+    # everything by a constant, so the policy function is unaffected)
+    if mqp:
+        v_out = v_out + b / (1 - b) * (np.amax(v_out - v_in) + np.amin(v_out - v_in)) / 2
+
+    # Return the value function and, if desired, policy function (the optimal asset choices from the last iteration are
+    # the policy function for v_in, and with a good initial guess, e.g. the value function from a nearby r, the loop
+    # might not run at all), plus the number of iterations if requested
+    if get_g and get_i:
+        return v_out, A[g_i, 0], i
+    elif get_g:
+        return v_out, A[g_i, 0]
+    elif get_i:
+        return v_out, i
+    else:
+        return v_out
+
+
+# Define a function that solves the household problem using Carroll's (2006) endogenous grid method, as an alternative
+# to v_iter(); rather than the utility function, this needs marginal utility u_c and its inverse u_c_inv
+# It iterates on the consumption function: given next period's consumption c(s', a') on the asset grid, the Euler
+# equation pins down current consumption for each (s, a') pair, and the budget constraint then gives the current assets
+# at which a' is optimal, so the policy function can be interpolated from those endogenous grid points without any
+# maximization, which is linear in m per iteration and gives policies which are not restricted to the asset grid
+# It returns the policy function for next period's assets g (n x m, like v_iter()) and the consumption function c, which
+# can be used as the initial guess c_0 for a nearby r
+def egm(r, b, u_c, u_c_inv, P, A, Y, c_0=None, tol=10**(-6), i_max_c=1000, c_min=10**(-10)):
+    # Get the number of incomes n and the number of asset choices m
+    n, m = Y.shape[0], A.shape[0]
+
+    # Calculate cash on hand (1 + r)a + y for each (s, a)
+    x = (1 + r) * A[None, :, 0] + Y[:, 0, None]
 
-    # Add the utilities to the continuation values, pick the maximum element for each row
-    # This resulty in an m*n x 1 vector of new values for the value function
-    # v_out = np.array(np.amax(U + b*W, axis=1), ndmin=2).transpose()
+    # If 1 + r is not positive, saving never pays, so everyone borrows as much as possible (consumption gets floored at
+    # c_min here and below, since there are states which cannot afford positive consumption for some r)
+    if 1 + r <= 0:
+        return np.ones((n, m)) * A[0, 0], np.maximum(x - A[0, 0], c_min)
 
-    # Reshape that vector into an n x m matrix, which is the new value function
-    # This does all three in one step
-    v_out = np.reshape(np.array(np.amax(U + b*np.repeat(P @ v_in, A.shape[0], axis=0),
-                       axis=1), ndmin=2).transpose(), v_0.shape)
+    # If there is no initial guess for the consumption function, start by consuming everything down to the borrowing
+    # limit
+    if c_0 is None:
+        c_in = np.maximum(x - A[0, 0], c_min)
+    else:
+        c_in = c_0
+
+    # Set up the policy function
+    g = np.zeros((n, m))
+
+    # Get the asset grid as regular floats, for the interpolation below
+    a_f = A[:, 0].astype(float)
+
+    # Set up a deviation which is definitely larger than the tolerance
+    dev = tol + 1
 
     # Count the iterations, to be able to stop if this takes too long to converge
     i = 1
-    while np.abs(np.amax(v_out - v_in)) > tol and i <= i_max_v:
-        v_in = v_out
+    while dev > tol and i <= i_max_c:
+        # Use the Euler equation to get current consumption for each income and choice of next period's assets (this is
+        # n x m, the (i, j) element refers to income i and asset choice j)
+        c_endo = u_c_inv(b * (1 + r) * (P @ u_c(c_in)))
 
-        # Calculate next-period continuation values, also as an m*n x m vector
-        # W = np.repeat(P @ v_in, A.shape[0], axis=0)
+        # Use the budget constraint to get the endogenous grid of current assets at which each choice is optimal (this
+        # needs to be a regular float, since np.interp doesn't handle long doubles, which r, A, and Y might be)
+        a_endo = ((c_endo + A[None, :, 0] - Y[:, 0, None]) / (1 + r)).astype(float)
 
-        # Get the new value function
-        # v_out = np.array(np.amax(U + b*W, axis=1), ndmin=2).transpose()
+        # Interpolate the policy function back onto the asset grid, for each income (below the first endogenous grid
+        # point, the borrowing limit binds, and above the last one, the policy is capped at the highest asset)
+        for s in range(n):
+            g[s, :] = np.interp(a_f, a_endo[s, :], a_f)
 
-        # Restack it
-        # This does all three in one step
-        # When iterating over excess demand later, increased precision might be helpful here
-        v_out = np.reshape(np.array(np.amax(U + b*np.repeat(P @ v_in, A.shape[0], axis=0),
-                           axis=1), ndmin=2).transpose(), v_0.shape).astype(np.longdouble)
+        # States which cannot afford positive consumption even at the borrowing limit get the same utility from any
+        # choice under crra(), so like in v_iter(), they pick the choice with the highest continuation value, which is
+        # the highest asset (otherwise, they would get stuck at the borrowing limit)
+        g[x - A[0, 0] <= 0] = A[-1, 0]
 
-        # If this is close enough, get the optimal policy function
-        if np.abs(np.amax(v_out - v_in)) <= tol and get_g:
-            # g = np.array(np.argmax(U + b*W, axis=1), ndmin=2).transpose()
-            # g = A[g]
+        # Get the implied consumption function
+        c_out = np.maximum(x - g, c_min)
 
-            # This does the previous two operations in one step, and restacks the result
-            g = np.reshape(A[np.array(np.argmax(U + b*np.repeat(P @ v_in, A.shape[0], axis=0), axis=1),
-                           ndmin=2).transpose()], v_0.shape)
+        # Calculate the deviation and update the consumption function
+        dev = np.amax(np.abs(c_out - c_in))
+        c_in = c_out
 
         # Increase iteration counter
         i += 1
 
     # If the maximum number of iterations was reached, print an error message
-    if i > i_max_v:
-        print('Value function failed to converge after', i_max_v, 'iterations', '\n',
-              'Deviation:', abs(np.amax(v_out - v_in)))
+    if i > i_max_c:
+        print('Consumption function failed to converge after', i_max_c, 'iterations', '\n', 'Deviation:', dev)
+
+    # Return the policy and consumption functions
+    return g, c_in
+
+
+# Define a function to set up the sparse transition matrix across (a, s), given the policy function
+# If the policy function is off the asset grid (e.g. from egm()), g_i should be the index of the closest grid point
+# below it, and g_w the weight on that grid point, with the rest going to the one above it (Young's (2010) lottery)
+# The matrix has n*m*n non-zero elements (twice that off the grid), i.e. memory use is linear in m but quadratic in n,
+# which for large grids is still a lot (at n = m = 1000, that's 10^9 elements), see find_L()
+def trans_mat(g_i, P, g_w=None):
+    # Get the number of incomes n and the number of asset choices m
+    n, m = g_i.shape
+
+    # Use 32 bit indices whenever they're large enough (for the row pointers, they have to go up to the number of
+    # non-zero elements), which saves a third of the memory
+    idx = np.int32 if 2 * n * m * n <= np.iinfo(np.int32).max else np.int64
+
+    # Row (i, j) of the transition matrix refers to income i and current asset j, which is row i*m + j once the (a, s)
+    # space is flattened
+    # Since g is deterministic, the only asset that can be reached from (i, j) is g_i[i, j], so the non-zero elements of
+    # that row are in columns k*m + g_i[i, j], for all next-period incomes k (in increasing order)
+    cols = np.arange(n, dtype=idx)[None, :] * m + g_i.reshape(n * m, 1).astype(idx)
+
+    # The probability of moving from (i, j) to (k, g_i[i, j]) is just P[i, k], which does not depend on j
+    vals = np.repeat(P, m, axis=0)
+
+    # If the policy function is off the grid, each row also gets the transitions to the grid point above, and the
+    # probabilities get split according to the weights
+    if g_w is not None:
+        cols = np.stack([cols, np.arange(n, dtype=idx)[None, :] * m
+                         + np.minimum(g_i + 1, m - 1).reshape(n * m, 1).astype(idx)], axis=2)
+        vals = np.stack([vals * g_w.reshape(n * m, 1), vals * (1 - g_w).reshape(n * m, 1)], axis=2)
+
+    # Every row has the same number of non-zero elements, so the CSR row pointers are just multiples of that, and the
+    # matrix can be set up directly, without a separate array of row indices
+    nnz_row = cols.size // (n * m)
+    P_X = csr_matrix((vals.reshape(-1), cols.reshape(-1), np.arange(0, cols.size + 1, nnz_row, dtype=idx)),
+                     shape=(n * m, n * m))
 
-    # Return the value function and, if desired, policy function
-    if get_g:
-        return v_out, g
+    # Off the grid, drop transitions with zero weight, and add up the two transitions to the top grid point, which
+    # happen if g_i is the top grid point already
+    if g_w is not None:
+        P_X.sum_duplicates()
+        P_X.eliminate_zeros()
+
+    # Return the transition matrix
+    return P_X
+
+
+# Define an error for when the stationary (a, s) distribution is not unique, which carries the number of stationary
+# distributions that were found and the associated eigenvalues, so whoever catches it can decide what to do
+class StationaryDistError(Exception):
+    def __init__(self, n_L, lam):
+        # Store the number of stationary distributions and the unit eigenvalues
+        self.n_L = n_L
+        self.lam = lam
+
+        # Set up the error message (usually this means m is too small, I believe)
+        super().__init__('There are ' + str(n_L) + ' stationary distributions across the (a, s) space')
+
+
+# Define a function that finds the stationary distribution of the transition matrix across (a, s), using one of several
+# iterative methods, all of which work without ever setting up a dense matrix
+# The methods are
+# 'arpack': Get the eigenvector associated with the unit eigenvalue of P_X' via ARPACK (this is the only one that can
+#           tell whether the stationary distribution is unique)
+# 'gmres': Solve (I - P_X')L = 0 via GMRES, replacing the last equation with the restriction that L sums to one
+# 'power': Power iteration, L_{t+1} = P_X' L_t
+# 'young': Young's (2010) histogram method, which pushes L forward using the policy indices and P directly, without
+#          setting up P_X at all
+# For policy functions which are off the asset grid, g_i and g_w work as in trans_mat()
+def stat_dist(g_i, P, method='arpack', tol=10**(-10), L_0=None, i_max_L=10000, g_w=None):
+    # Get the number of incomes n and the number of asset choices m
+    n, m = g_i.shape
+
+    # If there is no initial guess for the distribution, start from the uniform distribution; otherwise, flatten the
+    # initial guess (which might be a stationary distribution from a previous r) and make sure it sums to one
+    if L_0 is None:
+        L_in = np.ones(n * m) / (n * m)
     else:
-        return v_out
+        L_in = np.reshape(L_0, n * m).astype(float)
+        L_in /= L_in.sum()
+
+    # Check which method to use
+    if method == 'arpack':
+        # Get the two largest eigenvalues of P_X' and their eigenvectors (since P_X is a stochastic matrix, its largest
+        # eigenvalue is 1, and the second one is only there to be able to tell whether the stationary distribution is
+        # unique)
+        lam, L = eigs(trans_mat(g_i, P, g_w=g_w).transpose(), k=2, which='LM', v0=L_in, tol=tol)
+
+        # Check which eigenvalues are 1 (this is funky because of floating point issues)
+        unit = np.abs(lam - 1) <= np.maximum(tol, 10**(-10))
 
+        # Raise an error if the stationary distribution is not unique
+        if unit.sum() != 1:
+            raise StationaryDistError(n_L=unit.sum(), lam=lam[unit])
 
-# Define a function to find the stationary (a, s) distribution (luckily, this works with JIT)
-@jit
-def find_L(v, g, A, Y, P, X):
-    # Set up the transition matrix across (a, s) (note that Scipy's eigenvector algorithm doesn't accept high precision
-    # arrays (float64 / np.longdouble), so there isn't much that can be done here with precision, I think)
-    P_X = np.zeros(shape=(X.shape[0], X.shape[0]))
+        # Get the associated eigenvector, and divide by its sum, since this is a probability distribution
+        L_out = np.real(L[:, unit][:, 0])
+        L_out /= L_out.sum()
+    elif method == 'gmres':
+        # Set up I - P_X', and replace its last row by ones, since otherwise the system is singular
+        M = (identity(n * m, format='csr') - trans_mat(g_i, P, g_w=g_w).transpose()).tolil()
+        M[n * m - 1, :] = np.ones(n * m)
 
-    # Go through all elements of that transition matrix (obviously this is the major bottleneck of the whole script)
-    for ij in np.ndindex(P_X.shape):
-        # Fill in each element by checking whether the asset value it's mapping to is a' given (a, s), and multiplying
-        # that by the probability of ending up in s'
-        P_X[ij] = (g[X[ij[0]][0], X[ij[0]][1]] == A[X[ij[1]][1], 0]) * P[X[ij[0]][0], X[ij[1]][0]]
+        # The right hand side is all zeros, except for the last element, which makes L sum to one
+        e = np.zeros(n * m)
+        e[n * m - 1] = 1
 
-    # Calculate ergodic distribution of transition matrix
-    # First get the eigenvectors, then check which one is associated with the unit eigenvalue
-    # Checking which eigenvalue is 1 is funky because of floating point issues
-    L = sp.linalg.eig(P_X.transpose())[1][:, np.abs(np.linalg.eig(P_X.transpose())[0] - 1) <= 10**(-10)]
+        # Solve the system, starting from the initial guess
+        L_out, info = gmres(M.tocsr(), e, x0=L_in, rtol=tol, maxiter=i_max_L)
 
-    # Divide by the sum of the eigenvalues, since this is a probability distribution
-    L /= L.sum(axis=0)
+        # Print a warning if this did not converge
+        if info != 0:
+            print('GMRES failed to converge for the stationary distribution', '\n', 'Info:', info)
+    elif method in ['power', 'young']:
+        # For power iteration, the transition matrix is needed (transposed, since L is pushed forward)
+        if method == 'power':
+            P_X_T = trans_mat(g_i, P, g_w=g_w).transpose().tocsr()
 
-    # Print a warning if the stationary distribution is not unique (usually that means m is too small, I believe)
-    # Also stop the program, because this'll really mess things up once we start looking at excess demand and all that
-    if L.shape[1] > 1:
-        print('Warning: There is more than one stationary distribution across the (a, s) space', '\n',
-              'Stopping program')
-        exit()
+        # For the histogram method, get the flat index of the asset each (a, s) tuple moves to, within its current
+        # income state, to be able to add up mass at each a' via np.bincount
+        else:
+            g_flat = (np.arange(n)[:, None] * m + g_i).reshape(n * m)
+
+            # If the policy function is off the grid, the rest of the mass goes to the next grid point
+            if g_w is not None:
+                g_flat = np.concatenate([g_flat,
+                                         (np.arange(n)[:, None] * m + np.minimum(g_i + 1, m - 1)).reshape(n * m)])
+
+        # Set up a deviation which is definitely larger than the tolerance
+        dev = tol + 1
+
+        # Count the iterations, to be able to stop if this takes too long to converge
+        i = 1
+        while dev > tol and i <= i_max_L:
+            if method == 'power':
+                # Push the distribution forward one period
+                L_out = P_X_T @ L_in
+            else:
+                # Move mass at (a, s) to (g(a, s), s), and then from s to s' using P, i.e. L'(a', s') is the sum over s
+                # of P[s, s'] times the mass that chose a' in state s
+                if g_w is None:
+                    L_g = np.bincount(g_flat, weights=L_in, minlength=n * m)
+                else:
+                    L_g = np.bincount(g_flat, weights=np.concatenate([L_in * g_w.reshape(n * m),
+                                                                      L_in * (1 - g_w).reshape(n * m)]),
+                                      minlength=n * m)
+                L_out = (P.transpose() @ L_g.reshape(n, m)).reshape(n * m)
+
+            # Calculate the deviation and update the distribution
+            dev = np.amax(np.abs(L_out - L_in))
+            L_in = L_out
+
+            # Increase iteration counter
+            i += 1
+
+        # If the maximum number of iterations was reached, print an error message
+        if i > i_max_L:
+            print('Stationary distribution failed to converge after', i_max_L, 'iterations', '\n', 'Deviation:', dev)
+    else:
+        # Raise an error if the method is not recognized
+        raise ValueError('Stationary distribution method ' + str(method) + ' not recognized')
 
     # Reshape L so that the (i, j) element refers to state i and asset choice j
-    L = np.reshape(L, g.shape)
+    return np.reshape(L_out, (n, m))
+
+
+# Define a function to find the stationary (a, s) distribution
+# If the transition matrix would have more than nnz_max non-zero elements (see trans_mat()), this uses the histogram
+# method ('young') instead of the requested one, since that never sets up the matrix (but it also can't tell whether
+# the stationary distribution is unique)
+def find_L(v, g, A, Y, P, method='arpack', tol=10**(-10), L_0=None, nnz_max=5*10**7):
+    # Get the number of incomes n and the number of asset choices m
+    n, m = P.shape[0], A.shape[0]
+
+    # Get the policy function as indices on the asset grid (if g only contains elements of A, this recovers the argmax
+    # indices from v_iter exactly)
+    g_i = np.searchsorted(A[:, 0], g)
+
+    # Check whether the policy function is on the grid
+    if np.all(A[np.minimum(g_i, m - 1), 0] == g):
+        # If so, everyone moves to exactly one asset
+        g_w = None
+    else:
+        # Otherwise, get the closest grid point below the policy function (capped at m - 2, so there is always a grid
+        # point above it), and the weight on that point, which makes the expected asset choice equal to g
+        g_i = np.minimum(np.maximum(g_i - 1, 0), m - 2)
+        g_w = ((A[g_i + 1, 0] - g) / (A[g_i + 1, 0] - A[g_i, 0])).astype(float)
+
+    # The distribution is always calculated in regular floats, whatever precision the household problem was solved in
+    # (ARPACK doesn't handle long doubles), and the rows of P get normalized again, since after rounding P to single
+    # precision, they are off by more than the tolerance for the unit eigenvalue
+    P = P.astype(float)
+    P /= np.sum(P, axis=1, keepdims=True)
+
+    # Switch to the histogram method if the transition matrix would be too large (off the grid, it has twice as many
+    # non-zero elements)
+    if method != 'young' and n * m * n * (1 if g_w is None else 2) > nnz_max:
+        method = 'young'
+
+    # Calculate the ergodic distribution of the transition matrix across (a, s), which is set up as a sparse matrix or
+    # not at all, depending on the method (it used to be a dense matrix filled in element by element, which was
+    # obviously the major bottleneck of the whole script); note that this raises a StationaryDistError if the
+    # stationary distribution is not unique
+    L = stat_dist(g_i, P, method=method, tol=tol, L_0=L_0, g_w=g_w)
 
     # Return the stationary distribution across (a, s) tuples
     return L
 
 # Define CRRA utility
-def crra(c, g=4, u_inada=-10**10):
-    # Set up utility matrix (when iterating over excess demand later, higher precision might be helpful here)
-    u = np.zeros_like(c, dtype=np.longdouble)
+# If out is provided, utility gets written into it, so no new arrays get allocated other than a mask for positive
+# consumption (this used to set up several masks and copies of c)
+def crra(c, g=4, u_inada=-10**10, out=None):
+    # Set up utility matrix, with the same precision as consumption (but at least a float)
+    if out is None:
+        out = np.empty(np.shape(c), dtype=np.result_type(c, 1.0))
 
-    # Calculate utlity for positive consumption values
-    u[c!=0] = (c[c!=0]**(1 - g) - 1) / (1 - g)
+    # Figure out where consumption is positive
+    pos = np.greater(c, 0)
+
+    # Calculate utlity for positive consumption values (Numpy may still evaluate the other elements along the way and
+    # complain about them, even though those results get thrown away, so ignore that)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.power(c, 1 - g, out=out, where=pos)
+        np.subtract(out, 1, out=out, where=pos)
+        np.divide(out, 1 - g, out=out, where=pos)
 
     # To almost preserve Inada conditions, replace utility for 0 and negative consumption with a large negative number
-    u[c<=0] = u_inada
+    np.copyto(out, u_inada, where=~pos)
 
     # Return utility matrix
-    return u
+    return out
 
-# Set beta
-b = .96
+# Define the same CRRA utility as a compiled Numba ufunc, which does everything in a single pass over c without any
+# masks (Numba doesn't do long doubles, so this is for regular floats only)
+@vectorize(['float64(float64, float64, float64)'], nopython=True)
+def crra_ufunc(c, g, u_inada):
+    # Calculate utility for positive consumption, and use u_inada otherwise
+    if c > 0:
+        return (c**(1 - g) - 1) / (1 - g)
+    else:
+        return u_inada
 
-# Set lower and upper limits for r (these better contain the equilibrium interest rate)
-r_l = -5
-r_h = 5
+# Define a wrapper for the ufunc, which works like crra() (so it can be passed to v_iter() as u)
+def crra_nb(c, g=4, u_inada=-10**10, out=None):
+    # Call the ufunc (which can also write into out)
+    if out is None:
+        return crra_ufunc(c, g, u_inada)
+    else:
+        return crra_ufunc(c, g, u_inada, out=out)
 
-# Make an initial guess for r
-r = (r_h + r_l) / 2
+# Define CRRA marginal utility (this and its inverse are needed for the endogenous grid method)
+def crra_mu(c, g=4):
+    # Return marginal utility
+    return c**(-g)
 
-# Create a space of incomes
-n = 100  # Number of different values of income
-y_1 = .1  # Lowest possible income
-y_n = 1  # Highest possible income
-Y = np.array(np.linspace(y_1, y_n, num=n), ndmin=2).transpose()  # Column vector of incomes
+# Define the inverse of CRRA marginal utility
+def crra_mu_inv(mu, g=4):
+    # Return the consumption level which has marginal utility mu
+    return mu**(-1 / g)
 
-# Create a space of asset holdings
-m = 200  # Number of asset choices
-phi = y_1 / (1 - b)  # Borrowing limit; y_1 / (1 - b) is a 'natural' limit in the Ljungqvist & Sargent sense
-a_m = 4  # Highest possible asset value
-A = np.array(np.linspace(-phi, a_m, num=m).transpose(), ndmin=2).transpose()  # Column vector of asset choices
+# Set up the precisions the household problem can be solved in (see solve_equilibrium() and the table below)
+dtypes = {'float32': np.float32, 'float64': np.float64, 'longdouble': np.longdouble}
 
-# Set seed for random variables
-np.random.seed(seed=8675309)
+# Define a function that solves for the equilibrium interest rate of the economy described by params, a dictionary which
+# needs to contain beta ('b'), the income grid ('Y', n x 1), the asset grid ('A', m x 1), and the income transition
+# matrix ('P', n x n), and can contain any of the following (with the defaults used for them):
+# 'g': Coefficient of relative risk aversion for crra() (4)
+# 'r_l', 'r_h': Lower and upper limits for r, which better contain the equilibrium interest rate (-5 and 5)
+# 'r': Initial guess for r (the midpoint between r_l and r_h)
+# 'dr': If this is provided, the first step away from the initial guess moves r by dr, in the direction excess demand
+#       points to, instead of bisecting [r_l, r_h] (which is what makes a warm start from a nearby economy's r useful)
+# 'prec': Precision the household problem is solved in, 'float32', 'float64', or 'longdouble' ('float64', see the
+#         speed/accuracy table below)
+# 'polish': Whether to polish r in long doubles once it has been found in that precision (True)
+# 'hh_solver': Household solver, 'vfi' or 'egm' ('vfi')
+# 'kernel': Kernel for the maximization step in v_iter(), 'numpy' or 'numba' ('numpy')
+# 'tol_e', 'tol_e_p': Tolerance for excess demand, and the tighter one used for polishing (.001 and 10**(-6))
+# 'i_max_e': Maximum number of iterations for each stage (100)
+# The initial guesses for the value function (v_0, n x m, zeros if it isn't provided), consumption function (c_0), and
+# stationary distribution (L_0) can come from a previous solution, and buf works as in v_iter()
+# This returns a dictionary containing the interest rate with the lowest excess demand (in absolute terms) the search
+# came across ('r'), that excess demand ('e'), whether it is within tolerance ('conv'), the number of iterations it took
+# across all stages ('i'), and the value function ('v', None for EGM), policy function ('g'), consumption function ('c',
+# None for VFI), and stationary distribution ('L') at that interest rate
+def solve_equilibrium(params, v_0=None, c_0=None, L_0=None, buf=None, verbose=True):
+    # Get beta and the grids
+    b, Y, A, P = params['b'], params['Y'], params['A'], params['P']
 
-# Create a transition matrix with strictly positive transition propabilites
-# This is totally random; a more structured setup would probably generate more interesting results?
-P = uniform().rvs(size=(n, n))
+    # Get everything else, using the defaults if it isn't specified
+    g_u = params.get('g', 4)
+    r_l = params.get('r_l', -5)
+    r_h = params.get('r_h', 5)
+    r = params.get('r', (r_h + r_l) / 2)
+    dr = params.get('dr', None)
+    prec = params.get('prec', 'float64')
+    polish = params.get('polish', True)
+    hh_solver = params.get('hh_solver', 'vfi')
+    kernel = params.get('kernel', 'numpy')
+    tol_e = params.get('tol_e', .001)
+    tol_e_p = params.get('tol_e_p', 10**(-6))
+    i_max_e = params.get('i_max_e', 100)
 
-# This is how the transition probabilites are always positive
-while np.count_nonzero(P) - n**2 != 0:
-    P = uniform().rvs(size=(n, n))
+    # Check whether the household solver and precision are recognized
+    if hh_solver not in ['vfi', 'egm']:
+        raise ValueError('Household solver ' + str(hh_solver) + ' not recognized')
+    if prec not in dtypes:
+        raise ValueError('Precision ' + str(prec) + ' not recognized')
 
-# Make sure the rows of P sum up to one
-P *= np.sum(P, axis=1, keepdims=True)**(-1)
+    # Set up the utility function (and, for EGM, marginal utility and its inverse) for this coefficient of relative
+    # risk aversion
+    u = partial(crra, g=g_u)
+    u_c = partial(crra_mu, g=g_u)
+    u_c_inv = partial(crra_mu_inv, g=g_u)
 
-# Make an initial guess for the value function
-v_0 = uniform().rvs(size=(n, m)) * 30
+    # Start from the initial guess for r and the value function (if there is no initial guess for the consumption
+    # function or the stationary distribution, egm() and find_L() use their own)
+    r_2 = r
+    v = np.zeros((Y.shape[0], A.shape[0])) if v_0 is None else v_0
+    c = c_0
+    L = L_0
 
-# Find the value and policy functions
-v, g = v_iter(r=r, b=b, u=crra, P=P, A=A, Y=Y, v_0=v_0)
+    # Count the iterations across all stages
+    i_e = 0
 
-# Make an n*m x 2 matrix of the indices of all (a, s) combinations in their respective source vectors
-# Note that the first column is the index of s, the second column that of a
-# So X[i, :] = (j(s_j), l(a_l))
-# The reason this doesn't happen in the find_L function is that Numba doesn't currently support list creation, and it
-# seemed that having this X thing outside the function was a small price to pay for JIT compilation
-X = np.array([ij for ij in np.ndindex(Y.shape[0], A.shape[0])])
+    # There is no solution yet (this keeps the one with the lowest excess demand in absolute terms, since on a coarse
+    # grid, excess demand jumps around the equilibrium, so the last interest rate that was tried is not necessarily the
+    # best one)
+    eq = None
 
-# Find the (a, s) distribution lambda
-L = find_L(v=v, g=g, A=A, Y=Y, P=P, X=X)
+    # Go through the precision stages, first the chosen precision, and then long doubles for polishing, if desired
+    for stage in [prec] + (['longdouble'] if polish and prec != 'longdouble' else []):
+        # Get the type for this stage
+        dtype = dtypes[stage]
 
-# Calculate excess demand
-e = (L * g).sum()
+        # Cast everything to that type (after the first stage, this starts from the interest rate, bounds, and value or
+        # consumption function the preceding stage ended up with)
+        Y, A, P = (x.astype(dtype) for x in [Y, A, P])
+        r_l, r_h, r_2 = dtype(r_l), dtype(r_h), dtype(r_2)
+        if v is not None:
+            v = v.astype(dtype)
+        if c is not None:
+            c = c.astype(dtype)
 
-# Set a tolerance level for excess demand
-tol_e = .001
+        # Find the value and policy functions
+        if hh_solver == 'egm':
+            g, c = egm(r=r_2, b=b, u_c=u_c, u_c_inv=u_c_inv, P=P, A=A, Y=Y, c_0=c)
+            v = None
+        else:
+            v, g = v_iter(r=r_2, b=b, u=u, P=P, A=A, Y=Y, v_0=v, buf=buf, kernel=kernel)
 
-# Set up a maximum number of iterations and a counter for those iterations
-i_max_e = 100
-i = 1
+        # Find the (a, s) distribution lambda
+        L = find_L(v=v, g=g, A=A, Y=Y, P=P, L_0=L)
 
-# Throughout this loop there will be two values for the interest rate, that calculated during the preceding iteration
-# (r_1), and the new value (r_2)
-r_1 = r_2 = r
+        # Calculate excess demand
+        e = (L * g).sum()
 
-# If e isn't zero (and it most likely won't be), repeat the process until it is within tolerance, unless the interest
-# rate stops converging because it hits its precision maximum, in which case reiterating this loop makes no sense
-# since excess demand will not continue to converge
-while np.abs(e) > tol_e and (np.longdouble(r_1 - r_2) != 0 or i == 1) and i <= i_max_e:
-    # Update interest rate from preceding iteration
-    r_1 = r_2
+        # Keep the solution if it is the best one so far
+        if eq is None or np.abs(e) < np.abs(eq['e']):
+            eq = {'r': r_2, 'e': e, 'v': v, 'g': g, 'c': c, 'L': L}
 
-    # Update interest rate bounds in accordance with excess demand
-    if e < 0:
-        r_l = np.longdouble(r_1)
-    else:
-        r_h = np.longdouble(r_1)
+        # Get the tolerance for this stage, and reset the iteration counter
+        tol = tol_e if stage == prec else tol_e_p
+        i = 1
+
+        # Throughout this loop there will be two values for the interest rate, that calculated during the preceding
+        # iteration (r_1), and the new value (r_2); to be able to take secant steps, it also keeps the interest rate
+        # from the iteration before that (r_0) and excess demand at r_0 and r_1 (which starts out empty, since there is
+        # no such iteration yet)
+        r_1 = r_2
+        e_1 = None
+
+        # If e isn't zero (and it most likely won't be), repeat the process until it is within tolerance, unless the
+        # interest rate stops converging because it hits its precision maximum, in which case reiterating this loop
+        # makes no sense since excess demand will not continue to converge
+        while np.abs(e) > tol and (dtype(r_1 - r_2) != 0 or i == 1) and i <= i_max_e:
+            # Update interest rates and excess demand from preceding iterations
+            r_0, e_0 = r_1, e_1
+            r_1, e_1 = r_2, e
+
+            # Update interest rate bounds in accordance with excess demand
+            if e_1 < 0:
+                r_l = dtype(r_1)
+            else:
+                r_h = dtype(r_1)
+
+            # Update interest rate (using higher precision gives you a lot more digits to play with untill excess
+            # demand stops getting closer to zero, which is what the long double stage is for)
+            # Use a secant step through the last two interest rates if there are two of them, since that converges a
+            # lot faster than bisection, but fall back to bisection if the secant step isn't available or lands outside
+            # the bounds (which still contain the equilibrium interest rate, so the bounds keep shrinking either way)
+            # For the very first step, the secant step isn't available yet, but if dr is provided, moving r by that
+            # much (down if there is too much saving, up otherwise) sets it up without throwing away a good guess
+            if e_0 is not None and e_1 != e_0:
+                r_2 = dtype(r_1 - e_1 * (r_1 - r_0) / (e_1 - e_0))
+            elif e_0 is None and dr is not None and stage == prec:
+                r_2 = dtype(r_1 - np.sign(e_1) * dr)
+            if (e_0 is None and (dr is None or stage != prec)) or e_1 == e_0 or not r_l < r_2 < r_h:
+                r_2 = dtype((r_h + r_l) / 2)
+
+            # Find the value and policy functions, starting from the value (or consumption) function for the preceding
+            # interest rate, which is a much better guess than v_0 once the interest rate has settled down a bit
+            if hh_solver == 'egm':
+                g, c = egm(r=r_2, b=b, u_c=u_c, u_c_inv=u_c_inv, P=P, A=A, Y=Y, c_0=c)
+            else:
+                v, g = v_iter(r=r_2, b=b, u=u, P=P, A=A, Y=Y, v_0=v, buf=buf, kernel=kernel)
+
+            # Find lambda, starting from the preceding stationary distribution
+            L = find_L(v=v, g=g, A=A, Y=Y, P=P, L_0=L)
+
+            # Calculate excess demand
+            e = (L * g).sum()
+
+            # Keep the solution if it is the best one so far
+            if np.abs(e) < np.abs(eq['e']):
+                eq = {'r': r_2, 'e': e, 'v': v, 'g': g, 'c': c, 'L': L}
+
+            # If iterations exceed the maximum, print the remaining excess demand
+            if i >= i_max_e and verbose:
+                print('Excess demand failed to converge after', i_max_e, 'iterations', '\n',
+                      'Deviation:', e, '\n', 'Interest rate:', r_2)
+
+            # If the interest rate reaches its precision boundary, print its current value
+            if dtype(r_1 - r_2) == 0 and verbose:
+                print('Note: Interest rate reached maximum precision at', r_2, '(' + stage + ')', '\n',
+                      'Remaining excess demand:', e)
+
+            # Increase iteration counters
+            i += 1
+            i_e += 1
+
+        # Print the equilibrium interest rate, in case the loop before didn't stop prematurely
+        if i <= i_max_e and (dtype(r_1 - r_2) != 0 or i == 1) and verbose:
+            print('Equilibrium interest rate (' + stage + '):', r_2)
+
+    # Return the best solution, which has everything needed to warm start a nearby economy, along with whether it is
+    # within tolerance and the number of iterations
+    return dict(eq, conv=np.abs(eq['e']) <= tol_e, i=i_e)
+
+
+# Everything below only runs if this is run as a script, so the functions above can be imported (e.g. by
+# huggett_batch.py, which solves many economies in parallel) without solving this one
+if __name__ == '__main__':
+    # Set beta
+    b = .96
+
+    # Set lower and upper limits for r (these better contain the equilibrium interest rate)
+    r_l = -5
+    r_h = 5
+
+    # Make an initial guess for r
+    r = (r_h + r_l) / 2
+
+    # Create a space of incomes
+    n = 100  # Number of different values of income
+    y_1 = .1  # Lowest possible income
+    y_n = 1  # Highest possible income
+    Y = np.array(np.linspace(y_1, y_n, num=n), ndmin=2).transpose()  # Column vector of incomes
+
+    # Create a space of asset holdings
+    m = 200  # Number of asset choices
+    phi = y_1 / (1 - b)  # Borrowing limit; y_1 / (1 - b) is a 'natural' limit in the Ljungqvist & Sargent sense
+    a_m = 4  # Highest possible asset value
+    A = np.array(np.linspace(-phi, a_m, num=m).transpose(), ndmin=2).transpose()  # Column vector of asset choices
+
+    # Set seed for random variables
+    np.random.seed(seed=8675309)
+
+    # Create a transition matrix with strictly positive transition propabilites
+    # This is totally random; a more structured setup would probably generate more interesting results?
+    P = uniform().rvs(size=(n, n))
+
+    # This is how the transition probabilites are always positive
+    while np.count_nonzero(P) - n**2 != 0:
+        P = uniform().rvs(size=(n, n))
+
+    # Make sure the rows of P sum up to one
+    P *= np.sum(P, axis=1, keepdims=True)**(-1)
+
+    # Make an initial guess for the value function
+    v_0 = uniform().rvs(size=(n, m)) * 30
+
+    # Specify the precision the household problem is solved in, 'float32', 'float64', or 'longdouble' (everything in
+    # v_iter() and egm() follows the precision of r, A, Y, P, and the initial guesses, while the stationary
+    # distribution is always calculated in regular floats, see find_L())
+    # Long doubles have no BLAS support, so P @ v falls back to a much slower loop (and everything else moves around
+    # more memory), while single precision is fast but only resolves the value function to about v_iter()'s tolerance,
+    # so regular floats are the default, and long doubles are only used to polish r at the end (see polish below)
+    # For the setup below, this is how long v_iter() takes from v_0 at r = 0, how far its solution is from the long
+    # double one, and what solve_equilibrium() finds for r without polishing, which takes 10, 17, and 66 seconds in
+    # total (EGM from scratch takes .06, .08, and 2.3 seconds, and its policy function is off by 2.4e-7 and 8.9e-16 in
+    # single and double precision):
+    # | prec       | solve (s) | sweep (s) | P @ v (ms) | max |v - v_ld| | g mismatches | equilibrium r          |
+    # | float32    | .99       | .0050     | .038       | 1.9e-3         | 3 of 20000   | .029401865             |
+    # | float64    | 1.84      | .0094     | .10        | 1.3e-12        | 0            | .029384799782210605    |
+    # | longdouble | 7.53      | .0384     | 6.9        | 0              | 0            | .029384799782210613929 |
+    prec = 'float64'
+
+    # Specify whether to polish the equilibrium interest rate in long doubles, once it has been found in the precision
+    # above (this continues from the bounds for r found in that precision, with a tighter tolerance for excess demand,
+    # so it only takes a couple of extra solves; for float64 and the setup above, this takes 51 seconds in total, and
+    # gets excess demand down from 5.8e-4 to 8.4e-6)
+    polish = True
+
+    # Cast everything the household problem uses to the chosen precision for the benchmark below (solve_equilibrium()
+    # does this on its own; the random draws above are always made in regular floats, so the model is the same
+    # regardless of precision)
+    Y, A, P, v_0 = (x.astype(dtypes[prec]) for x in [Y, A, P, v_0])
+    r = dtypes[prec](r)
+
+    # Specify whether to benchmark the value function iteration methods against each other before solving the model
+    bench_v = False
+
+    # Check whether to run the benchmark
+    if bench_v:
+        # Go through all methods (plain VFI, VFI with MacQueen-Porteus bounds, and modified policy iteration with and
+        # without them)
+        for method, mqp in [('vfi', False), ('vfi', True), ('mpi', False), ('mpi', True)]:
+            # Record the time this started
+            time_start = time.time()
 
-    # Update interest rate (using higher precision gives you a lot more digits to play with untill excess demand stops
-    # getting closer to zero)
-    r_2 = np.longdouble((r_h + r_l) / 2)
+            # Find the value and policy functions
+            _, _, i_v = v_iter(r=r, b=b, u=crra, P=P, A=A, Y=Y, v_0=v_0, method=method, mqp=mqp, get_i=True)
 
-    # Find the value and policy functions
-    v, g = v_iter(r=r_2, b=b, u=crra, P=P, A=A, Y=Y, v_0=v_0)
+            # Display the number of maximization steps and the time it took
+            print('Method:', method, '| MacQueen-Porteus bounds:', mqp, '| Sweeps:', i_v,
+                  '| Time elapsed:', np.around(time.time() - time_start, 4), 'seconds')
 
-    # Create the X vector
-    X = np.array([ij for ij in np.ndindex(Y.shape[0], A.shape[0])])
+    # Specify which household solver to use, 'vfi' for value function iteration, or 'egm' for the endogenous grid
+    # method (which gives a continuous policy function, so there is no value function, and the initial guess for the
+    # next r is the consumption function c instead)
+    hh_solver = 'vfi'
 
-    # Find lambda
-    L = find_L(v=v, g=g, A=A, Y=Y, P=P, X=X)
+    # Specify which kernel value function iteration uses for the maximization step, 'numpy' or 'numba' (which runs on
+    # all cores and gives exactly the same results, see bellman_nb())
+    kernel = 'numba'
 
-    # Calculate excess demand
-    e = (L * g).sum()
+    # Set up a dictionary for the buffers v_iter() uses to calculate utilities, which get reused for every r
+    buf = {}
 
-    # If iterations exceed the maximum, print the remaining excess demand
-    if i >= i_max_e:
-        print('Excess demand failed to converge after', i_max_e, 'iterations', '\n',
-              'Deviation:', e, '\n', 'Interest rate:', r_2)
+    # Set a tolerance level for excess demand, and a tighter one for polishing the interest rate
+    tol_e = .001
+    tol_e_p = 10**(-6)
 
-    # If the interest rate reaches its precision boundary, print its current value
-    if np.longdouble(r_1 - r_2) == 0:
-        print('Note: Interest rate reached maximum precision at', r_2, '\n', 'Remaining excess demand:', e)
+    # Set up a maximum number of iterations
+    i_max_e = 100
 
-    # Increase iteration counter
-    i += 1
+    # Put all of that together
+    params = {'b': b, 'Y': Y, 'A': A, 'P': P, 'r_l': r_l, 'r_h': r_h, 'r': r, 'prec': prec, 'polish': polish,
+              'hh_solver': hh_solver, 'kernel': kernel, 'tol_e': tol_e, 'tol_e_p': tol_e_p, 'i_max_e': i_max_e}
 
-# Print the equilibrium interest rate, in case the loop before didn't stop prematurely
-if i <= i_max_e and np.longdouble(r_1 - r_2) != 0:
-    print('Equilibrium interest rate:', r_2)
+    # Solve for the equilibrium interest rate
+    eq = solve_equilibrium(params, v_0=v_0, buf=buf)
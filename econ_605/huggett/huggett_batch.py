@@ -0,0 +1,240 @@
+import numba
+import numpy as np
+import time
+from concurrent.futures import ProcessPoolExecutor
+from huggett import solve_equilibrium
+from multiprocessing import cpu_count, get_context
+from multiprocessing.shared_memory import SharedMemory
+from os import makedirs, path
+from queue import Empty
+from scipy.stats import uniform
+
+
+# Define a function that sets up a grid of parameters as a list of dictionaries (one for each economy), given lists of
+# values for any number of parameters, e.g. param_grid(b=[.95, .96], g=[2, 4])
+# The points are ordered like a snake, i.e. the values of each parameter run forwards and backwards in turns, so
+# consecutive points only ever differ in one parameter, by one step, which is what makes warm starts from the preceding
+# point useful
+def param_grid(**axes):
+    # Start with a single point that doesn't set anything
+    points = [{}]
+
+    # Go through all parameters, and combine every existing point with each of their values
+    for key, vals in axes.items():
+        # Flip the order of the values for every other existing point
+        points = [dict(p, **{key: x}) for j, p in enumerate(points) for x in (vals if j % 2 == 0 else vals[::-1])]
+
+    # Return the list of points
+    return points
+
+
+# Define a function that puts arrays (given as a dictionary) into shared memory, so that worker processes can use them
+# without each getting their own copy
+# This returns the shared memory blocks (which need to be closed and unlinked by whoever set them up, once they are no
+# longer needed) and a dictionary with the name, shape, and type of each array, which is all a worker needs to find it
+def share(arrays):
+    # Set up dictionaries for the blocks and their descriptions
+    shm = {}
+    meta = {}
+
+    # Go through all arrays
+    for key, x in arrays.items():
+        # Set up a block of shared memory of the same size (at least one byte, since empty blocks aren't allowed)
+        x = np.ascontiguousarray(x)
+        shm[key] = SharedMemory(create=True, size=max(x.nbytes, 1))
+
+        # Copy the array into it
+        np.ndarray(x.shape, dtype=x.dtype, buffer=shm[key].buf)[...] = x
+
+        # Store the description
+        meta[key] = (shm[key].name, x.shape, x.dtype.str)
+
+    # Return the blocks and their descriptions
+    return shm, meta
+
+
+# Set up the things each worker process gets from init_worker(), i.e. the shared memory blocks (which need to stay
+# around as long as the arrays using them), the arrays themselves, and the queue results get sent back through
+shm_w = {}
+arrays_w = {}
+queue_w = []
+
+
+# Define a function that sets up a worker process, by attaching to the shared arrays described in meta (see share()),
+# storing the results queue, and setting the number of threads Numba uses in that process (with one process per core,
+# this should usually be one, since otherwise the processes compete for cores)
+def init_worker(meta, queue, n_threads):
+    # Attach to each shared array
+    for key, (name, shape, dtype) in meta.items():
+        shm_w[key] = SharedMemory(name=name)
+        arrays_w[key] = np.ndarray(shape, dtype=dtype, buffer=shm_w[key].buf)
+
+    # Store the queue
+    queue_w.append(queue)
+
+    # Set the number of threads
+    numba.set_num_threads(min(n_threads, numba.config.NUMBA_NUM_THREADS))
+
+
+# Define a function that solves a chain of economies one after the other, inside a worker process, where chain is a list
+# of (index, parameters) tuples, and the parameters get added to (or replace) the shared arrays to get the params
+# argument for solve_equilibrium()
+# Each economy starts from the interest rate, value (or consumption) function, and stationary distribution of the
+# preceding one, with an initial step of dr for the interest rate, unless the grids don't match or the preceding one
+# failed; each result gets put into the queue as soon as it is done, as an (index, result, error) tuple
+def solve_chain(chain, dr=.01, keep=('g', 'L')):
+    # Set up the buffers v_iter() uses, which get reused for all economies with the same grid
+    buf = {}
+
+    # There is no preceding solution yet
+    eq_0 = None
+
+    # Go through all economies
+    for k, point in chain:
+        # Put together the parameters
+        params = dict(arrays_w, **point)
+
+        # Record the time this started
+        time_start = time.time()
+
+        # Solve the model, starting from the preceding solution if it fits this economy's grids (failures get sent
+        # back instead of bringing down the whole chain)
+        try:
+            if eq_0 is not None and eq_0['g'].shape == (params['Y'].shape[0], params['A'].shape[0]):
+                params.setdefault('r', eq_0['r'])
+                params.setdefault('dr', dr)
+                eq = solve_equilibrium(params, v_0=eq_0['v'], c_0=eq_0['c'], L_0=eq_0['L'], buf=buf, verbose=False)
+            else:
+                eq = solve_equilibrium(params, buf=buf, verbose=False)
+        except Exception as err:
+            queue_w[0].put((k, None, repr(err)))
+            eq_0 = None
+            continue
+
+        # Send back the interest rate, excess demand, convergence flag, iterations, time, and the arrays that should be
+        # kept
+        res = {'r': eq['r'], 'e': eq['e'], 'conv': eq['conv'], 'i': eq['i'], 'time': time.time() - time_start}
+        res.update({key: eq[key] for key in keep if eq[key] is not None})
+        queue_w[0].put((k, res, None))
+
+        # Keep the solution for the next economy
+        eq_0 = eq
+
+
+# Define a function that solves the model for all economies in points (a list of dictionaries of parameters, like the
+# ones param_grid() sets up) in parallel, with n_jobs processes (all cores by default), where shared is a dictionary of
+# parameters which are the same for all economies (usually the arrays 'Y', 'A', and 'P', which go into shared memory,
+# and solver settings like 'kernel', which just get added to each economy's parameters)
+# The points get split into contiguous chains, one for each process, and each process warm starts every economy from the
+# preceding one in its chain (see solve_chain()), so points should be ordered such that neighbours are similar
+# Results get written to out_dir as they come in: summary.csv gets a line for each economy (its index, the scalar
+# parameters, r, excess demand, whether it converged, the number of iterations, the time it took, and an error
+# message, if it failed), and point_k.npz stores the arrays in keep for economy k
+# This returns the summary as a list of dictionaries, in the same order as points
+def solve_batch(points, shared, out_dir, n_jobs=None, n_threads=1, dr=.01, keep=('g', 'L')):
+    # Use all cores if the number of processes isn't specified, but never more processes than economies
+    if n_jobs is None:
+        n_jobs = cpu_count()
+    n_jobs = max(min(n_jobs, len(points)), 1)
+
+    # Make sure the output directory exists
+    makedirs(out_dir, exist_ok=True)
+
+    # Separate the shared arrays from the shared settings
+    arrays = {key: x for key, x in shared.items() if np.ndim(x) > 0}
+    settings = {key: x for key, x in shared.items() if np.ndim(x) == 0}
+
+    # Split the economies into contiguous chains
+    chains = [[(int(k), dict(settings, **points[k])) for k in ks]
+              for ks in np.array_split(np.arange(len(points)), n_jobs) if len(ks) > 0]
+
+    # Get the scalar parameters, which go into the summary
+    cols = [key for key in dict.fromkeys(key for p in points for key in p) if all(np.ndim(p.get(key)) == 0
+                                                                                   for p in points)]
+
+    # Set up the summary
+    summary = [None] * len(points)
+
+    # Put the shared arrays into shared memory (worker processes get started fresh instead of being forked, which is
+    # safer with Numba's threads around, so they need to be able to find them)
+    shm, meta = share(arrays)
+    ctx = get_context('spawn')
+    queue = ctx.Queue()
+    try:
+        # Open the summary file, and write the header
+        with open(path.join(out_dir, 'summary.csv'), 'w') as f:
+            f.write(','.join(['k'] + cols + ['r', 'e', 'conv', 'i', 'time', 'error']) + '\n')
+            f.flush()
+
+            # Start the worker processes, and hand each of them a chain
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=ctx, initializer=init_worker,
+                                     initargs=(meta, queue, n_threads)) as pool:
+                futures = [pool.submit(solve_chain, chain, dr, keep) for chain in chains]
+
+                # Collect results until there is one for each economy
+                n_done = 0
+                while n_done < len(points):
+                    # Wait for the next result, but check every now and then whether any of the processes crashed,
+                    # since then, the remaining results are never going to come in
+                    try:
+                        k, res, err = queue.get(timeout=1)
+                    except Empty:
+                        for fut in futures:
+                            if fut.done() and fut.exception() is not None:
+                                raise fut.exception()
+                        continue
+
+                    # Store the summary for this economy
+                    summary[k] = dict({key: points[k].get(key) for key in cols}, k=k, error=err)
+                    if res is not None:
+                        summary[k].update({key: res[key] for key in ['r', 'e', 'conv', 'i', 'time']})
+
+                        # Save the arrays
+                        np.savez(path.join(out_dir, 'point_' + str(k) + '.npz'),
+                                 **{key: res[key] for key in keep if key in res}, r=res['r'])
+
+                    # Write the summary line right away, so results are on disk even if something crashes later
+                    f.write(','.join(str(summary[k].get(key, '')) for key in ['k'] + cols
+                                     + ['r', 'e', 'conv', 'i', 'time', 'error']) + '\n')
+                    f.flush()
+
+                    # Increase the counter
+                    n_done += 1
+    finally:
+        # Release the shared memory
+        for s in shm.values():
+            s.close()
+            s.unlink()
+
+    # Return the summary
+    return summary
+
+
+# Check whether this is run as a script
+if __name__ == '__main__':
+    # Set up the same income and asset grids and transition matrix as huggett.py does (with the borrowing limit fixed at
+    # the natural limit for beta = .96, so the asset grid is the same for all economies and can be shared)
+    n = 100
+    m = 200
+    y_1 = .1
+    Y = np.array(np.linspace(y_1, 1, num=n), ndmin=2).transpose()
+    A = np.array(np.linspace(-y_1 / (1 - .96), 4, num=m), ndmin=2).transpose()
+    np.random.seed(seed=8675309)
+    P = uniform().rvs(size=(n, n))
+    P *= np.sum(P, axis=1, keepdims=True)**(-1)
+
+    # Set up a grid of values for beta and the coefficient of relative risk aversion
+    points = param_grid(b=[.94, .95, .96], g=[2, 3, 4])
+
+    # Record the time this started
+    time_start = time.time()
+
+    # Solve all economies, with the results going into a directory next to this file
+    summary = solve_batch(points, {'Y': Y, 'A': A, 'P': P, 'kernel': 'numba'},
+                          out_dir=path.join(path.dirname(path.abspath(__file__)), 'batch_results'))
+
+    # Display the equilibrium interest rates and the time it took
+    for s in summary:
+        print('beta:', s['b'], '| g:', s['g'], '| r:', s.get('r'), '| Converged:', s.get('conv'), '| Error:',
+              s['error'])
+    print('Time elapsed:', np.around(time.time() - time_start, 4), 'seconds')
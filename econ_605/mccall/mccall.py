@@ -1,7 +1,9 @@
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 from matplotlib.ticker import FuncFormatter
 from os import mkdir, path
+from scipy.optimize import brentq
 from scipy.stats import chi2, uniform, f, norm
 
 
@@ -17,28 +19,295 @@ def cd(path):
         exit()
 
 
-# Define a function to iterate over value functions
-def V_iter(V_0, wages, beta, T):
-    # Set up V matrix to store value functions
-    V = np.zeros((n, T+1))
-    V[:, 0] = V_0
+# Define a function that finds the reservation wage w_bar directly, without iterating over value functions
+# Since accepting w is worth w / (1 - beta), and the value of rejecting is c + beta * E[V], the value function is V(w) =
+# max(w_bar, w) / (1 - beta), so w_bar solves the scalar equation h(w_bar) = (1 - beta)c + beta E[max(w_bar, w)] - w_bar
+# = 0, where E[max(w_bar, w)] = w_bar F(w_bar) + sum of f(w)w over all w > w_bar
+# The method can be 'fp' to iterate on w_bar <- (1 - beta)c + beta E[max(w_bar, w)] (which is a contraction with
+# modulus beta), 'newton' for Newton's method (h is convex and decreasing, with slope beta F(w_bar) - 1, so starting
+# from the lower bound below, this converges monotonically, in a handful of steps), or 'brent' for Brent's method
+# With the cumulative sums of f and f(w)w set up once, each evaluation of h is just a binary search over the wages
+def res_wage(wages, f_w, beta, c, method='newton', tol=10**(-6), i_max=10000):
+    # Sort the wages (they usually are already), along with their probabilities
+    i_w = np.argsort(wages)
+    wages = wages[i_w]
+    f_w = f_w[i_w]
+
+    # Get the cumulative distribution function, and the cumulative sum of f(w)w (with a zero in front, so element k is
+    # the sum over the k smallest wages)
+    F_w = np.concatenate([[0], np.cumsum(f_w)])
+    G_w = np.concatenate([[0], np.cumsum(f_w * wages)])
+
+    # Define h, along with F(w_bar), which gives its slope
+    def h(w_bar):
+        # Get the number of wages which are at most w_bar
+        k = np.searchsorted(wages, w_bar, side='right')
+
+        # Calculate h and F(w_bar)
+        return (1 - beta) * c + beta * (w_bar * F_w[k] + G_w[-1] - G_w[k]) - w_bar, F_w[k]
+
+    # The reservation wage lies between (1 - beta)c + beta E[w], where h is positive, and max(c, max(w)), where it is
+    # negative
+    w_l = (1 - beta) * c + beta * G_w[-1]
+    w_h = max(c, wages[-1])
+
+    # Check which method to use
+    if method == 'brent':
+        # Find the root of h
+        return brentq(lambda w_bar: h(w_bar)[0], w_l, w_h, xtol=tol, maxiter=i_max)
+    elif method in ['fp', 'newton']:
+        # Start at the lower bound, and set up a step which is definitely larger than the tolerance
+        w_bar = w_l
+        dev = tol + 1
+
+        # Count the iterations, to be able to stop if this takes too long to converge
+        i = 1
+        while dev > tol and i <= i_max:
+            # Get h and F at the current guess
+            h_w, F = h(w_bar)
+
+            # Take a step (fixed point iteration adds h to w_bar, Newton's method divides it by 1 - beta F first)
+            step = h_w if method == 'fp' else h_w / (1 - beta * F)
+            w_bar = w_bar + step
+            dev = np.abs(step)
+
+            # Increase iteration counter
+            i += 1
+
+        # If the maximum number of iterations was reached, print an error message
+        if i > i_max:
+            print('Reservation wage failed to converge after', i_max, 'iterations', '\n', 'Deviation:', dev)
+
+        # Return the reservation wage
+        return w_bar
+    else:
+        # Raise an error if the method is not recognized
+        raise ValueError('Reservation wage method ' + str(method) + ' not recognized')
+
+
+# Define a function that discretizes a (frozen scipy.stats) wage distribution over n wages, by evaluating its pdf at n
+# evenly spaced percentiles, and making sure the result sums to one
+def disc_pdf(w_dist, n):
+    # Get the percentiles for which a probability will be calculated
+    w_pctiles = np.linspace(10**(-10), 1 - 10**(-10), num=n)
+
+    # Get the value of the pdf for each percentile, and return the discretized pdf
+    f_w = w_dist.pdf(w_dist.ppf(w_pctiles))
+    return f_w / sum(f_w)
+
+
+# Define a function that solves for reservation wages for all combinations of discount factors in betas, values of
+# unemployment in cs, and wage distributions in dists (frozen scipy.stats distributions, which get discretized via
+# disc_pdf(), or discretized pdfs over wages), all at once
+# This is Newton's method from res_wage(), applied to a whole (distributions x betas x cs) array of reservation wages
+# at the same time: all distributions live on the same wages, so one binary search over the wages works for all of
+# them, and the betas and cs just get broadcast, so the only loop is over Newton steps (which stops once all of them
+# have converged, which takes a handful of steps, since each one converges monotonically)
+# This returns a tidy table with one row per combination, containing the distribution (its name and parameters, or its
+# position in dists if it was given as a pdf), beta, c, the reservation wage, the probability of accepting an offer,
+# the expected unemployment duration (one over that probability), and the expected accepted wage; if c is so high that
+# no wage is worth accepting (the reservation wage is above the highest wage), the probability is zero, the duration is
+# inf, and the expected accepted wage is NaN
+def res_wage_sweep(betas, cs, dists, wages, tol=10**(-6), i_max=100):
+    # Sort the wages (they usually are already)
+    i_w = np.argsort(wages)
+    wages = wages[i_w]
+
+    # Get the discretized pdfs (distributions x wages), and a label for each distribution
+    f_w = np.stack([(disc_pdf(d, len(wages)) if hasattr(d, 'ppf') else np.asarray(d, dtype=float))[i_w]
+                    for d in dists])
+    labels = [d.dist.name + '(' + ', '.join([str(a) for a in d.args] + [k + '=' + str(v) for k, v in d.kwds.items()])
+              + ')' if hasattr(d, 'ppf') else str(j) for j, d in enumerate(dists)]
+
+    # Get the cumulative distribution functions and cumulative sums of f(w)w, as in res_wage() (distributions x n + 1)
+    F_w = np.concatenate([np.zeros((len(dists), 1)), np.cumsum(f_w, axis=1)], axis=1)
+    G_w = np.concatenate([np.zeros((len(dists), 1)), np.cumsum(f_w * wages[None, :], axis=1)], axis=1)
+
+    # Set up beta and c so they broadcast against each other and the distributions
+    beta = np.asarray(betas, dtype=float)[None, :, None]
+    c = np.asarray(cs, dtype=float)[None, None, :]
+
+    # Define a function that gets F and G at given indices for each distribution
+    def at(X, k):
+        return np.take_along_axis(X, k.reshape(len(dists), -1), axis=1).reshape(k.shape)
+
+    # Start at the lower bound for the reservation wage, (1 - beta)c + beta E[w] (distributions x betas x cs)
+    w_bar = (1 - beta) * c + beta * G_w[:, -1, None, None]
+
+    # Set up a step which is definitely larger than the tolerance
+    dev = tol + 1
+
+    # Count the iterations, to be able to stop if this takes too long to converge
+    i = 1
+    while dev > tol and i <= i_max:
+        # Get the number of wages which are at most w_bar, and F(w_bar)
+        k = np.searchsorted(wages, w_bar, side='right')
+        F = at(F_w, k)
+
+        # Take a Newton step for all reservation wages at once
+        step = ((1 - beta) * c + beta * (w_bar * F + G_w[:, -1, None, None] - at(G_w, k)) - w_bar) / (1 - beta * F)
+        w_bar = w_bar + step
+        dev = np.amax(np.abs(step))
+
+        # Increase iteration counter
+        i += 1
+
+    # If the maximum number of iterations was reached, print an error message
+    if i > i_max:
+        print('Reservation wages failed to converge after', i_max, 'iterations', '\n', 'Deviation:', dev)
+
+    # Get the probability of accepting an offer (i.e. of an offer of at least w_bar), the expected duration, and the
+    # expected accepted wage (only dividing by the probability where it's positive, see above)
+    k = np.searchsorted(wages, w_bar, side='left')
+    p = F_w[:, -1, None, None] - at(F_w, k)
+    acc = p > 0
+    w_acc = np.divide(G_w[:, -1, None, None] - at(G_w, k), p, out=np.full(p.shape, np.nan), where=acc)
+    duration = np.divide(1, p, out=np.full(p.shape, np.inf), where=acc)
+
+    # Put together the table
+    dist, beta, c = np.meshgrid(labels, betas, cs, indexing='ij')
+    return pd.DataFrame({'dist': dist.ravel(), 'beta': beta.ravel(), 'c': c.ravel(), 'w_bar': w_bar.ravel(),
+                         'p_acc': p.ravel(), 'duration': duration.ravel(),
+                         'w_acc': w_acc.ravel()})
+
 
-    # Set up W matrix to store reservation wages
+# Define a function to iterate over value functions
+# The method can be 'vfi' to run up to T Bellman sweeps starting from V_0, or any of the methods of res_wage(), which
+# finds the reservation wage directly and gets the value function from it in closed form, so time and memory don't
+# depend on T at all (and only barely on n); in that case, V only contains the final value function, and W the
+# reservation wage
+# For 'vfi', setting tol stops the sweeps early, once the value function changes by at most tol (so T is just the
+# maximum number of sweeps), and history determines which value functions get stored in V: 'full' keeps all of them
+# (n x (sweeps + 1), starting with V_0), 'every_k' keeps V_0, every k-th one, and the last one, and 'none' only keeps
+# the last one (n x 1); W always has the reservation wage for every sweep
+def V_iter(V_0, wages, beta, T, method='vfi', tol=None, history='full', k=10):
+    # Check whether to find the reservation wage directly
+    if method != 'vfi':
+        # Get the reservation wage
+        w_bar = res_wage(wages, f_w, beta, c, method=method, tol=10**(-6) if tol is None else tol)
+
+        # Return the value function (as an n x 1 matrix) and reservation wage (as a vector of length one)
+        return (np.maximum(w_bar, wages) / (1 - beta))[:, None], np.array([w_bar])
+
+    # Check whether the history option is recognized
+    if history not in ['full', 'every_k', 'none']:
+        raise ValueError('History option ' + str(history) + ' not recognized')
+
+    # Calculate the value of accepting each wage once, since it doesn't change across sweeps
+    V_acc = wages / (1 - beta)
+
+    # Set up a list to store value functions (depending on history, not all of them get added to it)
+    V = [V_0]
+
+    # Set up W vector to store reservation wages
     W = np.zeros(T)
 
     # Loop over all time periods
+    V_t = V_0
+    t = 0
     for t in range(1, T+1):
-        # Calculate the new value function
-        V_t = np.maximum(c + beta * np.dot(f_w, V[:, t-1]), wages / (1 - beta))
+        # Calculate the value of rejecting the current offer, which is the same for every wage (this is all the
+        # reservation wage needs as well, so it only gets calculated once per sweep)
+        V_rej = c + beta * np.dot(f_w, V_t)
 
-        # Store it in the V matrix
-        V[:, t] = V_t
+        # Calculate the new value function, and how much it changed
+        V_t, V_in = np.maximum(V_rej, V_acc), V_t
+        dev = np.amax(np.abs(V_t - V_in))
 
-        # Calculate the reservation wage
-        W[t-1] = wages[np.argmin(np.abs((wages / (1 - beta)) - (c + beta * np.dot(f_w, V[:, t-1]))))]
+        # Store it, if desired
+        if history == 'full' or (history == 'every_k' and t % k == 0):
+            V.append(V_t)
 
-    # Return the value function and wage matrices
-    return V, W
+        # Calculate the reservation wage
+        W[t-1] = wages[np.argmin(np.abs(V_acc - V_rej))]
+
+        # Stop if the value function has converged
+        if tol is not None and dev <= tol:
+            break
+
+    # Make sure the last value function is stored (and only keep that one if there is no history)
+    if history == 'none':
+        V = [V_t]
+    elif V[-1] is not V_t:
+        V.append(V_t)
+
+    # Return the value function and wage matrices (only up to the last sweep)
+    return np.stack(V, axis=1), W[:t]
+
+# Define a function that simulates unemployment spells for N workers who all use the reservation wage w_bar, with wage
+# offers drawn from the discretized distribution f_w over wages, and returns a histogram of spell durations (the k-th
+# element is the number of workers who accepted the k+1-th offer) and one of accepted wages (the number of workers
+# who accepted each wage in wages)
+# Workers get handled in blocks of (at most) block workers, with all offers for a block drawn at once via the inverse
+# CDF of f_w, so there is no loop over workers; the method can be 'geometric', which uses the fact that each offer gets
+# accepted with probability p = P(w >= w_bar), independently across periods, so durations are geometric with
+# parameter p and accepted wages follow f_w conditional on w >= w_bar (so this is exact and doesn't loop over periods
+# either), or 'draws', which actually draws offers period by period for everyone who is still unemployed, as a check
+def sim_spells(w_bar, wages, f_w, N, method='geometric', block=10**6, seed=None):
+    # Check whether the method is recognized
+    if method not in ['geometric', 'draws']:
+        raise ValueError('Simulation method ' + str(method) + ' not recognized')
+
+    # Set up a random number generator
+    rng = np.random.default_rng(seed)
+
+    # Get the cumulative distribution of offers, and that of accepted offers, which only puts mass on wages that are at
+    # least w_bar
+    F_w = np.cumsum(f_w)
+    F_acc = np.cumsum(f_w * (wages >= w_bar))
+
+    # Get the probability that an offer gets accepted, and make sure that happens at all
+    p = F_acc[-1] / F_w[-1]
+    if p <= 0:
+        raise ValueError('No wage offer is at least as high as the reservation wage ' + str(w_bar))
+
+    # Define a function that draws the indices of wages from a cumulative distribution (which doesn't have to sum to
+    # one), using uniform draws (a uniform draw gets mapped to the first wage where the CDF exceeds it, which never
+    # has zero probability)
+    def draw(F, size):
+        return np.minimum(np.searchsorted(F, rng.uniform(size=size) * F[-1], side='right'), len(F) - 1)
+
+    # Set up the histograms (the duration one grows as needed)
+    d_hist = np.zeros(0, dtype=np.int64)
+    w_hist = np.zeros(len(wages), dtype=np.int64)
+
+    # Go through all blocks of workers
+    for N_b in np.diff(np.append(np.arange(0, N, block), N)):
+        # Check which method to use
+        if method == 'geometric':
+            # Draw durations and accepted wages directly
+            d = rng.geometric(p, size=N_b)
+            i_w = draw(F_acc, N_b)
+        else:
+            # Set up durations and accepted wages, and keep track of who is still unemployed
+            d = np.zeros(N_b, dtype=np.int64)
+            i_w = np.zeros(N_b, dtype=np.int64)
+            u = np.arange(N_b)
+
+            # Go through periods until everyone has accepted an offer
+            t = 1
+            while len(u) > 0:
+                # Draw offers for everyone who is still unemployed, and check who accepts
+                i_o = draw(F_w, len(u))
+                acc = wages[i_o] >= w_bar
+
+                # Record durations and wages for those who do, and keep the rest
+                d[u[acc]] = t
+                i_w[u[acc]] = i_o[acc]
+                u = u[~acc]
+
+                # Increase period counter
+                t += 1
+
+        # Add the block to the histograms (durations start at one)
+        d_b = np.bincount(d - 1)
+        if len(d_b) > len(d_hist):
+            d_hist = np.append(d_hist, np.zeros(len(d_b) - len(d_hist), dtype=np.int64))
+        d_hist[:len(d_b)] += d_b
+        w_hist += np.bincount(i_w, minlength=len(wages))
+
+    # Return the histograms
+    return d_hist, w_hist
 
 # Set plot options
 # plt.rc('text', usetex=True)  # Use LaTeX to compile text, which looks way better but also takes longer
@@ -68,9 +337,7 @@ wages = np.linspace(1, B, num=n)  # Vector of n wages, between 0 and B
 # w_dist = chi2(df=3)
 # w_dist = uniform()
 w_dist = f(dfn=500, dfd=10)  # Underlying distribution function
-w_pctiles = np.linspace(10**(-10), 1 - 10**(-10), num=n)  # Percentiles for which a probability will be calculated
-f_w = w_dist.pdf(w_dist.ppf(w_pctiles))  # value of the pdf for each percentile
-f_w = f_w / sum(f_w)  # Discretized pdf (i.e. this sums to one)
+f_w = disc_pdf(w_dist, n)  # Discretized pdf (i.e. this sums to one)
 
 # Set up discount factor
 beta = .97
@@ -87,6 +354,25 @@ T = 100
 # Get value functions and reservations wages over time
 V, W = V_iter(V_0, wages, beta, T)
 
+# Get the reservation wage directly as well, and compare it to the last one from iterating over value functions (which
+# can only be one of the wages in the vector)
+V_bar, W_bar = V_iter(V_0, wages, beta, T, method='newton')
+print('Reservation wage after', T, 'iterations:', W[-1], '\n',
+      'Reservation wage from the scalar fixed point:', W_bar[0])
+
+# Simulate unemployment spells for a million workers who use that reservation wage, and compare the mean duration to
+# its theoretical value, 1 / P(w >= w_bar)
+N = 10**6
+d_hist, w_hist = sim_spells(W_bar[0], wages, f_w, N, seed=8675309)
+print('Mean unemployment duration:', np.sum(np.arange(1, len(d_hist) + 1) * d_hist) / N, '\n',
+      'Expected duration:', 1 / np.sum(f_w[wages >= W_bar[0]]), '\n',
+      'Mean accepted wage:', np.sum(wages * w_hist) / N)
+
+# Get reservation wages and expected durations for a range of discount factors and values of unemployment, for the
+# wage distribution above and a chi-squared one, and display them
+sweep = res_wage_sweep(np.linspace(.9, .99, num=10), np.linspace(0, 24000, num=5), [w_dist, chi2(df=3)], wages)
+print(sweep.to_string())
+
 # Change to figures directory
 cd(mdir + fdir)
 
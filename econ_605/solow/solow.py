@@ -1,42 +1,138 @@
 import matplotlib.pyplot as plt
 import numpy as np
+import time
+from numba import njit, prange
+
+
+# Define a compiled version of the recursion for k, for a batch of economies (each element of k_0 and each row of alpha,
+# s, and x = 1 - g_A - n - d, which are batch x T + 1, is one of them), which goes through the economies in parallel,
+# and through time periods in order for each of them
+@njit(parallel=True)
+def k_path_nb(k_0, alpha, s, x, T):
+    # Set up the paths (batch x T + 1)
+    k = np.empty((k_0.shape[0], T + 1))
+
+    # Go through all economies in parallel
+    for b in prange(k_0.shape[0]):
+        # Start at the initial value, and apply k_{t + 1} = G(K_{t})
+        k[b, 0] = k_0[b]
+        for t in range(T):
+            k[b, t + 1] = s[b, t] * k[b, t]**alpha[b, t] + x[b, t] * k[b, t]
+
+    # Return the paths
+    return k
+
+
+# Define a function that calculates time paths for the Solow model, using a Cobb-Douglas production function, for any
+# number of economies at once, where the parameters can change over time and get hit by shocks
+# Each parameter (and initial value) can be a scalar, a time path of length T + 1 (the value in period t governs the
+# move from t to t + 1), or an array with one row per economy (a column for parameters which are constant over time, or
+# T + 1 columns for time paths); they all get broadcast against each other, so e.g. a single path for s combined with
+# e_A of shape batch x T + 1 runs the same policy experiment for that many draws of shocks
+# e_A and e_d are shocks to the growth rate of technology and to the depreciation rate, i.e. A_{t + 1} = (1 + g_A_{t} +
+# e_A_{t}) A_{t} and depreciation in period t is d_{t} + e_d_{t}
+# This returns a dictionary with the usual series (k, K, L, A, Y, C, R, w), the steady state k_star_{t} implied by the
+# parameters (including shocks) in period t, the log gap between k and k_star (gap), the rate lam_{t} at which that gap
+# closes locally (one minus the slope of k_{t + 1} = G(k_{t}) at k_star), the corresponding half life (in periods; this
+# is inf if lam <= 0, where the gap doesn't close, and NaN if lam >= 1, where k jumps past k_star instead), and the
+# first period t_conv from which on |gap| stays below tol (-1 if it doesn't get there), all as batch x T + 1 arrays
+# (except t_conv, which is one number per economy)
+# The method can be 'numpy', which loops over periods for k, but with each step vectorized over the batch, or 'numba',
+# which uses k_path_nb(); the numpy loop has a fixed cost per period, so it's the better choice for large batches over
+# short horizons (10,000 economies over 100 periods take .14 seconds with numpy and .16 with numba on one core), while
+# numba wins for small batches over long horizons (10 economies over 50,000 periods take .31 seconds with numpy and .09
+# with numba)
+def solow_paths(alpha, n, s, d, g_A, K_0, L_0, A_0, T, e_A=0, e_d=0, tol=.01, method='numpy'):
+    # Check whether the method is recognized
+    if method not in ['numpy', 'numba']:
+        raise ValueError('Method ' + str(method) + ' not recognized')
+
+    # Get the number of economies, which is the number of rows of any of the inputs that have two dimensions
+    B = np.broadcast_shapes(*[np.shape(x)[:-1] for x in [alpha, n, s, d, g_A, e_A, e_d] if np.ndim(x) == 2]
+                            + [np.shape(x) for x in [K_0, L_0, A_0]] + [(1,)])[0]
+
+    # Convert the parameters into batch x T + 1 arrays (including the shocks, which get added to their parameters)
+    alpha, n, s, d, g_A, e_A, e_d = (np.broadcast_to(np.array(x, dtype=float, ndmin=2), (B, T + 1))
+                                     for x in [alpha, n, s, d, g_A, e_A, e_d])
+    g = g_A + e_A
+    d = d + e_d
+
+    # Convert the initial values into vectors (batch x 1)
+    K_0, L_0, A_0 = (np.broadcast_to(np.array(x, dtype=float, ndmin=1), (B,))[:, None] for x in [K_0, L_0, A_0])
+
+    # Get L_{t + 1} = (1 + n_{t}) L_{t} and A_{t + 1} = (1 + g_A_{t} + e_A_{t}) A_{t} as cumulative products
+    L = np.cumprod(np.concatenate([L_0, 1 + n[:, :-1]], axis=1), axis=1)
+    A = np.cumprod(np.concatenate([A_0, 1 + g[:, :-1]], axis=1), axis=1)
+
+    # Get the coefficient on k_{t} in the law of motion
+    x = 1 - g - n - d
+
+    # Calculate the paths for k (k_{t + 1} = G(k_{t}))
+    k_0 = (K_0 / (A_0 * L_0))[:, 0]
+    if method == 'numba':
+        k = k_path_nb(k_0, alpha, s, x, T)
+    else:
+        # Set up k, and go through all time periods, updating all economies at once
+        k = np.empty((B, T + 1))
+        k[:, 0] = k_0
+        for t in range(T):
+            k[:, t + 1] = s[:, t] * k[:, t]**alpha[:, t] + x[:, t] * k[:, t]
+
+    # Back out other series, using Y = K^alpha (AL)^(1 - alpha) = AL k^alpha, R = alpha k^(alpha - 1), and
+    # w = (1 - alpha) A k^alpha, so that the only power that needs to be taken is k^alpha
+    k_alpha = k**alpha
+    K = k * (A * L)
+    Y = (A * L) * k_alpha
+    C = (1 - s) * Y
+    R = alpha * k_alpha / k
+    w = (1 - alpha) * A * k_alpha
+
+    # Get the steady state implied by each period's parameters, and the log gap between k and it
+    k_star = (s / (n + g + d))**(1 / (1 - alpha))
+    gap = np.log(k / k_star)
+
+    # Get the local rate of convergence, since G'(k_star) = alpha (n + g + d) + x = 1 - (1 - alpha) (n + g + d), and
+    # the half life that goes with it (which only exists for 0 < lam < 1, so only take the log there)
+    lam = (1 - alpha) * (n + g + d)
+    half_life = np.where(lam <= 0, np.inf, np.nan)
+    halves = (lam > 0) & (lam < 1)
+    half_life[halves] = np.log(2) / -np.log(1 - lam[halves])
+
+    # Get the first period from which on the gap stays within tol (going backwards from the last period, a period
+    # counts if it and all periods after it are within tol)
+    close = np.flip(np.logical_and.accumulate(np.flip(np.abs(gap) < tol, axis=1), axis=1), axis=1)
+    t_conv = np.where(close[:, -1], np.argmax(close, axis=1), -1)
+
+    # Return those series
+    return {'k': k, 'K': K, 'L': L, 'A': A, 'Y': Y, 'C': C, 'R': R, 'w': w, 'k_star': k_star, 'gap': gap, 'lam': lam,
+            'half_life': half_life, 't_conv': t_conv}
 
 
-# Define a function that calculates time paths for the Solow model, using a Cobb-Douglas production function
+# Define a function that calculates time paths for the Solow model, using a Cobb-Douglas production function, for a
+# single economy, where parameters can be scalars or time paths (useful for parameter breaks)
 def solow_cobb_douglas(alpha, n, s, d, g_A, K_0, L_0, A_0, T):
-    # If they're scalar, convert parameters into time series (useful for parameter breaks)
-    alpha_s = np.ones(T + 1) * alpha
-    n_s = np.ones(T + 1) * n
-    s_s = s * np.ones(T + 1)
-    d_s = np.ones(T + 1) * d
-    g_A_s = np.ones(T + 1) * g_A
-
-    # Set up time series
-    k = np.ones(T + 1) * K_0 / (A_0 * L_0)
-    L = np.ones(T + 1) * L_0
-    A = np.ones(T + 1) * A_0
-
-    # Loop through time periods
-    for t in range(T):
-        # k_{t + 1} = G(K_{t})
-        k[t + 1] = s_s[t] * k[t]**(alpha_s[t]) + (1 - g_A_s[t] - n_s[t] - d_s[t]) * k[t]
-
-        # L_{t + 1} = (1 + n) L_{t}
-        L[t + 1] = (1 + n_s[t]) * L[t]
-
-        # A_{t + 1} = (1 + g_A) A_{t}
-        A[t + 1] = (1 + g_A_s[t]) * A[t]
-
-    # Back out other series
-    K = k * (A * L)
-    Y = K**(alpha_s) * (A * L)**(1 - alpha_s)
-    C = (1 - s_s) * Y
-    R = (alpha_s) * ((A * L) / K)**(1 - alpha_s)
-    w = (1 - alpha_s) * A**(1 - alpha_s) * (K/L)**(alpha_s)
-    k_star = (s_s / (n_s + g_A_s + d_s))**(1/(1 - alpha_s))
+    # Get the series from the general version
+    paths = solow_paths(alpha, n, s, d, g_A, K_0, L_0, A_0, T)
+
+    # Return those series
+    return tuple(paths[key][0] for key in ['k', 'K', 'L', 'A', 'Y', 'C', 'R', 'w', 'k_star'])
+
+
+# Define a function that calculates time paths for the Solow model for a whole batch of parameter sets at once, where
+# each parameter (and initial value) can be a scalar or a vector (which all get broadcast against each other, so a
+# vector of saving rates and a vector of population growth rates of the same length make up that many parameter sets)
+# This returns the same series as solow_cobb_douglas(), each as a batch x T + 1 array; the method gets passed on to
+# solow_paths()
+def solow_batch(alpha, n, s, d, g_A, K_0, L_0, A_0, T, method='numpy'):
+    # Broadcast the parameters against each other, to get vectors with one element per parameter set
+    alpha, n, s, d, g_A, K_0, L_0, A_0 = np.broadcast_arrays(*np.atleast_1d(alpha, n, s, d, g_A, K_0, L_0, A_0))
+
+    # Get the series from the general version, with each parameter as a column (so it's constant over time)
+    paths = solow_paths(alpha[:, None], n[:, None], s[:, None], d[:, None], g_A[:, None], K_0, L_0, A_0, T,
+                        method=method)
 
     # Return those series
-    return k, K, L, A, Y, C, R, w, k_star
+    return tuple(paths[key] for key in ['k', 'K', 'L', 'A', 'Y', 'C', 'R', 'w', 'k_star'])
 
 # Set plot options
 plt.rc('text', usetex=True)  # Use LaTeX to compile text, which looks way better but also takes longer
@@ -66,6 +162,59 @@ k, K, L, A, Y, C, R, w, k_star =\
 k1, K1, L1, A1, Y1, C1, R1, w1, k_star1 =\
     solow_cobb_douglas(alpha=0.3, n=n[0], s=s[0], d=0.15, g_A=g_A, K_0=1.4, L_0=1.0, A_0=0.2, T=T)
 
+# Draw shocks to technology growth and depreciation for 10,000 economies (one row each), all going through the same
+# change in g_A as the changed series
+np.random.seed(seed=8675309)
+e_A = np.random.normal(scale=.01, size=(10000, T + 1))
+e_d = np.random.normal(scale=.01, size=(10000, T + 1))
+
+# Record the time this started
+time_start = time.time()
+
+# Simulate all of them at once
+paths = solow_paths(alpha=0.3, n=n[0], s=s[0], d=0.15, g_A=g_A, K_0=1.4, L_0=1.0, A_0=0.2, T=T, e_A=e_A, e_d=e_d)
+
+# Display the time it took, the spread of k in the last period, and how far k ends up from (and how quickly it moves
+# towards) the steady state, both for the changed series and on average across the shocked economies (leaving out
+# economies whose half life in the last period isn't finite, see solow_paths())
+print('Monte Carlo:', e_A.shape[0], 'paths in', np.around(time.time() - time_start, 4), 'seconds')
+print('k in the last period (5th, 50th, 95th percentile):', np.percentile(paths['k'][:, -1], [5, 50, 95]))
+print('Changed series | Gap to k* in the last period:', np.log(k1[-1] / k_star1[-1]))
+half_life = paths['half_life'][:, -1]
+print('Shocked series | Mean absolute gap to k* in the last period:', np.mean(np.abs(paths['gap'][:, -1])),
+      '| Mean half life (periods):', np.mean(half_life[np.isfinite(half_life)]),
+      '| Paths without a finite half life:', np.sum(~np.isfinite(half_life)))
+
+# Set up a grid of saving rates and population growth rates for a policy experiment, with 10,000 economies
+s_grid, n_grid = (x.flatten() for x in np.meshgrid(np.linspace(.05, .5, num=100), np.linspace(0, .05, num=100)))
+
+# Record the time this started
+time_start = time.time()
+
+# Simulate all of them at once
+k_b, K_b, L_b, A_b, Y_b, C_b, R_b, w_b, k_star_b =\
+    solow_batch(alpha=0.3, n=n_grid, s=s_grid, d=0.15, g_A=g_A[0], K_0=1.4, L_0=1.0, A_0=0.2, T=T)
+
+# Display the time it took, and how far from the steady state the economies end up
+print('Batch:', len(s_grid), 'economies in', np.around(time.time() - time_start, 4),
+      'seconds | Largest distance of k from k* in the last period:', np.amax(np.abs(k_b[:, -1] - k_star_b[:, -1])))
+
+# For a few economies over a very long horizon (without growth, so the levels of the series don't overflow), the loop
+# over periods dominates, which is where the Numba recursion is faster, so compare both methods there (the first Numba
+# call includes compiling the function)
+s_long = np.linspace(.05, .5, num=10)
+solow_batch(alpha=0.3, n=0, s=s_long, d=0.15, g_A=0, K_0=1.4, L_0=1.0, A_0=0.2, T=10, method='numba')
+for method in ['numpy', 'numba']:
+    # Record the time this started
+    time_start = time.time()
+
+    # Get the paths
+    k_l = solow_batch(alpha=0.3, n=0, s=s_long, d=0.15, g_A=0, K_0=1.4, L_0=1.0, A_0=0.2, T=50000, method=method)[0]
+
+    # Display the time it took
+    print('Long horizon (' + method + '):', len(s_long), 'economies over', k_l.shape[1] - 1, 'periods in',
+          np.around(time.time() - time_start, 4), 'seconds')
+
 # Set up plot
 fig, ax = plt.subplots()
 ax.set_title('Dynamics of the Solow model with technological progress')
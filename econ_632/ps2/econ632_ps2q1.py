@@ -49,7 +49,7 @@ mdir = path.dirname(path.abspath(getsourcefile(lambda:0))).replace('\\', '/')
 chdir(mdir)
 
 # Import custom packages (have to be in the main directory)
-from linreg import larry, ols
+from linreg import larry, ols_many
 from texaux import textable
 
 # Set data directory (has to exist and contain insurance_data.csv)
@@ -595,21 +595,17 @@ switchreg = pd.DataFrame(np.zeros(shape=(X_sw.shape[1]+2,
                                          len(switching_measures_reg)*2)),
                       index=['y', 'stat',  'Constant'] + list(Xvars_sw))
 
-# Go through all switching measures
-for i, measure in enumerate(switching_measures_reg):
-    # Get the variable in question
-    var = switching_measures_reg[measure]
-
-    # Make the LHS variable into a column vector
-    y = larry(insurance_data_red[var])
-
-    # Figure out where y and X are both not missing
-    I = ~np.isnan(y[:,0]) & ~np.isnan(X_sw.sum(axis=1))
+# Make the LHS variables into a matrix, with one column for each of the
+# switching measures, making sure these are provided in float format
+Y = larry(
+    insurance_data_red[list(switching_measures_reg.values())].astype(float))
 
-    # Run OLS
-    bhat, _, _, p = ols(y[I,:], X_sw[I,:], cov_est='cluster',
-                        clustvar=clusters[I,:])
+# Run OLS for all of them at once (each one uses the observations where it and
+# X are both not missing, and those using the same observations share the work)
+bhat, _, _, p = ols_many(Y, X_sw, cov_est='cluster', clustvar=clusters)
 
+# Go through all switching measures
+for i, measure in enumerate(switching_measures_reg):
     # Add outcome name to results DataFrame
     switchreg.iloc[0, 2*i:2*i+2] = measure
 
@@ -618,8 +614,8 @@ for i, measure in enumerate(switching_measures_reg):
     switchreg.iloc[1, 2*i+1] = 'p'
 
     # Add results
-    switchreg.iloc[2:, 2*i] = bhat[:, 0]
-    switchreg.iloc[2:, 2*i+1] = p[:, 0]
+    switchreg.iloc[2:, 2*i] = bhat[:, i]
+    switchreg.iloc[2:, 2*i+1] = p[:, i]
 
 # Set outcomes and beta_hat / p-values as headers for switching results
 switchreg = switchreg.T.set_index(['y', 'stat']).T
@@ -664,21 +660,16 @@ domreg = pd.DataFrame(np.zeros(shape=(X_dom.shape[1]+2,
                                       len(dominance_measures)*2)),
                       index=['y', 'stat',  'Constant'] + list(Xvars_dom))
 
-# Go through all measures of dominated choices
-for i, measure in enumerate(dominance_measures):
-    # Get the variable in question
-    var = dominance_measures[measure]
-
-    # Make the LHS variable into a column vector
-    y = larry(insurance_data_red[var])
+# Make the LHS variables into a matrix, with one column for each of the
+# measures of dominated choices, making sure these are provided in float format
+Y = larry(insurance_data_red[list(dominance_measures.values())].astype(float))
 
-    # Figure out where y and X are both not missing
-    I = ~np.isnan(y[:,0]) & ~np.isnan(X_dom.sum(axis=1))
-
-    # Run OLS
-    bhat, _, _, p = ols(y[I,:], X_dom[I,:], cov_est='cluster',
-                        clustvar=clusters[I,:])
+# Run OLS for all of them at once (each one uses the observations where it and
+# X are both not missing, and those using the same observations share the work)
+bhat, _, _, p = ols_many(Y, X_dom, cov_est='cluster', clustvar=clusters)
 
+# Go through all measures of dominated choices
+for i, measure in enumerate(dominance_measures):
     # Add outcome name to results DataFrame
     domreg.iloc[0, 2*i:2*i+2] = measure
 
@@ -687,8 +678,8 @@ for i, measure in enumerate(dominance_measures):
     domreg.iloc[1, 2*i+1] = 'p'
 
     # Add results
-    domreg.iloc[2:, 2*i] = bhat[:, 0]
-    domreg.iloc[2:, 2*i+1] = p[:, 0]
+    domreg.iloc[2:, 2*i] = bhat[:, i]
+    domreg.iloc[2:, 2*i+1] = p[:, i]
 
 # Set outcomes and beta_hat / p-values as headers for dominance results
 domreg = domreg.T.set_index(['y', 'stat']).T
@@ -757,21 +748,16 @@ toolreg = pd.DataFrame(np.zeros(shape=(X_tool.shape[1]+2,
                                        len(tool_measures)*2)),
                        index=['y', 'stat',  'Constant'] + list(Xvars_tool))
 
-# Go through all measures of tool access
-for i, measure in enumerate(tool_measures):
-    # Get the variable in question
-    var = tool_measures[measure]
-
-    # Make the LHS variable into a column vector
-    y = larry(insurance_data_red[var])
+# Make the LHS variables into a matrix, with one column for each of the
+# measures of tool access, making sure these are provided in float format
+Y = larry(insurance_data_red[list(tool_measures.values())].astype(float))
 
-    # Figure out where y and X are both not missing
-    I = ~np.isnan(y[:,0]) & ~np.isnan(X_tool.sum(axis=1))
-
-    # Run OLS
-    bhat, _, _, p = ols(y[I,:], X_tool[I,:], cov_est='cluster',
-                        clustvar=clusters[I,:])
+# Run OLS for all of them at once (each one uses the observations where it and
+# X are both not missing, and those using the same observations share the work)
+bhat, _, _, p = ols_many(Y, X_tool, cov_est='cluster', clustvar=clusters)
 
+# Go through all measures of tool access
+for i, measure in enumerate(tool_measures):
     # Add outcome name to results DataFrame
     toolreg.iloc[0, 2*i:2*i+2] = measure
 
@@ -780,8 +766,8 @@ for i, measure in enumerate(tool_measures):
     toolreg.iloc[1, 2*i+1] = 'p'
 
     # Add results
-    toolreg.iloc[2:, 2*i] = bhat[:, 0]
-    toolreg.iloc[2:, 2*i+1] = p[:, 0]
+    toolreg.iloc[2:, 2*i] = bhat[:, i]
+    toolreg.iloc[2:, 2*i+1] = p[:, i]
 
 # Set outcomes and beta_hat / p-values as headers for tool access results
 toolreg = toolreg.T.set_index(['y', 'stat']).T
@@ -828,21 +814,16 @@ planreg = pd.DataFrame(np.zeros(shape=(X_plan.shape[1]+2,
                                        len(plan_chars)*2)),
                        index=['y', 'stat',  'Constant'] + list(Xvars_plan))
 
-# Go through all plan characteristics
-for i, char in enumerate(plan_chars):
-    # Get the variable in question
-    var = plan_chars[char]
-
-    # Make the LHS variable into a column vector
-    y = larry(insurance_data_red[var])
+# Make the LHS variables into a matrix, with one column for each of the
+# plan characteristics, making sure these are provided in float format
+Y = larry(insurance_data_red[list(plan_chars.values())].astype(float))
 
-    # Figure out where y and X are both not missing
-    I = ~np.isnan(y[:,0]) & ~np.isnan(X_plan.sum(axis=1))
-
-    # Run OLS
-    bhat, _, _, p = ols(y[I,:], X_plan[I,:], cov_est='cluster',
-                        clustvar=clusters[I,:])
+# Run OLS for all of them at once (each one uses the observations where it and
+# X are both not missing, and those using the same observations share the work)
+bhat, _, _, p = ols_many(Y, X_plan, cov_est='cluster', clustvar=clusters)
 
+# Go through all plan characteristics
+for i, char in enumerate(plan_chars):
     # Add outcome name to results DataFrame
     planreg.iloc[0, 2*i:2*i+2] = char
 
@@ -851,8 +832,8 @@ for i, char in enumerate(plan_chars):
     planreg.iloc[1, 2*i+1] = 'p'
 
     # Add results
-    planreg.iloc[2:, 2*i] = bhat[:, 0]
-    planreg.iloc[2:, 2*i+1] = p[:, 0]
+    planreg.iloc[2:, 2*i] = bhat[:, i]
+    planreg.iloc[2:, 2*i+1] = p[:, i]
 
 # Set outcomes and beta_hat / p-values as headers for tool access results
 planreg = planreg.T.set_index(['y', 'stat']).T
@@ -1,7 +1,8 @@
 # Import necessary packages
 import numpy as np
-import pandas as pd
-from numpy.linalg import solve
+from numpy.linalg import LinAlgError
+from scipy.linalg.lapack import dpotrf, dpotrs
+from scipy.sparse import csr_matrix
 from scipy.stats import norm
 
 # This function takes an input and converts it to a 'long' array; that is, this
@@ -28,6 +29,33 @@ def larry(x):
     # Return the array
     return X
 
+# This function sets up everything needed to sum variables within clusters,
+# which is a sparse [J,n] matrix of cluster indicators D, where D[j,i] = 1 if
+# observation i is in cluster j. Summing any [n,k] matrix S within clusters is
+# then just D @ S, and when the same clusters get used over and over (e.g. in a
+# bootstrap), D only has to be set up once
+def cluster_index(clustvar):
+    # Inputs
+    # clustvar: [n,1] vector, cluster variable
+    #
+    # Outputs
+    # clusters: dictionary, with the cluster indicators ('D'), the cluster of
+    #           each observation, numbered from 0 to J-1 ('codes'), and the
+    #           number of clusters ('J')
+
+    # Number the clusters
+    _, codes = np.unique(clustvar[:,0], return_inverse=True)
+    codes = codes.reshape(-1)
+
+    # Get number of observations n and number of clusters J
+    n, J = len(codes), codes.max() + 1
+
+    # Set up the cluster indicators
+    D = csr_matrix((np.ones(n), (codes, np.arange(n))), shape=(J,n))
+
+    # Return the cluster index
+    return {'D': D, 'codes': codes, 'J': J}
+
 # This function just runs a standard linear regression of y on X
 def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
         clustvar=None):
@@ -44,6 +72,9 @@ def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
     #        separately
     # get_p: boolean, if true, calculate the p-values for a two-sided test of
     #        beta[i] = 0, for each element of the coefficient vector separately
+    # clustvar: [n,1] vector, cluster variable (only used if cov_est is
+    #           cluster), or the output of cluster_index() for it, which saves
+    #           setting that up if the same clusters get used repeatedly
     #
     # Outputs:
     # beta_hat: [k,1] vector, coefficient estimates
@@ -62,9 +93,18 @@ def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
     # Get number of observations n and number of coefficients k
     n, k = X.shape[0], X.shape[1]
 
+    # Get the Cholesky factorization of X'X (which is all that's needed to apply
+    # (X'X)^(-1) to anything, without ever calculating the inverse itself;
+    # this calls LAPACK directly, since for small samples, the overhead of
+    # going through Scipy's wrappers would take longer than the actual work)
+    XX, info = dpotrf(X.transpose() @ X)
+
+    # Make sure that worked, which it won't if X doesn't have full column rank
+    if info != 0:
+        raise LinAlgError('X\'X is not positive definite')
+
     # Calculate OLS coefficients
-    XXinv = solve(X.transpose() @ X, np.eye(k))  # Calculate (X'X)^(-1)
-    beta_hat = XXinv @ (X.transpose() @ y)
+    beta_hat = dpotrs(XX, X.transpose() @ y)[0]
 
     # Check whether covariance is needed
     if get_cov:
@@ -75,30 +115,40 @@ def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
         if cov_est == 'hmsd':
             # For the homoskedastic estimator, just calculate the standard
             # variance
-            V_hat = ( 1 / (n - k) ) * XXinv * (U_hat.transpose() @ U_hat)
+            V_hat = (
+                ( 1 / (n - k) ) * dpotrs(XX, np.eye(k))[0]
+                * (U_hat.transpose() @ U_hat))
         elif cov_est == 'hc1':
             # Calculate component of middle part of EHW sandwich,
             # S_i = X_i u_i, which makes it very easy to calculate
-            # sum_i X_i X_i' u_i^2 = S'S)
-            S = ( U_hat @ np.ones(shape=(1,k)) ) * X
+            # sum_i X_i X_i' u_i^2 = S'S; broadcasting the residuals across
+            # the columns of X avoids setting up an [n,k] matrix of copies)
+            S = U_hat * X
 
-            # Calculate EHW variance/covariance matrix
-            V_hat = ( n / (n - k) ) * XXinv @ (S.transpose() @ S) @ XXinv
+            # Calculate EHW variance/covariance matrix, by applying (X'X)^(-1)
+            # to S'S, and then to the transpose of the result (which gives
+            # (X'X)^(-1) S'S (X'X)^(-1), since both are symmetric)
+            V_hat = dpotrs(XX, S.transpose() @ S)[0]
+            V_hat = (
+                ( n / (n - k) )
+                * dpotrs(XX, V_hat.transpose())[0])
         elif cov_est == 'cluster':
-            # Calculate number of clusters
-            J = len(np.unique(clustvar))
+            # Set up the cluster index, unless that was done already
+            if not isinstance(clustvar, dict):
+                clustvar = cluster_index(clustvar)
 
-            # Same thing as S above, but needs to be a DataFrame, because pandas
-            # has the groupby method, which is needed in the next step
-            S = pd.DataFrame((U_hat @ np.ones(shape=(1,k))) * X)
+            # Get number of clusters
+            J = clustvar['J']
 
-            # Sum all covariates within clusters
-            S = S.groupby(clustvar[:,0], axis=0).sum().values
+            # Same thing as S above, but summed within clusters
+            S = clustvar['D'] @ (U_hat * X)
 
-            # Calculate cluster-robust variance estimator
+            # Calculate cluster-robust variance estimator (the same way as the
+            # EHW one above)
+            V_hat = dpotrs(XX, S.transpose() @ S)[0]
             V_hat = (
                 ( n / (n - k) ) * ( J / (J - 1) )
-                * XXinv @ (S.transpose() @ S) @ XXinv)
+                * dpotrs(XX, V_hat.transpose())[0])
         else:
             # Print an error message
             print('Error in ',ols.__name__,'(): The specified covariance '
@@ -136,3 +186,176 @@ def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
     else:
         # Otherwise, just return coefficients
         return beta_hat
+
+# This function runs linear regressions of several LHS variables on the same
+# RHS variables, where each LHS variable can use a different sample (e.g.
+# because it has missing values in different places). Outcomes that use the
+# same sample share one factorization of X'X, and all their coefficients are
+# calculated at once
+def ols_many(Y, X, masks=None, get_cov=True, cov_est='hc1', get_t=True,
+             get_p=True, clustvar=None):
+    # Inputs
+    # Y: [n,m] matrix, LHS variables, one column for each outcome
+    # X: [n,k] matrix, RHS variables, which are the same for all outcomes
+    # masks: [n,m] boolean matrix, or None; each column specifies which
+    #        observations to use for the corresponding outcome. If None, each
+    #        outcome uses all observations for which neither it nor any of
+    #        the RHS variables are missing (NaN)
+    # get_cov, cov_est, get_t, get_p, clustvar: same as for ols(). If clustvar
+    #                                           is the output of
+    #                                           cluster_index(), samples using
+    #                                           all observations use it as is,
+    #                                           and all others get their own
+    #                                           index, set up from its codes
+    #
+    # Outputs:
+    # beta_hat: [k,m] matrix, coefficient estimates (one column per outcome)
+    # V_hat: [m,k,k] array, estimates of the variance/covariance matrices,
+    #        where V_hat[j,:,:] is the one for outcome j
+    # t: [k,m] matrix, t-statistics
+    # p: [k,m] matrix, p-values
+
+    # If p-values are necessary, then t-statistics will be needed
+    if get_p and not get_t:
+        get_t = True
+
+    # If t-statistics are necessary, then the covariance has to be estimated
+    if get_t and not get_cov:
+        get_cov = True
+
+    # Check whether the covariance estimator is recognized
+    if get_cov and cov_est not in ['hmsd', 'hc1', 'cluster']:
+        # Print an error message
+        print('Error in ',ols_many.__name__,'(): The specified covariance '
+            'method could not be recognized. Please specify another ',
+            'method.',sep='')
+
+        # Exit the program
+        return
+
+    # Get number of outcomes m and number of coefficients k
+    m, k = Y.shape[1], X.shape[1]
+
+    # If no masks were provided, use all observations where the outcome and
+    # all RHS variables are not missing
+    if masks is None:
+        masks = ~np.isnan(Y) & ~np.isnan(X.sum(axis=1, keepdims=True))
+
+    # Group together outcomes that use the same sample (using the raw bytes of
+    # each mask as a key, which is much faster than sorting the masks to find
+    # the distinct ones)
+    samples = {}
+    for j in range(m):
+        samples.setdefault(masks[:,j].tobytes(), []).append(j)
+
+    # If the cluster index was provided, keep it, and get the cluster of each
+    # observation from it, which can be restricted to each sample below
+    clusters_all = None
+    if isinstance(clustvar, dict):
+        clusters_all = clustvar
+        clustvar = clustvar['codes'][:,None]
+
+    # Set up matrix of coefficients, and array of variance/covariance matrices
+    beta_hat = np.zeros(shape=(k,m))
+    V_hat = np.zeros(shape=(m,k,k))
+
+    # Go through all distinct samples
+    for J in samples.values():
+        # Get the observations in this sample, and the corresponding parts of X
+        # and Y (for the outcomes using it)
+        I = masks[:,J[0]]
+        X_s = X[I,:]
+        Y_s = Y[I,:][:,J]
+
+        # Get number of observations in this sample
+        n = X_s.shape[0]
+
+        # Get the Cholesky factorization of X'X (see ols())
+        XX, info = dpotrf(X_s.transpose() @ X_s)
+
+        # Make sure that worked, which it won't if X doesn't have full column
+        # rank in this sample
+        if info != 0:
+            raise LinAlgError('X\'X is not positive definite')
+
+        # Calculate OLS coefficients for all outcomes using this sample at once
+        beta_hat[:,J] = dpotrs(XX, X_s.transpose() @ Y_s)[0]
+
+        # Check whether covariance is needed
+        if get_cov:
+            # Get residuals (one column per outcome)
+            U_hat = Y_s - X_s @ beta_hat[:,J]
+
+            # Calculate (X'X)^(-1), which gets used once for each outcome, so
+            # here, it's cheaper to calculate it than to keep solving
+            XXinv = dpotrs(XX, np.eye(k))[0]
+
+            # Check which covariance estimator to use
+            if cov_est == 'hmsd':
+                # For the homoskedastic estimator, scale (X'X)^(-1) by each
+                # outcome's residual variance
+                V_hat[J,:,:] = (
+                    XXinv[None,:,:]
+                    * (np.sum(U_hat**2, axis=0) / (n - k))[:,None,None])
+            else:
+                # Calculate components of middle part of the sandwich for all
+                # outcomes at once, S[i,j,:] = X_i u_ij (see ols())
+                S = U_hat[:,:,None] * X_s[:,None,:]
+
+                # Set the degrees of freedom correction
+                dfc = n / (n - k)
+
+                # Check whether to use the cluster-robust estimator
+                if cov_est == 'cluster':
+                    # Set up the cluster index for this sample (unless it
+                    # includes all observations, and the index was provided),
+                    # and get the number of clusters
+                    if clusters_all is not None and I.all():
+                        clusters = clusters_all
+                    else:
+                        clusters = cluster_index(clustvar[I,:])
+                    C = clusters['J']
+
+                    # Sum all covariates within clusters (for all outcomes at
+                    # once, which requires stacking them side by side first)
+                    S = (clusters['D'] @ S.reshape(n, -1)).reshape(C, -1, k)
+
+                    # Adjust the degrees of freedom correction
+                    dfc = dfc * ( C / (C - 1) )
+
+                # Calculate S'S for each outcome (stacking the outcomes along
+                # the first dimension), and get the variance/covariance matrices
+                S = S.transpose(1,0,2)
+                V_hat[J,:,:] = (
+                    dfc * XXinv @ (S.transpose(0,2,1) @ S) @ XXinv)
+
+    # Check whether covariance is needed
+    if get_cov:
+        # Replace NaNs as zeros (happen if division by zero occurs)
+        V_hat[np.isnan(V_hat)] = 0
+
+        # Check whether to get t-statistics
+        if get_t:
+            # Calculate t-statistics
+            t = (
+                beta_hat
+                / np.sqrt(np.diagonal(V_hat, axis1=1, axis2=2)).transpose())
+
+            # Check whether to calculate p-values
+            if get_p:
+                # Calculate p-values
+                p = 2 * (1 - norm.cdf(np.abs(t)))
+
+                # Return coefficients, variance/covariance matrices,
+                # t-statistics, and p-values
+                return beta_hat, V_hat, t, p
+            else:
+                # Return coefficients, variance/covariance matrices, and
+                # t-statistics
+                return beta_hat, V_hat, t
+        else:
+            # Return coefficients and variance/covariance matrices
+            return beta_hat, V_hat
+    else:
+        # Otherwise, just return coefficients
+        return beta_hat
@@ -0,0 +1,95 @@
+################################################################################
+### Econ 666, grant proposal: Benchmark for chunked parallel bootstraps
+################################################################################
+
+################################################################################
+### Part 1: Setup
+################################################################################
+
+# Import other necessary packages and functions
+import numpy as np
+import time
+from inspect import getsourcefile
+from joblib import Parallel, delayed
+from multiprocessing import cpu_count
+from os import chdir, path
+
+# Specify name for main directory (just uses the file's directory, see
+# econ666_pap.py)
+mdir = path.dirname(path.abspath(getsourcefile(lambda:0))).replace('\\', '/')
+
+# Change to main directory
+chdir(mdir)
+
+# Import custom packages (have to be in the main directory)
+from linreg import (b_iter_cgm0, cluster_index, larry, ols, rng_stream,
+                    run_chunked)
+
+# Set number of digits to round to
+nround = 4
+
+################################################################################
+### Part 2: Data
+################################################################################
+
+# Specify number of clusters, observations per cluster, and bootstrap iterations
+# (the small sample is the case where sending tasks to worker processes costs
+# more than the work itself)
+J = 20
+n = 10
+B = 4999
+
+# Get the random number generator for the data
+rng = rng_stream(666, 0)
+
+# Make a vector of cluster indicators
+CV = np.kron(larry([x for x in range(J)]), np.ones(shape=(n,1))).astype(int)
+
+# Draw an intercept and a cluster level treatment, and outcomes with a cluster
+# level error component
+X = np.concatenate((np.ones(shape=(J*n,1)),
+                    rng.binomial(1, .5, size=(J,1))[CV[:,0],:]), axis=1)
+y = rng.normal(size=(J,1))[CV[:,0],:] + rng.normal(size=(J*n,1))
+
+# Get restricted coefficients (with the null imposed on the treatment effect)
+# and unrestricted residuals, as boot_ols() does
+beta_hat_R = np.zeros(shape=(2,1))
+beta_hat_R[0,:] = ols(y, X[:,[0]], get_cov=False, get_t=False, get_p=False)
+e_hat = y - X @ ols(y, X, get_cov=False, get_t=False, get_p=False)
+
+# Collect the arguments which are the same for all iterations
+kwargs = {'y': y, 'X': X, 'e_hat': e_hat, 'beta_hat_R': beta_hat_R, 'CV': CV,
+          'J': J, 'seed': 666, 'clusters': cluster_index(CV)}
+
+################################################################################
+### Part 3: Benchmark
+################################################################################
+
+# Use all cores, but at least two processes, since otherwise there is nothing
+# to compare
+ncores = max(cpu_count(), 2)
+
+# Start the worker processes, so that doesn't count towards either method
+Parallel(n_jobs=ncores)(delayed(np.sqrt)(x) for x in range(ncores))
+
+# Run the bootstrap with one task per iteration, which is how boot_ols() used to
+# do it, and time it
+time_start = time.time()
+Tb_task = Parallel(n_jobs=ncores)(
+    delayed(b_iter_cgm0)(**kwargs, b=b) for b in range(B))
+Tb_task = np.concatenate(Tb_task, axis=1)
+duration_task = time.time() - time_start
+
+# Run the bootstrap in chunks, and time it
+time_start = time.time()
+Tb_chunk = run_chunked(b_iter_cgm0, B, kwargs, n_jobs=ncores)
+Tb_chunk = Tb_chunk[:,:,0].transpose()
+duration_chunk = time.time() - time_start
+
+# Display results
+print('Bootstrap iterations:', B, '| Observations:', J*n, '| Processes:',
+      ncores)
+print('One task per iteration:', np.around(duration_task, nround), 'seconds')
+print('Chunked:', np.around(duration_chunk, nround), 'seconds')
+print('Speedup:', np.around(duration_task / duration_chunk, nround))
+print('Same results:', np.array_equal(Tb_task, Tb_chunk))
@@ -16,7 +16,6 @@ import numpy as np
 import time
 import warnings
 from inspect import getsourcefile
-from joblib import Parallel, delayed
 from multiprocessing import cpu_count
 from os import chdir, mkdir, path
 from scipy.optimize import fsolve, minimize, NonlinearConstraint
@@ -34,7 +33,7 @@ mdir = path.dirname(path.abspath(getsourcefile(lambda:0))).replace('\\', '/')
 chdir(mdir)
 
 # Import custom packages (have to be in the main directory)
-from linreg import larry, boot_ols
+from linreg import larry, boot_ols, exec_context, rng_stream, run_chunked
 
 ################################################################################
 ### 1.2: Display options, seed
@@ -396,38 +395,48 @@ B = 1999
 # Specify number of simulations to use for power calculation
 S = 1000
 
-# Specify whether to run simulations in parallel
-parsim = True
+# Specify number of cores to use (set this to 1 to run everything in sequence)
+ncores = cpu_count()
+
+# Set up the execution context, which decides whether to run the simulations or
+# the bootstrap iterations within each of them in parallel, and how many BLAS
+# threads each process gets (see exec_context() in linreg.py)
+ctx = exec_context(S, B, n_jobs=ncores)
 
 # Define one iteration of the power calculation
 def power_iter(s, N=N, F_v=F_v, F_i=F_i, mu_T=mu_T, I_v=I_v, imp0=imp0, B=B,
-               seed=0, parbs=(not parsim)):
-    # Set random number generator seed
-    np.random.seed(seed+s)
+               seed=0, ctx=None):
+    # Get the random number generator for this simulation (see rng_stream()
+    # in linreg.py)
+    rng = rng_stream(seed, s)
 
     # Get village level adoption rates
-    mu_v = larry(F_v.rvs(size=J))
+    mu_v = larry(F_v.rvs(size=J, random_state=rng))
 
     # Stack them to a vector for each individual
     mu_v = mu_v[I_v[:,0], :]
 
     # Get individual level adoption rates
-    mu_i = larry(F_i.rvs(size=N))
+    mu_i = larry(F_i.rvs(size=N, random_state=rng))
 
     # Draw adoption rates, as the minimum of 1 and a sum of three Bernoulli
     # random variables (individual level, village level, and treatment level)
     y = np.amin(
-        [np.random.binomial(1, mu_i, size=(N,1))
-         + np.random.binomial(1, mu_v, size=(N,1))
-         + np.random.binomial(1, mu_T, size=(N,1)),
+        [rng.binomial(1, mu_i, size=(N,1))
+         + rng.binomial(1, mu_v, size=(N,1))
+         + rng.binomial(1, mu_T, size=(N,1)),
          np.ones(shape=(N,1))], axis=0)
 
     # Use Cameron, Gelbach, and Miller (2008) cluster robust bootstrap with the
     # null imposed to get point estimates, t-statistics, and confidence
-    # intervals (do not use parallel computing if the simulation is run in
-    # parallel already)
-    beta_hat, t_hat, CI = boot_ols(y, X, alg='cgm0', B=B, clustvar=I_v,
-                                   imp0=imp0, par=parbs)
+    # intervals, doing all bootstrap iterations at once using village level
+    # sufficient statistics (with as many villages as this design has, drawing
+    # disturbances is the only option, since there are far more than B possible
+    # ones, so enum isn't used), where each simulation gets its own bootstrap
+    # random number streams, and the execution context decides whether the
+    # bootstrap can use more than one core
+    beta_hat, t_hat, CI = boot_ols(y, X, alg='cgm0_fast', B=B, clustvar=I_v,
+                                   imp0=imp0, seed=[seed, s], ctx=ctx)
 
     # Get rejection decision, by checking whether the treatment coefficients'
     # t-statistics are outside of the confidence intervals calculated under the
@@ -440,17 +449,10 @@ def power_iter(s, N=N, F_v=F_v, F_i=F_i, mu_T=mu_T, I_v=I_v, imp0=imp0, B=B,
 # Record the time this started
 time_start = time.time()
 
-# Check whether to run this in parallel
-if parsim:
-    # If so, get number of available cores
-    ncores = cpu_count()
-
-    # Go through all simulations in parallel, save rejection rates
-    R = Parallel(n_jobs=ncores)(
-        delayed(power_iter)(s, seed=666) for s in range(S))
-else:
-    # Go through all simulations in sequence, save rejection rates
-    R = [power_iter(s) for s in range(S)]
+# Go through all simulations, in chunks (see run_chunked() in linreg.py),
+# running them in parallel if the execution context says so, and save rejection
+# rates (this gives the same results regardless of how many cores get used)
+R = run_chunked(power_iter, S, {'seed': 666, 'ctx': ctx}, index='s', ctx=ctx)
 
 # Record the time this was done
 time_end = time.time()
@@ -460,7 +462,7 @@ duration = np.around(time_end - time_start, nround)
 
 # Make these into a proper matrix (this will be [e,S], which means I can take
 # the mean along the second dimension later)
-R = np.concatenate(R, axis=1)
+R = R[:,:,0].transpose()
 
 # Get simulated power as rate at which true null was rejected across simulations
 kappa_hat = larry(R.mean(axis=1))
@@ -470,4 +472,5 @@ print()
 print('Simulated power:')
 print('Any treatment vs. control:', np.around(kappa_hat[1,0], nround))
 print("'High' treatment vs. 'low' treatment:", np.around(kappa_hat[2,0], nround))
+print('Parallel level:', ctx['level'], '| Processes:', ctx['n_jobs'])
 print('Time elapsed:', duration, 'seconds')
@@ -4,11 +4,15 @@
 
 # Import necessary packages
 import numpy as np
-import pandas as pd
+import time
+from contextlib import nullcontext
 from joblib import Parallel, delayed
 from multiprocessing import cpu_count
-from numpy.linalg import solve
+from numpy.linalg import LinAlgError
+from scipy.linalg.lapack import dpotrf, dpotrs
+from scipy.sparse import csr_matrix
 from scipy.stats import norm
+from threadpoolctl import ThreadpoolController
 
 ################################################################################
 ### Part 2: Auxiliary functions
@@ -38,13 +42,263 @@ def larry(x):
     # Return the array
     return X
 
+# This function sets up everything needed to sum variables within clusters,
+# which is a sparse [J,n] matrix of cluster indicators D, where D[j,i] = 1 if
+# observation i is in cluster j. Summing any [n,k] matrix S within clusters is
+# then just D @ S, and when the same clusters get used over and over (e.g. in a
+# bootstrap), D only has to be set up once
+def cluster_index(clustvar):
+    # Inputs
+    # clustvar: [n,1] vector, cluster variable
+    #
+    # Outputs
+    # clusters: dictionary, with the cluster indicators ('D'), the cluster of
+    #           each observation, numbered from 0 to J-1 ('codes'), and the
+    #           number of clusters ('J')
+
+    # Number the clusters
+    _, codes = np.unique(clustvar[:,0], return_inverse=True)
+    codes = codes.reshape(-1)
+
+    # Get number of observations n and number of clusters J
+    n, J = len(codes), codes.max() + 1
+
+    # Set up the cluster indicators
+    D = csr_matrix((np.ones(n), (codes, np.arange(n))), shape=(J,n))
+
+    # Return the cluster index
+    return {'D': D, 'codes': codes, 'J': J}
+
+# This function gets the random number generator for replication b of a
+# simulation, bootstrap, permutation test, etc. that uses the given seed. Each
+# replication gets its own stream (the b-th child of SeedSequence(seed), see
+# SeedSequence.spawn()), which is statistically independent of all others, and
+# only depends on seed and b, so results are the same no matter how
+# replications are split across workers, or in which order they are run
+def rng_stream(seed, b):
+    # Inputs
+    # seed: scalar or list of scalars, seed for the whole simulation (a list
+    #       can be used to combine several seeds, e.g. [666, s] to get separate
+    #       bootstrap streams for simulation s)
+    # b: scalar, index of the replication
+    #
+    # Outputs
+    # rng: Numpy Generator, random number generator for this replication
+
+    # Return the generator
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(b,)))
+
+# Set up the list for the thread pool controller blas_limit() uses, which it
+# sets up the first time it gets called in a process (the controller can't be
+# sent to worker processes, so each of them needs its own)
+controller = []
+
+# This function limits the number of threads BLAS (which Numpy and Scipy use
+# for matrix products, Cholesky factorizations, etc.) can use, for as long as
+# the context manager it returns is active, e.g. with blas_limit(1): ...
+def blas_limit(threads):
+    # Inputs
+    # threads: scalar, maximum number of BLAS threads (no limit if None)
+    #
+    # Outputs
+    # limit: context manager, sets the limit while it's active
+
+    # Check whether there is a limit
+    if threads is None:
+        # If not, return a context manager that does nothing
+        return nullcontext()
+
+    # Set up the controller, unless that was done already (setting it up takes
+    # a while, since it has to look for all loaded BLAS libraries, but using
+    # it afterwards is very cheap)
+    if not controller:
+        controller.append(ThreadpoolController())
+
+    # Return the limit
+    return controller[0].limit(limits=threads, user_api='blas')
+
+# This function sets up an execution context for a simulation with S
+# replications, each of which runs a bootstrap with B iterations (or anything
+# else with two nested levels of replications). It decides which level gets
+# run in parallel, so that the other level doesn't also try to start worker
+# processes (which would give each core several processes competing for it),
+# and how many BLAS threads each process gets (so processes don't compete for
+# cores that way either). The outer level gets parallelized if there are at
+# least as many simulations as cores (or as bootstrap iterations), since it has
+# the larger tasks, and the inner level otherwise. The context is a dictionary,
+# which gets passed down to the functions running each level (see run_chunked(),
+# boot_ols(), and ols()); worker processes get its 'worker' entry instead,
+# which makes sure they don't start processes of their own
+def exec_context(S, B, n_jobs=None):
+    # Inputs
+    # S: scalar, number of outer replications (e.g. simulations)
+    # B: scalar, number of inner replications (e.g. bootstrap iterations) per
+    #    outer replication
+    # n_jobs: scalar, number of cores to use (all cores if None; with 1,
+    #         everything runs in this process)
+    #
+    # Outputs
+    # ctx: dictionary, with the level that gets run in parallel ('level',
+    #      either 'outer', 'inner', or None), the number of processes for it
+    #      ('n_jobs'), the number of BLAS threads for this process ('blas'),
+    #      the pool of worker processes ('pool', a joblib Parallel object, or
+    #      None), and the context for worker processes ('worker', which has the
+    #      number of BLAS threads for each worker, and no level or pool)
+
+    # Use all cores if the number isn't specified, and keep track of how many
+    # cores there are to go around
+    if n_jobs is None:
+        n_jobs = cpu_count()
+    cores = n_jobs
+
+    # Check which level to run in parallel
+    if n_jobs == 1 or (S == 1 and B == 1):
+        # With only one core (or nothing to split up), don't run anything in
+        # parallel
+        level = None
+        n_jobs = 1
+    elif S >= n_jobs or S >= B:
+        # With enough outer replications to keep all cores busy, parallelize
+        # those, since they're the larger tasks
+        level = 'outer'
+
+        # Don't start more processes than there are outer replications
+        n_jobs = min(n_jobs, S)
+    else:
+        # Otherwise, parallelize the inner level
+        level = 'inner'
+
+    # Set up the context for worker processes, where the cores get split
+    # evenly across processes (this is its own worker context, since workers
+    # never start any processes themselves)
+    worker = {'level': None, 'n_jobs': 1, 'blas': max(cores // n_jobs, 1),
+              'pool': None}
+    worker['worker'] = worker
+
+    # Set up the pool of worker processes (joblib keeps the processes around
+    # between calls, so all chunks sent to it run in the same processes)
+    pool = Parallel(n_jobs=n_jobs) if level is not None else None
+
+    # Return the context (this process can use all cores, since it only does
+    # work while the worker processes are idle)
+    return {'level': level, 'n_jobs': n_jobs, 'blas': cores, 'pool': pool,
+            'worker': worker}
+
+# This function runs replications b0 to b1-1 of a simulation, bootstrap,
+# permutation test, etc. one after the other, and returns the results as a
+# single array (which is much cheaper to send back from a worker process than a
+# list of many small results)
+def run_chunk(func, b0, b1, kwargs, index='b', blas=None):
+    # Inputs
+    # func: function, runs one replication
+    # b0: scalar, index of the first replication to run
+    # b1: scalar, index after the last replication to run
+    # kwargs: dictionary, arguments for func which are the same for all
+    #         replications
+    # index: string, name of the argument of func which gets the index of the
+    #        replication
+    # blas: scalar, maximum number of BLAS threads to use (see blas_limit())
+    #
+    # Outputs
+    # res: [b1-b0,...] array, results of each replication, stacked along the
+    #      first dimension
+
+    # Run the replications, and return their results
+    with blas_limit(blas):
+        return np.array([func(**kwargs, **{index: b}) for b in range(b0, b1)])
+
+# This function runs R replications of a simulation, bootstrap, permutation
+# test, etc. in parallel, by splitting them into chunks of consecutive
+# replications, and sending each chunk to a worker process as one task. That
+# way, the arguments which are the same for all replications only get sent once
+# per chunk (and large arrays among them only once overall, since joblib
+# memory maps those), instead of once per replication. Since each replication
+# should get its random numbers from rng_stream(), the results don't depend on
+# the chunk size or the number of processes
+def run_chunked(func, R, kwargs, index='b', n_jobs=None, chunk=None,
+                target=.2, pilot=2, ctx=None, level='outer'):
+    # Inputs
+    # func, kwargs, index: see run_chunk()
+    # R: scalar, number of replications
+    # n_jobs: scalar, number of worker processes (all cores if None; ignored
+    #         if ctx is given)
+    # chunk: scalar, number of replications per chunk. If None, this gets
+    #        chosen automatically, as the larger of (1) the chunk size which
+    #        gives about four chunks per process, so processes that finish
+    #        early can pick up more work, and (2) the number of replications it
+    #        takes to keep a process busy for target seconds, so sending tasks
+    #        doesn't take longer than doing them
+    # target: scalar, minimum time per chunk, in seconds
+    # pilot: scalar, number of replications to run in this process first, to
+    #        time them (their results get used, so nothing is wasted)
+    # ctx: dictionary, execution context (see exec_context()). If this is
+    #      given, the replications only run in parallel if ctx says this level
+    #      should be, using its pool of worker processes, and if ctx is one of
+    #      the arguments in kwargs, worker processes get ctx['worker'] instead
+    # level: string, level these replications are at, either 'outer' or
+    #        'inner' (only used if ctx is given)
+    #
+    # Outputs
+    # res: [R,...] array, results of each replication, stacked along the first
+    #      dimension
+
+    # Check whether there is an execution context
+    if ctx is not None:
+        # If so, use its pool if this level should run in parallel, and run
+        # everything here otherwise
+        n_jobs = ctx['n_jobs'] if ctx['level'] == level else 1
+        pool = ctx['pool']
+
+        # Set the number of BLAS threads for this process and for workers
+        blas, blas_w = ctx['blas'], ctx['worker']['blas']
+
+        # Hand workers their own context
+        kwargs_w = {key: (ctx['worker'] if x is ctx else x)
+                    for key, x in kwargs.items()}
+    else:
+        # Otherwise, use all cores if the number of processes isn't specified,
+        # and set up a pool of that many processes
+        if n_jobs is None:
+            n_jobs = cpu_count()
+        pool = Parallel(n_jobs=n_jobs)
+
+        # Don't limit BLAS threads
+        blas, blas_w = None, None
+        kwargs_w = kwargs
+
+    # Run the pilot replications, and time them
+    b0 = min(pilot, R)
+    time_start = time.time()
+    res = [run_chunk(func, 0, b0, kwargs, index, blas)]
+    t_rep = (time.time() - time_start) / max(b0, 1)
+
+    # Check whether the chunk size needs to be chosen
+    if chunk is None:
+        chunk = max(int(np.ceil((R - b0) / (4 * n_jobs))),
+                    int(np.ceil(target / max(t_rep, 1e-9))), 1)
+
+    # Check whether there is more than one chunk left to do, and more than one
+    # process to do them
+    if n_jobs > 1 and R - b0 > chunk:
+        # If so, run the chunks in parallel
+        res = res + pool(
+            delayed(run_chunk)(func, c, min(c + chunk, R), kwargs_w, index,
+                               blas_w)
+            for c in range(b0, R, chunk))
+    elif R > b0:
+        # Otherwise, just run the rest here
+        res.append(run_chunk(func, b0, R, kwargs, index, blas))
+
+    # Return the results
+    return np.concatenate(res, axis=0)
+
 ################################################################################
 ### Part 3: Regression models
 ################################################################################
 
 # This function just runs a standard linear regression of y on X
 def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
-        clustvar=None):
+        clustvar=None, ctx=None):
     # Inputs
     # y: [n,1] vector, LHS variables
     # X: [n,k] matrix, RHS variables
@@ -58,6 +312,11 @@ def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
     #        separately
     # get_p: boolean, if true, calculate the p-values for a two-sided test of
     #        beta[i] = 0, for each element of the coefficient vector separately
+    # clustvar: [n,1] vector, cluster variable (only used if cov_est is
+    #           cluster), or the output of cluster_index() for it, which saves
+    #           setting that up if the same clusters get used repeatedly
+    # ctx: dictionary, execution context (see exec_context()), which sets the
+    #      number of BLAS threads to use
     #
     # Outputs:
     # beta_hat: [k,1] vector, coefficient estimates
@@ -65,6 +324,13 @@ def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
     # t: [k,1] vector, t-statistics
     # p: [k,1] vector, p-values
 
+    # If there is an execution context, run this again within its limit on BLAS
+    # threads
+    if ctx is not None:
+        with blas_limit(ctx['blas']):
+            return ols(y, X, get_cov=get_cov, cov_est=cov_est, get_t=get_t,
+                       get_p=get_p, clustvar=clustvar)
+
     # If p-values are necessary, then t-statistics will be needed
     if get_p and not get_t:
         get_t = True
@@ -76,9 +342,18 @@ def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
     # Get number of observations n and number of coefficients k
     n, k = X.shape[0], X.shape[1]
 
+    # Get the Cholesky factorization of X'X (which is all that's needed to apply
+    # (X'X)^(-1) to anything, without ever calculating the inverse itself;
+    # this calls LAPACK directly, since for small samples, the overhead of
+    # going through Scipy's wrappers would take longer than the actual work)
+    XX, info = dpotrf(X.transpose() @ X)
+
+    # Make sure that worked, which it won't if X doesn't have full column rank
+    if info != 0:
+        raise LinAlgError('X\'X is not positive definite')
+
     # Calculate OLS coefficients
-    XXinv = solve(X.transpose() @ X, np.eye(k))  # Calculate (X'X)^(-1)
-    beta_hat = XXinv @ (X.transpose() @ y)
+    beta_hat = dpotrs(XX, X.transpose() @ y)[0]
 
     # Check whether covariance is needed
     if get_cov:
@@ -89,30 +364,40 @@ def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
         if cov_est == 'hmsd':
             # For the homoskedastic estimator, just calculate the standard
             # variance
-            V_hat = ( 1 / (n - k) ) * XXinv * (U_hat.transpose() @ U_hat)
+            V_hat = (
+                ( 1 / (n - k) ) * dpotrs(XX, np.eye(k))[0]
+                * (U_hat.transpose() @ U_hat))
         elif cov_est == 'hc1':
             # Calculate component of middle part of EHW sandwich,
             # S_i = X_i u_i, which makes it very easy to calculate
-            # sum_i X_i X_i' u_i^2 = S'S)
-            S = ( U_hat @ np.ones(shape=(1,k)) ) * X
-
-            # Calculate EHW variance/covariance matrix
-            V_hat = ( n / (n - k) ) * XXinv @ (S.transpose() @ S) @ XXinv
+            # sum_i X_i X_i' u_i^2 = S'S; broadcasting the residuals across
+            # the columns of X avoids setting up an [n,k] matrix of copies)
+            S = U_hat * X
+
+            # Calculate EHW variance/covariance matrix, by applying (X'X)^(-1)
+            # to S'S, and then to the transpose of the result (which gives
+            # (X'X)^(-1) S'S (X'X)^(-1), since both are symmetric)
+            V_hat = dpotrs(XX, S.transpose() @ S)[0]
+            V_hat = (
+                ( n / (n - k) )
+                * dpotrs(XX, V_hat.transpose())[0])
         elif cov_est == 'cluster':
-            # Calculate number of clusters
-            J = len(np.unique(clustvar))
+            # Set up the cluster index, unless that was done already
+            if not isinstance(clustvar, dict):
+                clustvar = cluster_index(clustvar)
 
-            # Same thing as S above, but needs to be a DataFrame, because pandas
-            # has the groupby method, which is needed in the next step
-            S = pd.DataFrame((U_hat @ np.ones(shape=(1,k))) * X)
+            # Get number of clusters
+            J = clustvar['J']
 
-            # Sum all covariates within clusters
-            S = S.groupby(clustvar[:,0], axis=0).sum().values
+            # Same thing as S above, but summed within clusters
+            S = clustvar['D'] @ (U_hat * X)
 
-            # Calculate cluster-robust variance estimator
+            # Calculate cluster-robust variance estimator (the same way as the
+            # EHW one above)
+            V_hat = dpotrs(XX, S.transpose() @ S)[0]
             V_hat = (
                 ( n / (n - k) ) * ( J / (J - 1) )
-                * XXinv @ (S.transpose() @ S) @ XXinv)
+                * dpotrs(XX, V_hat.transpose())[0])
         else:
             # Print an error message
             print('Error in ',ols.__name__,'(): The specified covariance '
@@ -161,12 +446,12 @@ def ols(y, X, get_cov=True, cov_est='hc1', get_t=True, get_p=True,
 
 # Define one iteration of the Cameron, Gelbach, and Miller (2008) cluster robust
 # wild bootstrap with the null imposed
-def b_iter_cgm0(y, X, e_hat, beta_hat_R, CV, J, seed):
-    # Set random number generator's seed
-    np.random.seed(seed)
+def b_iter_cgm0(y, X, e_hat, beta_hat_R, CV, J, seed, b, clusters=None):
+    # Get the random number generator for this iteration (see rng_stream())
+    rng = rng_stream(seed, b)
 
     # To get Rademacher disturbances, draw Bernoulli random variables
-    eta = np.random.binomial(1, .5, size=J)
+    eta = rng.binomial(1, .5, size=J)
 
     # Then, change zeros to -1, and convert to a proper (column) vector
     eta = larry(eta - (eta == 0))
@@ -180,25 +465,159 @@ def b_iter_cgm0(y, X, e_hat, beta_hat_R, CV, J, seed):
     # Get LHS variable for this bootstrap iteration
     ystar = X @ beta_hat_R + estar
 
+    # Use the cluster index, if one was provided (see cluster_index()), since
+    # that's the same for every iteration, and the cluster variable otherwise
+    if clusters is None:
+        clusters = CV
+
     # Get t-statistic for this iteration
     _, _, tstar = ols(ystar, X, get_cov=True, cov_est='cluster', get_t=True,
-                      get_p=False, clustvar=CV)
+                      get_p=False, clustvar=clusters)
 
     # Return the t-statistic for this bootstrap iteration
     return tstar
 
 ################################################################################
-### 4.2: Running algorithms
+### 4.2: All iterations at once
 ################################################################################
 
-# Define a function to bootstrap confidence intervals for OLS
-def boot_ols(y, X, alg='cgm0', B=4999, alpha=.05, clustvar=None, imp0=None,
-             b0=0, seed=0, par=True):
-    # Get number of available cores
-    ncores = cpu_count()
+# Draw Rademacher disturbances for the Cameron, Gelbach, and Miller (2008)
+# cluster robust wild bootstrap, in exactly the same way as b_iter_cgm0() does
+def rademacher_cgm0(J, seed, B):
+    # Inputs
+    # J: scalar, number of clusters
+    # seed: scalar or list of scalars, seed for the bootstrap (see rng_stream())
+    # B: scalar, number of iterations
+    #
+    # Outputs
+    # eta: [J,B] matrix, disturbances, one column per iteration
+
+    # Set up matrix of disturbances
+    eta = np.zeros(shape=(J,B))
+
+    # Go through all iterations, and draw Bernoulli random variables
+    for b in range(B):
+        eta[:,b] = rng_stream(seed, b).binomial(1, .5, size=J)
+
+    # Change zeros to -1, and return the disturbances
+    return eta - (eta == 0)
+
+# Get all 2^J possible vectors of Rademacher disturbances, which with few
+# clusters is both faster and more precise than drawing them at random, since
+# that would draw many of them more than once anyway
+def rademacher_all(J):
+    # Inputs
+    # J: scalar, number of clusters
+    #
+    # Outputs
+    # eta: [J,2^J] matrix, disturbances, one column per iteration
+
+    # Use the binary representation of 0 to 2^J - 1, where the j-th bit
+    # specifies whether cluster j gets a 1 or a -1
+    eta = (np.arange(2**J)[None,:] >> np.arange(J)[:,None]) & 1
+
+    # Change zeros to -1, and return the disturbances
+    return (2 * eta - 1).astype(float)
+
+# Define all iterations of the Cameron, Gelbach, and Miller (2008) cluster
+# robust wild bootstrap with the null imposed at once, for given disturbances
+# (see rademacher_cgm0() and rademacher_all()). Since X never changes, the
+# bootstrap coefficients are just
+# beta*_b = beta_hat_R + (X'X)^(-1) X' (e_hat * eta_b), and the cluster sums of
+# the scores at the bootstrap residuals are
+# s_jb = eta_jb X_j'e_j - X_j'X_j (beta*_b - beta_hat_R), so everything only
+# depends on the data through X'X and the cluster level X_j'e_j and X_j'X_j.
+# Those get calculated once, after which each iteration only takes O(J k^2)
+# operations, regardless of the number of observations (this is the same idea
+# as in Roodman et al. (2019), Fast and wild: Bootstrap inference in Stata
+# using boottest)
+def b_all_cgm0(X, e_hat, beta_hat_R, clusters, eta, block=1000):
+    # Inputs
+    # X: [n,k] matrix, RHS variables
+    # e_hat: [n,1] vector, residuals from the unrestricted regression
+    # beta_hat_R: [k,1] vector, restricted coefficient estimates
+    # clusters: dictionary, output of cluster_index() for the cluster variable,
+    #           where the cluster variable has to take on the values 0 to J-1
+    #           (since that's what b_iter_cgm0() assumes)
+    # eta: [J,B] matrix, disturbances, one column per iteration
+    # block: scalar, number of iterations to do at once (the temporary arrays
+    #        this needs are [J,block,k])
+    #
+    # Outputs
+    # Tb: [k,B] matrix, bootstrapped t-statistics
+
+    # Get number of observations n, coefficients k, clusters J, and iterations
+    # B
+    n, k = X.shape
+    J, B = eta.shape
+
+    # Get the Cholesky factorization of X'X (see ols()), and calculate
+    # (X'X)^(-1), which gets used for every iteration
+    XX, info = dpotrf(X.transpose() @ X)
+    if info != 0:
+        raise LinAlgError('X\'X is not positive definite')
+    XXinv = dpotrs(XX, np.eye(k))[0]
+
+    # Calculate X_j'e_j for each cluster ([J,k])
+    G = clusters['D'] @ (e_hat * X)
 
-    # Check which algorithm to use
-    if alg =='cgm0':  # Cameron, Gelbach, and Miller (2008)
+    # Calculate X_j'X_j for each cluster ([J,k,k])
+    H = (
+        (clusters['D'] @ (X[:,:,None] * X[:,None,:]).reshape(n, k*k))
+        .reshape(J, k, k))
+
+    # Get the change in coefficients relative to beta_hat_R for all iterations
+    # ([k,B])
+    A = (XXinv @ G.transpose()) @ eta
+
+    # Set degrees of freedom correction for the cluster robust variance
+    # estimator (see ols())
+    dfc = ( n / (n - k) ) * ( J / (J - 1) )
+
+    # Set up matrix of bootstrapped t-statistics
+    Tb = np.zeros(shape=(k,B))
+
+    # Go through blocks of iterations
+    for b0 in range(0, B, block):
+        # Get the iterations in this block
+        b1 = min(b0 + block, B)
+
+        # Calculate cluster sums of the scores ([J,block,k])
+        S = (
+            eta[:,b0:b1,None] * G[:,None,:]
+            - (H @ A[:,b0:b1]).transpose(0,2,1))
+
+        # Get the diagonal of (X'X)^(-1) S'S (X'X)^(-1) for each iteration,
+        # which is the sum across clusters of the squared elements of
+        # (X'X)^(-1) s_jb ([k,block])
+        V = dfc * np.sum((S @ XXinv)**2, axis=0).transpose()
+
+        # Calculate t-statistics
+        Tb[:,b0:b1] = (beta_hat_R + A[:,b0:b1]) / np.sqrt(V)
+
+    # Return the bootstrapped t-statistics
+    return Tb
+
+################################################################################
+### 4.3: Running algorithms
+################################################################################
+
+# Define a function to bootstrap confidence intervals for OLS (with
+# alg='cgm0_fast', setting enum=True uses all 2^J possible vectors of cluster
+# level disturbances instead of B random ones, as long as 2^J <= B). If this
+# runs inside a larger simulation, ctx should be the simulation's execution
+# context (see exec_context()), which decides whether the bootstrap iterations
+# get run in parallel; otherwise, par decides that
+def boot_ols(y, X, alg='cgm0', B=4999, alpha=.05, clustvar=None, imp0=None,
+             b0=0, seed=0, par=True, enum=False, ctx=None):
+    # If there is no execution context, set one up for just this bootstrap,
+    # using all available cores if it should run in parallel
+    if ctx is None:
+        ctx = exec_context(1, B, n_jobs=(None if par else 1))
+
+    # Check which algorithm to use (cgm0_fast is the same algorithm, just doing
+    # all iterations at once, see b_all_cgm0())
+    if alg in ['cgm0', 'cgm0_fast']:  # Cameron, Gelbach, and Miller (2008)
         # Get length of coefficient vectors
         k = X.shape[1]
 
@@ -208,9 +627,13 @@ def boot_ols(y, X, alg='cgm0', B=4999, alpha=.05, clustvar=None, imp0=None,
         # Set cluster variable
         CV = clustvar
 
+        # Set up the cluster index once, rather than in every iteration
+        CL = cluster_index(CV)
+
         # Get original sample unrestricted coefficient estimate and t-statistic
         beta_hat, _, t_hat = ols(y, X, get_cov=True, cov_est='cluster',
-                                 get_t=True, get_p=False, clustvar=CV)
+                                 get_t=True, get_p=False, clustvar=CL,
+                                 ctx=ctx)
 
         # Get indicator for unrestricted elements of coefficient vector
         unrest = (imp0 == 0)
@@ -227,26 +650,40 @@ def boot_ols(y, X, alg='cgm0', B=4999, alpha=.05, clustvar=None, imp0=None,
         # Replace unrestricted elements with original sample restricted
         # coefficient estimates
         beta_hat_R[unrest[:,0], :] = ols(y, X_R, get_cov=False, get_t=False,
-                                        get_p=False)
+                                        get_p=False, ctx=ctx)
 
         # Get residuals
         e_hat = y - X @ beta_hat
 
-        # Check whether to use parallel computing
-        if par:
-            # Get matrix of bootstrapped t-statistics (for now, this will be a
-            # list), using parallel computing
-            Tb = Parallel(n_jobs=ncores)(
-                delayed(b_iter_cgm0)(y=y, X=X, e_hat=e_hat,
-                                     beta_hat_R=beta_hat_R, CV=CV, J=J,
-                                     seed=seed+b) for b in range(B))
+        # Check whether to do all iterations at once
+        if alg == 'cgm0_fast':
+            # Check whether to use all possible disturbances, which happens if
+            # that was requested and there aren't more of them than iterations
+            if enum and 2**J <= B:
+                # Get all of them, and adjust the number of iterations
+                eta = rademacher_all(J)
+                B = eta.shape[1]
+            else:
+                # Otherwise, draw them
+                eta = rademacher_cgm0(J, seed, B)
+
+            # Get matrix of bootstrapped t-statistics (this runs in this
+            # process, so it can use as many BLAS threads as the context
+            # allows it)
+            with blas_limit(ctx['blas']):
+                Tb = b_all_cgm0(X=X, e_hat=e_hat, beta_hat_R=beta_hat_R,
+                                clusters=CL, eta=eta)
         else:
-            # Otherwise, do it in sequence
-            Tb = [b_iter_cgm0(y=y, X=X, e_hat=e_hat, beta_hat_R=beta_hat_R,
-                              CV=CV, J=J, seed=seed+b) for b in range(B)]
-
-        # Convert list to actual matrix (this is [k,B])
-        Tb = np.concatenate(Tb, axis=1)
+            # Otherwise, get the bootstrapped t-statistics in chunks of
+            # iterations, in parallel if the context says the inner level
+            # should be (see run_chunked()), and convert them to a matrix (this
+            # is [k,B])
+            Tb = run_chunked(b_iter_cgm0, B,
+                             {'y': y, 'X': X, 'e_hat': e_hat,
+                              'beta_hat_R': beta_hat_R, 'CV': CV, 'J': J,
+                              'seed': seed, 'clusters': CL},
+                             ctx=ctx, level='inner')
+            Tb = Tb[:,:,0].transpose()
 
         # Set up matrix of confidence intervals
         CI = np.zeros(shape=(k,2))
@@ -256,9 +693,11 @@ def boot_ols(y, X, alg='cgm0', B=4999, alpha=.05, clustvar=None, imp0=None,
             # Get the bootstrapped t-statistics for the current coefficient
             Tbi = np.sort(Tb[i,:])
             # Get the upper and lower bounds of the alpha level confidence
-            # interval
-            CI[i,:] = [Tbi[np.int((alpha/2) * (B+1))],
-                       Tbi[np.int((1 - alpha/2) * (B+1))]]
+            # interval (with few iterations, which happens if all 2^J
+            # disturbances get used and J is small, the upper index can be past
+            # the end, in which case this uses the largest t-statistic)
+            CI[i,:] = [Tbi[min(int((alpha/2) * (B+1)), B-1)],
+                       Tbi[min(int((1 - alpha/2) * (B+1)), B-1)]]
 
         # Return the point estimate, t-statistic, and confidence intervals
         return beta_hat, t_hat, CI
@@ -1,15 +1,25 @@
 # Import necessary packages
 import numpy as np
-from numpy.linalg import solve
+from numpy.linalg import LinAlgError
+from scipy.linalg.lapack import dpotrf, dpotrs
 
 # This function just runs a standard linear regression of y on X
 def ols(y, X, get_cov=True, cov_est='hc1'):
     # Get number of observations n and number of coefficients k
     n, k = X.shape[0], X.shape[1]
 
+    # Get the Cholesky factorization of X'X (which is all that's needed to apply
+    # (X'X)^(-1) to anything, without ever calculating the inverse itself;
+    # this calls LAPACK directly, since for small samples, the overhead of
+    # going through Scipy's wrappers would take longer than the actual work)
+    XX, info = dpotrf(X.transpose() @ X)
+
+    # Make sure that worked, which it won't if X doesn't have full column rank
+    if info != 0:
+        raise LinAlgError('X\'X is not positive definite')
+
     # Calculate OLS coefficients
-    XXinv = solve(X.transpose() @ X, np.eye(k))  # Calculate (X'X)^(-1)
-    beta_hat = XXinv @ (X.transpose() @ y)
+    beta_hat = dpotrs(XX, X.transpose() @ y)[0]
 
     # Check whether covariance is needed
     if get_cov:
@@ -19,15 +29,23 @@ def ols(y, X, get_cov=True, cov_est='hc1'):
         # Check which covariance estimator to use
         if cov_est == 'hmsd':
             # For the homoskedastic estimator, just calculate the standard variance
-            V_hat = ( 1 / (n - k) ) * XXinv * (U_hat.transpose() @ U_hat)
+            V_hat = (
+                ( 1 / (n - k) ) * dpotrs(XX, np.eye(k))[0]
+                * (U_hat.transpose() @ U_hat))
         elif cov_est == 'hc1':
             # Calculate component of middle part of EHW sandwich,
             # S_i = X_i u_i, which makes it very easy to calculate
-            # sum_i X_i X_i' u_i^2 = S'S)
-            S = ( U_hat @ np.ones(shape=(1,k)) ) * X
+            # sum_i X_i X_i' u_i^2 = S'S; broadcasting the residuals across
+            # the columns of X avoids setting up an [n,k] matrix of copies)
+            S = U_hat * X
 
-            # Calculate EHW variance/covariance matrix
-            V_hat = ( n / (n - k) ) * XXinv @ (S.transpose() @ S) @ XXinv
+            # Calculate EHW variance/covariance matrix, by applying (X'X)^(-1)
+            # to S'S, and then to the transpose of the result (which gives
+            # (X'X)^(-1) S'S (X'X)^(-1), since both are symmetric)
+            V_hat = dpotrs(XX, S.transpose() @ S)[0]
+            V_hat = (
+                ( n / (n - k) )
+                * dpotrs(XX, V_hat.transpose())[0])
         else:
             # Print an error message
             print('Error in ',ols.__name__,'(): The specified covariance '
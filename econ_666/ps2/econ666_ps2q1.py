@@ -11,7 +11,6 @@ import pandas as pd
 import re
 import requests
 from inspect import getsourcefile
-from joblib import Parallel, delayed
 from multiprocessing import cpu_count
 from os import chdir, mkdir, path
 from shutil import copyfile, rmtree
@@ -29,7 +28,7 @@ mdir = path.dirname(path.abspath(getsourcefile(lambda:0))).replace('\\', '/')
 chdir(mdir)
 
 # Import custom packages (have to be in the main directory)
-from linreg import ols
+from linreg import ols, ols_many, rng_stream, run_chunked
 
 ################################################################################
 ### Part 1: Define necessary functions
@@ -108,7 +107,7 @@ def holm_bonferroni(p, alpha=.05, order='F'):
 # Define a function to do one interation of the free step down resampling
 # algorithm (that is, one treatment reassignment plus calculating the
 # corresponding p-values)
-def permute_p(Y, Isamp, ntreat, balvars, prank, X=None, Z=None, seed=1,
+def permute_p(Y, Isamp, ntreat, balvars, prank, X=None, Z=None, seed=1, r=0,
     Breg=10, breg_icept=True, cov_est='hmsd', order='F', shape=None):
     # Inputs
     # Y: [N,M] matrix, data for each of the M outcomes in the family
@@ -125,7 +124,11 @@ def permute_p(Y, Isamp, ntreat, balvars, prank, X=None, Z=None, seed=1,
     #    regressions, but without saving their p-values
     # Z: [N,E] matrix, data for covariates of interest, will be included in the
     #    estimations, and their p-values will be recorded
-    # seed: scalar, random number generator's seed
+    # seed: scalar or list of scalars, seed for the whole randomization
+    #       procedure (see rng_stream() in linreg.py)
+    # r: scalar, index of this iteration, which together with seed determines
+    #    the random number generator it uses (this isn't called b, since that's
+    #    the index of the balancing regressions below)
     # Breg: scalar, number of balancing regressions to use
     # breg_icept: boolean, if true, balancing regressions will include an
     #             intercept
@@ -140,8 +143,8 @@ def permute_p(Y, Isamp, ntreat, balvars, prank, X=None, Z=None, seed=1,
     #         whether shape was specified,  permutation p-values for one
     #         iteration of the free step-down randomization
 
-    # Set random number generator's seed
-    np.random.seed(seed)
+    # Get the random number generator for this iteration
+    rng = rng_stream(seed, r)
 
     # Get total sample size N and number of outcome variables M
     N, M = Y.shape
@@ -180,7 +183,7 @@ def permute_p(Y, Isamp, ntreat, balvars, prank, X=None, Z=None, seed=1,
         # normal distribution, getting the rank (adjusting by +1 to account for
         # Python's zero indexing), and assigning everyone with a rank equal to
         # or below the number of treated units to treatment
-        Wb = np.random.normal(size=(N,1))
+        Wb = rng.normal(size=(N,1))
         Wb = np.array((Wb[:,0].argsort() + 1 <= ntreat), ndmin=2).transpose()
 
         # Set up vector of t-statistics for this treatment assignment
@@ -228,39 +231,31 @@ def permute_p(Y, Isamp, ntreat, balvars, prank, X=None, Z=None, seed=1,
             # Save the treatment assignment
             W = Wb
 
-    # Set up a vector of p-values, one for each outcome variable and coefficient
-    # of interest
-    pstar = np.zeros(shape=(T,1))
+    # Make an index of where both each member and all parts of X are not NaN,
+    # and only get units in the estimation sample, i.e. where Isamp == 1 (one
+    # column per member)
+    I = (~np.isnan(Y) & ~np.isnan(X.sum(axis=1, keepdims=True))
+         & np.array(Isamp, ndmin=2).transpose())
 
-    # Go through all members in the family
-    for i in range(T):
-        # Make an index of where both the member and all parts of X are not NaN,
-        # and only get units in the estimation sample, i.e. where Isamp == 1
-        I = (~np.isnan(Y[:,i]) & ~np.isnan(X.sum(axis=1)) & Isamp)
-
-        # Get the number of effective observations
-        n = I.sum()
-
-        # Get outcome variable, i.e. the current member of the family, for those
-        # observations with non-missing data for both LHS and RHS variables
-        y = np.array(Y[I,i], ndmin=2).transpose()
-
-        # Make a matrix of RHS variables. If X was specified, add it to the
-        # treatment assignment
-        if X is not None:
-            Xstar = np.concatenate((X[I], W[I]), axis=1)
-        else:
-            Xstar = W[I]
+    # Make a matrix of RHS variables. If X was specified, add it to the
+    # treatment assignment
+    if X is not None:
+        Xstar = np.concatenate((X, W), axis=1)
+    else:
+        Xstar = W
 
-        # If Z was specified, add it in after the treatment assignment
-        if Z is not None:
-            Xstar = np.concatenate((Xstar, Z[I]), axis=1)
+    # If Z was specified, add it in after the treatment assignment
+    if Z is not None:
+        Xstar = np.concatenate((Xstar, Z), axis=1)
 
-        # Run OLS
-        _, _, _, p = ols(y, Xstar, cov_est=cov_est)
+    # Run OLS for all members in the family at once, each using the
+    # observations with non-missing data for both LHS and RHS variables
+    _, _, _, p = ols_many(Y, Xstar, masks=I, cov_est=cov_est)
 
-        # Save only p-values of interest
-        pstar[i,:] = p[cidx]
+    # Save only p-values of interest, as a vector with one element for each
+    # outcome variable and coefficient of interest (going through all members
+    # for the first coefficient of interest, then the second, and so on)
+    pstar = np.array(p[cidx,:].flatten(), ndmin=2).transpose()
     # Reorder p-values in the original order (lowest to highest)
     pstar_reord = pstar[prank]
 
@@ -720,35 +715,28 @@ for f, family in enumerate(neighborhood):
     SE = np.zeros(shape=(M,k))
     p_unadj = np.zeros(shape=(M,k))
 
-    # Set up vector of sample sizes
-    N = np.zeros(shape=(M,1))
+    # Make an index of where both each member and all parts of X are not NaN
+    # (one column per member)
+    I = (~np.isnan(Y) & ~np.isnan(Xresitt.sum(axis=1, keepdims=True)))
 
-    # Go through all members in the family
-    for i in range(M):
-        # Make an index of where both the member and all parts of X are not NaN
-        I = (~np.isnan(Y[:,i]) & ~np.isnan(Xresitt.sum(axis=1)))
-
-        # Get the number of effective observations
-        n = I.sum()
-
-        # Save it for printing later
-        N[i,0] = n
+    # Get the number of effective observations for each member, and save them
+    # for printing later
+    N = np.array(I.sum(axis=0), ndmin=2).transpose()
 
-        # Get outcome variable, i.e. the current member of the family, for those
-        # observations with non-missing data for both LHS and RHS variables
-        y = np.array(Y[I,i], ndmin=2).transpose()
-
-        # Run OLS
-        bhat, Vhat, _, p = ols(y, Xresitt[I], cov_est='hmsd')
+    # Run OLS for all members at once, each using the observations with
+    # non-missing data for both LHS and RHS variables
+    bhat, Vhat, _, p = ols_many(Y, Xresitt, masks=I, cov_est='hmsd')
 
+    # Go through all members in the family
+    for i in range(M):
         # Save p-values
-        p_unadj[i,:] = p[cidx,0]
+        p_unadj[i,:] = p[cidx,i]
 
         # Save point estimates for coefficients of interest
-        b[i,:] = bhat[cidx,0]
+        b[i,:] = bhat[cidx,i]
 
         # Save standard errors
-        SE[i,:] = np.sqrt(np.diag(Vhat[cidx,cidx]))
+        SE[i,:] = np.sqrt(np.diag(Vhat[i][cidx,cidx]))
 
     ############################################################################
     ### Part 5.1: Bonferroni, Holm-Bonferroni
@@ -773,11 +761,14 @@ for f, family in enumerate(neighborhood):
     # Get randomization p-values using all available cores in parallel. Note
     # that the sample index this gets is the indicator for being a responder and
     # in the ITT follow-up sample, but only for those people who are in the
-    # original ITT sample
-    P = Parallel(n_jobs=ncores)( delayed(permute_p)
-        (Y=Y, X=beta0, Isamp=I_resitt[I_itt], ntreat=ntreat,
-         prank=p_unadj_sort_idx, balvars=BV, seed=f*R+r, Breg=Breg)
-        for r in range(R) )
+    # original ITT sample. Each family uses its own seed, and each iteration its
+    # own random number stream for that seed. The iterations get sent to the
+    # worker processes in chunks (see run_chunked() in linreg.py)
+    P = run_chunked(permute_p, R,
+                    {'Y': Y, 'X': beta0, 'Isamp': I_resitt[I_itt],
+                     'ntreat': ntreat, 'prank': p_unadj_sort_idx, 'balvars': BV,
+                     'seed': f, 'Breg': Breg},
+                    index='r', n_jobs=ncores)
 
     # Count how often the randomization values are below the original p-values
     P = np.sum([(p_star <= p_unadj) for p_star in P], axis=0)
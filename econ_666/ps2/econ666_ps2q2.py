@@ -15,7 +15,6 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from inspect import getsourcefile
-from joblib import Parallel, delayed
 from multiprocessing import cpu_count
 from os import chdir, mkdir, path
 from scipy.optimize import fsolve, minimize, NonlinearConstraint
@@ -34,7 +33,7 @@ mdir = path.dirname(path.abspath(getsourcefile(lambda:0))).replace('\\', '/')
 chdir(mdir)
 
 # Import custom packages (have to be in the main directory)
-from linreg import ols
+from linreg import ols, rng_stream, run_chunked
 
 ################################################################################
 ### Directories, graph options
@@ -437,16 +436,17 @@ D = np.zeros(shape=(y.shape[0],1))
 D[V_lg == 1] = 1
 
 # Define a function to do one iteration of the randomization distribution
-def random_t(y, x1, V, N_0, N_1, p_0, p_1, seed, D):
-    # Set random number generator's seed
-    np.random.seed(seed)
+def random_t(y, x1, V, N_0, N_1, p_0, p_1, seed, r, D):
+    # Get the random number generator for this iteration (see rng_stream() in
+    # linreg.py)
+    rng = rng_stream(seed, r)
 
     # Calculate sample size
     N = y.shape[0]
 
     # Generate treatment indicator
     # Draw random normals
-    W = np.random.normal(size=N)
+    W = rng.normal(size=N)
 
     # Replace the treatment in small villages as 1 with probability p_sm
     W[~V] = (W[~V].argsort() + 1 <= p_0 * N_0)
@@ -469,11 +469,12 @@ def random_t(y, x1, V, N_0, N_1, p_0, p_1, seed, D):
 # Get number of available cores
 ncores = cpu_count()
 
-# Get results
-res = Parallel(n_jobs=ncores)(
-    delayed(random_t)
-    (y=y, x1=cons, V=V_lg, N_0=N_sm, N_1=N_lg, p_0=p_sm, p_1=p_lg, seed = r, D=D)
-    for r in range(R))
+# Get results, sending the iterations to the worker processes in chunks (see
+# run_chunked() in linreg.py)
+res = run_chunked(random_t, R,
+                  {'y': y, 'x1': cons, 'V': V_lg, 'N_0': N_sm, 'N_1': N_lg,
+                   'p_0': p_sm, 'p_1': p_lg, 'seed': 666, 'D': D},
+                  index='r', n_jobs=ncores)
 
 # Make the results into a Numpy array
 res = np.array(res, ndmin=2)
@@ -612,16 +613,17 @@ y = y_unskilled + beta * W
 
 # Define a function to do one iteration of the randomization distribution
 def random_t_cls(N, y, x1, V_1, Vid, Vid_0, Vid_1, J_0, J_1, N_0, N_1, p_0, p_1,
-                 seed, D):
-    # Set random number generator's seed
-    np.random.seed(seed)
+                 seed, r, D):
+    # Get the random number generator for this iteration (see rng_stream() in
+    # linreg.py)
+    rng = rng_stream(seed, r)
 
     # Calculate sample size
     N = y.shape[0]
 
     # Generate treatment indicator
     # Draw random normals
-    W = np.random.normal(size=N)
+    W = rng.normal(size=N)
 
     # Get the treatment indicators for people in small villages
     W_0 = W[~V_1]
@@ -662,11 +664,12 @@ def random_t_cls(N, y, x1, V_1, Vid, Vid_0, Vid_1, J_0, J_1, N_0, N_1, p_0, p_1,
     return t[1,0], b[1,0]
 
 # Get randomization distribution
-res = Parallel(n_jobs=ncores)(
-    delayed(random_t_cls)
-    (N=N_q2h, y=y, x1=cons, V_1=V_lg, Vid=Vid, Vid_0=Vid_sm, Vid_1=Vid_lg,
-     J_0=J_sm, J_1=J_lg, N_0=N_sm, N_1=N_lg, p_0=p_sm, p_1=p_lg, seed = r, D=D)
-    for r in range(R))
+res = run_chunked(random_t_cls, R,
+                  {'N': N_q2h, 'y': y, 'x1': cons, 'V_1': V_lg, 'Vid': Vid,
+                   'Vid_0': Vid_sm, 'Vid_1': Vid_lg, 'J_0': J_sm, 'J_1': J_lg,
+                   'N_0': N_sm, 'N_1': N_lg, 'p_0': p_sm, 'p_1': p_lg,
+                   'seed': 666, 'D': D},
+                  index='r', n_jobs=ncores)
 
 # Make the results into a Numpy array
 res = np.array(res, ndmin=2)
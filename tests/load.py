@@ -0,0 +1,79 @@
+import ast
+import importlib.util
+import sys
+from os import path
+from scipy.linalg import lapack
+from threadpoolctl import ThreadpoolController
+
+# Get the cloudpickle joblib uses (bundled with joblib, unless the installed version was unbundled)
+try:
+    from joblib.externals.cloudpickle import register_pickle_by_value
+except ImportError:
+    from cloudpickle import register_pickle_by_value
+try:
+    from joblib.externals.loky.backend.reduction import register
+except ImportError:
+    from loky.backend.reduction import register
+
+# LAPACK routines imported from Scipy (as linreg.py does) and BLAS thread controllers (which linreg.py keeps around once
+# it has set one up) can't be pickled, which doesn't matter as long as the functions using them get sent by reference,
+# but they get sent by value here, so have workers look up the routines by name, and set up their own controllers
+register(type(lapack.dpotrf), lambda f: (getattr, (lapack, f.__name__.split()[-1])))
+register(ThreadpoolController, lambda c: (ThreadpoolController, ()))
+
+# Directory containing the course directories (econ_605, econ_666, etc.)
+root = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+# Define a function that imports a module from its path relative to the repository root, under a name that is unique
+# across the whole repository (several directories have their own copy of linreg.py, which would otherwise all end up as
+# the same module)
+def load_module(rel_path, name):
+    # Return the module if it was imported already
+    if name in sys.modules:
+        return sys.modules[name]
+
+    # Import the module, and register it before running it, so Numba can find its functions
+    spec = importlib.util.spec_from_file_location(name, path.join(root, rel_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+    # Worker processes can't import the module under that name, so have joblib send its functions by value instead
+    register_pickle_by_value(module)
+
+    # Return the module
+    return module
+
+
+# Define a function that imports only the imports and function definitions of a file, for files which run a whole
+# script when imported (solow.py, mccall.py); imports of the packages in skip get dropped as well, since those are only
+# needed for the plots at the end of the script
+def load_defs(rel_path, name, skip=('matplotlib',)):
+    # Return the module if it was imported already
+    if name in sys.modules:
+        return sys.modules[name]
+
+    # Parse the file
+    file = path.join(root, rel_path)
+    with open(file) as f:
+        tree = ast.parse(f.read(), filename=file)
+
+    # Keep the imports (except the skipped ones) and the function definitions
+    def keep(node):
+        if isinstance(node, ast.Import):
+            return not any(a.name.split('.')[0] in skip for a in node.names)
+        if isinstance(node, ast.ImportFrom):
+            return node.module.split('.')[0] not in skip
+        return isinstance(node, ast.FunctionDef)
+    tree.body = [node for node in tree.body if keep(node)]
+
+    # Set up an empty module, register it, and run what's left of the file in it
+    spec = importlib.util.spec_from_loader(name, loader=None)
+    module = importlib.util.module_from_spec(spec)
+    module.__file__ = file
+    sys.modules[name] = module
+    exec(compile(tree, file, 'exec'), module.__dict__)
+
+    # Return the module
+    return module
@@ -0,0 +1,284 @@
+import numpy as np
+import pytest
+from functools import partial
+from load import load_module
+
+# Import the Huggett model
+hg = load_module('econ_605/huggett/huggett.py', 'huggett')
+
+
+# Define a function that makes a random income transition matrix and random policy indices (and weights, for policies
+# off the grid) for n incomes and m assets
+def random_policy(n, m, seed=0):
+    # Get a random number generator
+    rng = np.random.default_rng(seed)
+
+    # Draw the transition matrix, and normalize its rows
+    P = rng.random((n, n))
+    P /= P.sum(axis=1, keepdims=True)
+
+    # Draw the policy indices (capped at m - 2, as find_L() does off the grid) and weights
+    g_i = rng.integers(0, m - 1, size=(n, m))
+    g_w = rng.random((n, m))
+
+    # Return the transition matrix, indices, and weights
+    return P, g_i, g_w
+
+
+# The sparse transition matrix should match the dense one, set up element by element
+def test_trans_mat_dense():
+    # Get a small random policy
+    n, m = 4, 15
+    P, g_i, g_w = random_policy(n, m)
+
+    # Set up the dense transition matrices, on and off the grid
+    P_X = np.zeros((n * m, n * m))
+    P_X_w = np.zeros((n * m, n * m))
+    for i in range(n):
+        for j in range(m):
+            for k in range(n):
+                P_X[i * m + j, k * m + g_i[i, j]] += P[i, k]
+                P_X_w[i * m + j, k * m + g_i[i, j]] += P[i, k] * g_w[i, j]
+                P_X_w[i * m + j, k * m + g_i[i, j] + 1] += P[i, k] * (1 - g_w[i, j])
+
+    # Compare
+    assert np.allclose(hg.trans_mat(g_i, P).toarray(), P_X, rtol=0, atol=1e-15)
+    assert np.allclose(hg.trans_mat(g_i, P, g_w=g_w).toarray(), P_X_w, rtol=0, atol=1e-15)
+
+
+# If the transition matrix would be too large, find_L() should fall back to the histogram method, and get the same
+# distribution as ARPACK does
+def test_find_L_fallback():
+    # Set up a small grid, and a policy which is off the grid
+    n, m = 3, 20
+    P, _, _ = random_policy(n, m, seed=1)
+    A = np.linspace(-1, 1, num=m)[:, None]
+    g = np.random.default_rng(2).uniform(-1, 1, size=(n, m))
+
+    # Get the distribution with ARPACK, and with a limit on the size of the transition matrix that forces the fallback
+    L = hg.find_L(None, g, A, None, P)
+    L_young = hg.find_L(None, g, A, None, P, tol=10**(-13), nnz_max=10)
+
+    # Compare
+    assert np.allclose(L_young, L, rtol=0, atol=10**(-9))
+
+
+# Define a function that sets up a small Huggett economy (incomes, assets, income transitions, and an initial guess for
+# the value function), like the one in huggett.py's main block, but with fewer grid points
+def small_economy(n=5, m=60, b=.96, seed=0):
+    # Get a random number generator
+    rng = np.random.default_rng(seed)
+
+    # Set up the income and asset grids, with the natural borrowing limit
+    Y = np.linspace(.1, 1, num=n)[:, None]
+    A = np.linspace(-.1 / (1 - b), 4, num=m)[:, None]
+
+    # Draw the transition matrix, and normalize its rows
+    P = rng.random((n, n))
+    P /= P.sum(axis=1, keepdims=True)
+
+    # Draw the initial guess
+    v_0 = rng.random((n, m)) * 30
+
+    # Return everything
+    return Y, A, P, v_0
+
+
+# The monotone search should find the same value and policy functions as checking the whole grid, including for low
+# interest rates, where it falls back to the grid search whenever continuation values are not concave
+@pytest.mark.parametrize('r', [-.5, -.1, .02])
+def test_v_iter_monotone(r):
+    # Set up the economy
+    b = .96
+    Y, A, P, v_0 = small_economy(b=b)
+    u = partial(hg.crra, g=2)
+
+    # Solve it both ways
+    v, g = hg.v_iter(r, b, u, P, A, Y, v_0, tol=10**(-8))
+    v_mon, g_mon = hg.v_iter(r, b, u, P, A, Y, v_0, tol=10**(-8), search='monotone')
+
+    # Compare
+    assert np.array_equal(g_mon, g)
+    assert np.allclose(v_mon, v, rtol=0, atol=10**(-8))
+
+
+# Without the fallback, the monotone Bellman operator should still match the grid search when continuation values are
+# not concave (which the random initial guess makes sure of), since it then checks each bracket in full
+def test_bellman_mon_non_concave():
+    # Set up the economy
+    b = .96
+    Y, A, P, v_0 = small_economy(b=b)
+    u = partial(hg.crra, g=2)
+
+    # Apply both operators to the initial guess
+    v, g_i = hg.bellman(.02, b, u, P, A, Y, v_0)
+    v_mon, g_i_mon = hg.bellman_mon(.02, b, u, P, A, Y, v_0, hg.mon_levels(A.shape[0]))
+
+    # Compare
+    assert np.array_equal(g_i_mon, g_i)
+    assert np.allclose(v_mon, v, rtol=0, atol=10**(-10))
+
+
+# All methods for the stationary distribution should find the same one, on and off the grid (with a tight tolerance,
+# since the iterative ones stop based on the change per iteration)
+@pytest.mark.parametrize('method', ['gmres', 'power', 'young'])
+@pytest.mark.parametrize('off_grid', [False, True])
+def test_stat_dist_methods(method, off_grid):
+    # Get a small random policy
+    P, g_i, g_w = random_policy(4, 25, seed=3)
+    g_w = g_w if off_grid else None
+
+    # Get the distribution via ARPACK, and via the other method
+    L = hg.stat_dist(g_i, P, g_w=g_w)
+    L_m = hg.stat_dist(g_i, P, method=method, tol=10**(-14), i_max_L=10**5, g_w=g_w)
+
+    # Compare
+    assert np.allclose(L_m, L, rtol=0, atol=10**(-10))
+    assert np.isclose(L_m.sum(), 1)
+
+
+# Warm starting from the equilibrium of the same economy should stop right away, and warm starting from a nearby
+# interest rate (with a first step of dr) should find an equilibrium within tolerance close to the one found from scratch
+# (on a grid this coarse, excess demand jumps around, so not necessarily the same one, or in fewer iterations)
+def test_solve_equilibrium_warm_start():
+    # Set up the economy, without polishing
+    Y, A, P, _ = small_economy(n=4, m=200)
+    params = {'b': .96, 'Y': Y, 'A': A, 'P': P, 'g': 2, 'polish': False}
+
+    # Solve it from scratch
+    eq = hg.solve_equilibrium(params, verbose=False)
+    assert eq['conv']
+
+    # Solve it again, starting from its own solution
+    eq_0 = hg.solve_equilibrium(dict(params, r=eq['r'], dr=.001), v_0=eq['v'], L_0=eq['L'], verbose=False)
+    assert eq_0['conv'] and eq_0['i'] == 0 and eq_0['r'] == eq['r']
+
+    # Solve it again, starting from a nearby interest rate
+    eq_w = hg.solve_equilibrium(dict(params, r=eq['r'] + .002, dr=.001), v_0=eq['v'], L_0=eq['L'], verbose=False)
+    assert eq_w['conv'] and abs(eq_w['r'] - eq['r']) < .001
+
+
+# The Bellman operator should give the same results whether it goes through the income states in blocks or all at once,
+# with precomputed utilities, and with buffers
+def test_bellman_blocks():
+    # Set up the economy
+    r, b = .02, .96
+    Y, A, P, v_0 = small_economy(b=b)
+    u = partial(hg.crra, g=2)
+    n = Y.shape[0]
+
+    # Apply the operator all at once, without anything precomputed
+    v, g_i = hg.bellman(r, b, u, P, A, Y, v_0)
+
+    # Apply it in blocks of two income states, with buffers
+    buf = hg.u_buffers(A, Y, 2)
+    v_b, g_i_b = hg.bellman(r, b, u, P, A, Y, v_0, n_block=2, buf=buf)
+
+    # Apply it with all utilities precomputed
+    U = hg.u_block(r, u, A, Y[:, 0, None, None] - A[None, None, :, 0])
+    v_U, g_i_U = hg.bellman(r, b, u, P, A, Y, v_0, U=U, n_block=n)
+
+    # Compare
+    for v_x, g_i_x in [(v_b, g_i_b), (v_U, g_i_U)]:
+        assert np.array_equal(g_i_x, g_i)
+        assert np.array_equal(v_x, v)
+
+
+# Modified policy iteration, with or without the MacQueen-Porteus stopping rule, should find the same policy function
+# as plain value function iteration, in fewer maximization steps, and a value function within the usual error bound of
+# the fixed point (stopping once the value function changes by at most tol means it's within b/(1-b) tol of it)
+@pytest.mark.parametrize('method, mqp', [('mpi', False), ('vfi', True), ('mpi', True)])
+def test_v_iter_mpi_mqp(method, mqp):
+    # Set up the economy
+    r, b = .02, .96
+    Y, A, P, v_0 = small_economy(b=b)
+    u = partial(hg.crra, g=2)
+
+    # Solve it with plain value function iteration, with a tight tolerance
+    v, g, i = hg.v_iter(r, b, u, P, A, Y, v_0, tol=10**(-10), i_max_v=10**4, get_i=True)
+
+    # Solve it with the other method, with a looser one
+    v_m, g_m, i_m = hg.v_iter(r, b, u, P, A, Y, v_0, tol=10**(-6), i_max_v=10**4, method=method, mqp=mqp,
+                              get_i=True)
+
+    # Compare
+    assert np.array_equal(g_m, g)
+    assert np.allclose(v_m, v, rtol=0, atol=b / (1 - b) * 10**(-6) + 10**(-8))
+    assert i_m < i
+
+
+# The endogenous grid method isn't restricted to the asset grid, so its policy function should be within one grid step
+# of the one value function iteration finds, and its consumption function should satisfy the budget constraint
+def test_egm_vs_v_iter():
+    # Set up the economy
+    r, b = .02, .96
+    Y, A, P, v_0 = small_economy(m=100, b=b)
+
+    # Solve it via value function iteration and via EGM
+    _, g = hg.v_iter(r, b, partial(hg.crra, g=2), P, A, Y, v_0, tol=10**(-8), method='mpi', i_max_v=10**4)
+    g_e, c_e = hg.egm(r, b, partial(hg.crra_mu, g=2), partial(hg.crra_mu_inv, g=2), P, A, Y, tol=10**(-10))
+
+    # Compare
+    assert np.amax(np.abs(g_e - g)) <= A[1, 0] - A[0, 0]
+    assert np.allclose(c_e, (1 + r) * A[None, :, 0] + Y - g_e, rtol=0, atol=10**(-12))
+
+
+# The Numba ufunc version of CRRA utility should match crra(), including for non-positive consumption, and both should
+# be able to write into a buffer
+def test_crra_nb():
+    # Set up consumption values, some of them non-positive
+    c = np.linspace(-1, 3, num=41)[:, None] * np.ones((1, 3))
+
+    # Get utility both ways, once into new arrays and once into buffers
+    u = hg.crra(c, g=2)
+    u_nb = hg.crra_nb(c, g=2)
+    out, out_nb = np.empty_like(c), np.empty_like(c)
+    hg.crra(c, g=2, out=out)
+    hg.crra_nb(c, g=2, out=out_nb)
+
+    # Compare
+    assert np.allclose(u_nb, u, rtol=10**(-15), atol=0)
+    assert np.array_equal(out, u) and np.array_equal(out_nb, u_nb)
+    assert np.all(u[c <= 0] == -10**10)
+
+
+# Solving the household problem in long doubles should give the same policy function as in regular floats, with a value
+# function of the same type, and single precision (which can't get much below a tolerance of .001) should be within the
+# error bound for that tolerance (see test_v_iter_mpi_mqp())
+def test_v_iter_precision():
+    # Set up the economy
+    r, b = .02, .96
+    Y, A, P, v_0 = small_economy(b=b)
+    u = partial(hg.crra, g=2)
+
+    # Solve it in each precision (everything follows the type of r, A, Y, P, and the initial guess)
+    sol = {}
+    for prec, dtype in hg.dtypes.items():
+        sol[prec] = hg.v_iter(dtype(r), b, u, P.astype(dtype), A.astype(dtype), Y.astype(dtype), v_0.astype(dtype),
+                              tol=10**(-6) if prec != 'float32' else 10**(-3))
+
+    # Compare
+    assert sol['longdouble'][0].dtype == np.longdouble and sol['float32'][0].dtype == np.float32
+    assert np.array_equal(sol['longdouble'][1], sol['float64'][1])
+    assert np.allclose(sol['longdouble'][0], sol['float64'][0], rtol=0, atol=10**(-9))
+    assert np.allclose(sol['float32'][0], sol['float64'][0], rtol=0, atol=2 * b / (1 - b) * 10**(-3))
+
+
+# The Numba kernel should give exactly the same results as Numpy, both for a single Bellman step (with and without
+# blocks and buffers) and for the whole value function iteration
+def test_bellman_numba_kernel():
+    # Set up the economy
+    r, b = .02, .96
+    Y, A, P, v_0 = small_economy(b=b)
+    u = partial(hg.crra, g=2)
+
+    # Apply a single step both ways, all at once and in blocks of two income states with buffers
+    for n_block, buf in [(None, None), (2, hg.u_buffers(A, Y, 2))]:
+        v, g_i = hg.bellman(r, b, u, P, A, Y, v_0, n_block=n_block, buf=buf)
+        v_nb, g_i_nb = hg.bellman(r, b, u, P, A, Y, v_0, n_block=n_block, buf=buf, kernel='numba')
+        assert np.array_equal(g_i_nb, g_i) and np.array_equal(v_nb, v)
+
+    # Solve the household problem both ways
+    v, g = hg.v_iter(r, b, u, P, A, Y, v_0)
+    v_nb, g_nb = hg.v_iter(r, b, u, P, A, Y, v_0, kernel='numba')
+    assert np.array_equal(g_nb, g) and np.array_equal(v_nb, v)
@@ -0,0 +1,59 @@
+import numpy as np
+import sys
+from load import load_module, root
+from os import path
+
+# The batch runner imports huggett by name, and its worker processes get started fresh, so the directory has to be on
+# the path (which the worker processes inherit)
+sys.path.insert(0, path.join(root, 'econ_605', 'huggett'))
+hg = load_module('econ_605/huggett/huggett.py', 'huggett')
+hb = load_module('econ_605/huggett/huggett_batch.py', 'huggett_batch')
+
+
+# The parameter grid should contain every combination exactly once, ordered so that consecutive points differ in one
+# parameter by one step
+def test_param_grid():
+    # Set up the grid
+    axes = {'b': [.94, .95, .96], 'g': [2, 3, 4], 'tol_e': [.01, .001]}
+    points = hb.param_grid(**axes)
+
+    # Check that every combination is in there exactly once
+    assert len(points) == 18
+    assert len({tuple(p[key] for key in axes) for p in points}) == 18
+
+    # Check that consecutive points only differ in one parameter, by one step
+    for p, q in zip(points[:-1], points[1:]):
+        steps = [abs(axes[key].index(p[key]) - axes[key].index(q[key])) for key in axes]
+        assert sorted(steps) == [0, 0, 1]
+
+
+# Solving a small batch in worker processes should give the same equilibria as solving each economy directly, and
+# write a summary line and the arrays for each of them
+def test_solve_batch(tmp_path):
+    # Set up a small economy, and three values of beta (on a grid this coarse, excess demand jumps around, so this uses
+    # a looser tolerance for it)
+    rng = np.random.default_rng(0)
+    Y = np.linspace(.1, 1, num=3)[:, None]
+    A = np.linspace(-.1 / (1 - .96), 4, num=200)[:, None]
+    P = rng.random((3, 3))
+    P /= P.sum(axis=1, keepdims=True)
+    points = hb.param_grid(b=[.94, .95, .96])
+    shared = {'Y': Y, 'A': A, 'P': P, 'g': 2, 'polish': False, 'tol_e': .01}
+
+    # Solve them in two processes (the first one gets the first two economies, and warm starts the second one from the
+    # first, and the second one gets the last one)
+    summary = hb.solve_batch(points, shared, str(tmp_path), n_jobs=2)
+
+    # Compare to solving them directly (economies which get warm started can end up at a different interest rate within
+    # the tolerance for excess demand, but the others should be exactly the same)
+    for k, point in enumerate(points):
+        eq = hg.solve_equilibrium(dict(shared, **point), verbose=False)
+        assert summary[k]['error'] is None and summary[k]['conv'] and eq['conv']
+        assert abs(summary[k]['e']) <= .01
+        if k != 1:
+            assert summary[k]['r'] == eq['r']
+        assert path.isfile(path.join(str(tmp_path), 'point_' + str(k) + '.npz'))
+
+    # Check the summary file has a header and a line per economy
+    with open(path.join(str(tmp_path), 'summary.csv')) as f:
+        assert len(f.readlines()) == len(points) + 1
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from load import load_module
+
+# Import the grant proposal's copy of linreg.py
+lr = load_module('econ_666/prop/linreg.py', 'linreg_666_prop')
+
+
+# Define a function that makes a small clustered data set with J clusters of n observations each, with an intercept, a
+# cluster level treatment, and an individual level covariate
+def clustered_data(J, n, seed=0):
+    # Get a random number generator
+    rng = np.random.default_rng(seed)
+
+    # Make the cluster variable
+    CV = np.repeat(np.arange(J), n)[:, None]
+
+    # Make a treatment which varies across clusters (alternating, so even J=2 has both groups)
+    D = (np.arange(J) % 2)[CV[:, 0]]
+
+    # Put together the RHS variables and the outcome
+    X = np.column_stack([np.ones(J * n), D, rng.normal(size=J * n)])
+    y = rng.normal(size=(J, 1))[CV[:, 0], :] + rng.normal(size=(J * n, 1))
+
+    # Return the data
+    return y, X, CV
+
+
+# With few clusters, boot_ols(enum=True) should use all 2^J disturbances, give the same t-statistics as refitting the
+# model for each of them (which is what b_iter_cgm0() does for a single draw), and take the CI from their order
+# statistics without running past the end (J=3 and J=5 used to raise an IndexError)
+@pytest.mark.parametrize('J', [3, 4, 5, 6])
+def test_boot_ols_enum_small_J(J):
+    # Get the data, and impose the null on the treatment effect
+    y, X, CV = clustered_data(J, 6)
+    imp0 = lr.larry([0, 1, 0])
+
+    # Run the enumerated bootstrap
+    beta_hat, t_hat, CI = lr.boot_ols(y, X, alg='cgm0_fast', B=999, clustvar=CV, imp0=imp0, enum=True, par=False)
+
+    # Get the restricted coefficients and unrestricted residuals, the same way boot_ols() does
+    unrest = (imp0[:, 0] == 0)
+    beta_hat_R = np.zeros(beta_hat.shape)
+    beta_hat_R[unrest, :] = lr.ols(y, X[:, unrest], get_cov=False, get_t=False, get_p=False)
+    e_hat = y - X @ beta_hat
+
+    # Refit the model for every possible vector of disturbances
+    eta = lr.rademacher_all(J)
+    Tb = np.column_stack([
+        lr.ols(X @ beta_hat_R + e_hat * eta[CV[:, 0], b][:, None], X, cov_est='cluster', get_p=False, clustvar=CV)[2][:, 0]
+        for b in range(2**J)])
+
+    # Check the sufficient statistics version against that
+    Tb_fast = lr.b_all_cgm0(X, e_hat, beta_hat_R, lr.cluster_index(CV), eta)
+    assert np.allclose(Tb_fast, Tb, rtol=1e-10, atol=1e-10)
+
+    # Check the CI against the order statistics (the upper one can't be past the largest)
+    B = 2**J
+    Tb = np.sort(Tb, axis=1)
+    lo = min(int(.025 * (B + 1)), B - 1)
+    hi = min(int(.975 * (B + 1)), B - 1)
+    assert np.allclose(CI, np.column_stack([Tb[:, lo], Tb[:, hi]]), rtol=1e-10, atol=1e-10)
+
+
+# The vectorized bootstrap should draw the same disturbances as the one that refits the model in each iteration, and
+# so give the same confidence intervals
+def test_boot_ols_cgm0_fast():
+    # Get the data, and impose the null on the treatment effect
+    y, X, CV = clustered_data(12, 8)
+    imp0 = lr.larry([0, 1, 0])
+
+    # Run both versions of the bootstrap
+    beta_hat, t_hat, CI = lr.boot_ols(y, X, alg='cgm0', B=199, clustvar=CV, imp0=imp0, seed=3, par=False)
+    beta_fast, t_fast, CI_fast = lr.boot_ols(y, X, alg='cgm0_fast', B=199, clustvar=CV, imp0=imp0, seed=3,
+                                             par=False)
+
+    # Compare them
+    assert np.array_equal(beta_fast, beta_hat)
+    assert np.array_equal(t_fast, t_hat)
+    assert np.allclose(CI_fast, CI, rtol=1e-10, atol=1e-10)
+
+
+# The execution context should parallelize the outer level when there are enough simulations to keep all cores busy,
+# the inner level otherwise, and nothing with a single core, splitting cores evenly across worker processes for BLAS
+@pytest.mark.parametrize('S, B, n_jobs, level, n_proc, blas_w', [
+    (8, 100, 4, 'outer', 4, 1),
+    (2, 100, 4, 'inner', 4, 1),
+    (2, 1, 4, 'outer', 2, 2),
+    (1, 1, 4, None, 1, 4),
+    (8, 100, 1, None, 1, 1)])
+def test_exec_context(S, B, n_jobs, level, n_proc, blas_w):
+    # Set up the context, and check its decisions
+    ctx = lr.exec_context(S, B, n_jobs=n_jobs)
+    assert (ctx['level'], ctx['n_jobs'], ctx['blas'], ctx['worker']['blas']) == (level, n_proc, n_jobs, blas_w)
+    assert (ctx['pool'] is None) == (level is None)
+
+    # Workers shouldn't start processes of their own
+    assert ctx['worker']['level'] is None and ctx['worker']['worker'] is ctx['worker']
+
+
+# Running the bootstrap within an execution context (here, one that parallelizes the bootstrap iterations across two
+# processes, although run_chunked() keeps iterations this quick in one process) shouldn't change any results
+@pytest.mark.parametrize('alg', ['cgm0', 'cgm0_fast'])
+def test_boot_ols_ctx(alg):
+    # Get the data, and impose the null on the treatment effect
+    y, X, CV = clustered_data(10, 8)
+    imp0 = lr.larry([0, 1, 0])
+
+    # Run the bootstrap without a context, in this process only, and within a context for the inner level
+    res = lr.boot_ols(y, X, alg=alg, B=99, clustvar=CV, imp0=imp0, seed=4, par=False)
+    ctx = lr.exec_context(1, 99, n_jobs=2)
+    assert ctx['level'] == 'inner'
+    res_ctx = lr.boot_ols(y, X, alg=alg, B=99, clustvar=CV, imp0=imp0, seed=4, ctx=ctx)
+
+    # Compare them
+    for a, b in zip(res, res_ctx):
+        assert np.array_equal(a, b)
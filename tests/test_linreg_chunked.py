@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from load import load_module
+
+# Import the copies of linreg.py which run replications in chunks
+copies = [load_module('econ_666/ps2/linreg.py', 'linreg_666_ps2'),
+          load_module('econ_666/prop/linreg.py', 'linreg_666_prop')]
+
+
+# Each replication's random numbers should only depend on the seed and its index, so running replications in any
+# split, or in any order, gives the same draws, while different replications and different seeds give different ones
+@pytest.mark.parametrize('lr', copies)
+def test_rng_stream(lr):
+    # Define a replication which just draws some random numbers
+    def draw(seed, b):
+        return lr.rng_stream(seed, b).normal(size=3)
+
+    # Get the draws for all replications one at a time, in reverse order
+    R = 10
+    res = np.array([draw([666, 2], b) for b in reversed(range(R))])[::-1]
+
+    # Compare to running them in chunks of different sizes
+    for splits in [[0, R], [0, 1, R], [0, 3, 4, 8, R]]:
+        chunks = [lr.run_chunk(draw, b0, b1, {'seed': [666, 2]}) for b0, b1 in zip(splits[:-1], splits[1:])]
+        assert np.array_equal(np.concatenate(chunks, axis=0), res)
+
+    # All replications should get their own numbers, and so should a different simulation
+    assert len(np.unique(res[:, 0])) == R
+    other = lr.run_chunk(draw, 0, R, {'seed': [666, 3]})
+    assert not np.any(np.isin(other, res))
+
+
+# Running bootstrap iterations in parallel, in small chunks, should give exactly the same results as running them all
+# in this process
+@pytest.mark.parametrize('lr', copies)
+def test_run_chunked(lr):
+    # Set up a small clustered regression, and the arguments for the bootstrap iterations of the proposal's copy
+    # (which any copy can run, as long as it's sent along)
+    prop = copies[1]
+    rng = np.random.default_rng(0)
+    CV = np.repeat(np.arange(10), 5)[:, None]
+    X = np.column_stack([np.ones(50), rng.normal(size=50)])
+    y = rng.normal(size=(50, 1))
+    kwargs = {'y': y, 'X': X, 'e_hat': y - y.mean(), 'beta_hat_R': np.array([[y.mean()], [0]]), 'CV': CV, 'J': 10,
+              'seed': 5}
+
+    # Run the iterations in this process, and in two worker processes in chunks of three (with a pilot of two)
+    serial = lr.run_chunk(prop.b_iter_cgm0, 0, 23, kwargs)
+    par = lr.run_chunked(prop.b_iter_cgm0, 23, kwargs, n_jobs=2, chunk=3)
+
+    # Compare them
+    assert par.shape == serial.shape
+    assert np.array_equal(par, serial)
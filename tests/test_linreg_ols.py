@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from load import load_module
+from numpy.linalg import LinAlgError
+
+# Import all copies of linreg.py (the problem set 1 copy only has ols(), without t-statistics or clustering)
+ps1 = load_module('econ_666/ps1/linreg.py', 'linreg_666_ps1')
+copies = [load_module('econ_632/ps2/linreg.py', 'linreg_632_ps2'),
+          load_module('econ_666/ps2/linreg.py', 'linreg_666_ps2'),
+          load_module('econ_666/prop/linreg.py', 'linreg_666_prop')]
+
+
+# Define a function that makes a small heteroskedastic data set with a cluster variable
+def ols_data(n=200, k=4, J=20, seed=0):
+    # Get a random number generator
+    rng = np.random.default_rng(seed)
+
+    # Make the RHS variables (with an intercept), the cluster variable, and the outcome
+    X = np.column_stack([np.ones(n), rng.normal(size=(n, k - 1))])
+    CV = rng.integers(0, J, size=(n, 1))
+    y = X @ rng.normal(size=(k, 1)) + (1 + np.abs(X[:, 1:2])) * rng.normal(size=(n, 1))
+
+    # Return the data
+    return y, X, CV
+
+
+# Define a function that gets OLS coefficients and covariance estimates straight from the textbook formulas, using the
+# explicit inverse of X'X
+def ols_baseline(y, X, cov_est, CV):
+    # Get the coefficients and residuals
+    n, k = X.shape
+    XXinv = np.linalg.inv(X.T @ X)
+    beta_hat = XXinv @ X.T @ y
+    U_hat = y - X @ beta_hat
+
+    # Get the covariance estimate
+    if cov_est == 'hmsd':
+        V_hat = XXinv * (U_hat.T @ U_hat) / (n - k)
+    elif cov_est == 'hc1':
+        V_hat = n / (n - k) * XXinv @ (X.T @ (X * U_hat**2)) @ XXinv
+    else:
+        # Add up X_i u_i within each cluster, one cluster at a time
+        J = len(np.unique(CV))
+        S = np.array([(X * U_hat)[CV[:, 0] == c, :].sum(axis=0) for c in np.unique(CV)])
+        V_hat = n / (n - k) * J / (J - 1) * XXinv @ (S.T @ S) @ XXinv
+
+    # Return both
+    return beta_hat, V_hat
+
+
+# The Cholesky version of ols() should match the textbook formulas in every copy of linreg.py
+@pytest.mark.parametrize('cov_est', ['hmsd', 'hc1', 'cluster'])
+@pytest.mark.parametrize('lr', [ps1] + copies)
+def test_ols_cholesky(lr, cov_est):
+    # The problem set 1 copy can't cluster
+    if lr is ps1 and cov_est == 'cluster':
+        pytest.skip('no clustering in this copy')
+
+    # Get the data, and run both versions
+    y, X, CV = ols_data()
+    if lr is ps1:
+        beta_hat, V_hat = lr.ols(y, X, cov_est=cov_est)
+    else:
+        beta_hat, V_hat, t, p = lr.ols(y, X, cov_est=cov_est, clustvar=CV)
+    beta_0, V_0 = ols_baseline(y, X, cov_est, CV)
+
+    # Compare them
+    assert np.allclose(beta_hat, beta_0, rtol=1e-10, atol=1e-12)
+    assert np.allclose(V_hat, V_0, rtol=1e-10, atol=1e-14)
+    if lr is not ps1:
+        assert np.allclose(t, beta_0 / np.sqrt(np.diag(V_0))[:, None], rtol=1e-10, atol=0)
+
+    # With a RHS variable that's always zero (e.g. a dummy for an empty category), the factorization should fail
+    with pytest.raises(LinAlgError):
+        lr.ols(y, np.column_stack([X, np.zeros(X.shape[0])]), cov_est=cov_est)
+
+
+# The sparse cluster indicators should number clusters by their sorted labels, sum within clusters the same way as a
+# loop over clusters does, and give the same clustered ols() results whether passed in or set up from the labels
+@pytest.mark.parametrize('lr', copies)
+def test_cluster_index(lr):
+    # Get the data, with cluster labels that are neither consecutive nor sorted
+    y, X, CV = ols_data()
+    CV = 7 * (19 - CV) + 3
+
+    # Set up the cluster indicators, and check the numbering
+    clusters = lr.cluster_index(CV)
+    labels = np.unique(CV)
+    assert clusters['J'] == len(labels)
+    assert np.array_equal(labels[clusters['codes']], CV[:, 0])
+
+    # Sum within clusters both ways
+    S = X * y
+    assert np.allclose(clusters['D'] @ S, np.array([S[CV[:, 0] == c, :].sum(axis=0) for c in labels]), rtol=1e-12,
+                       atol=1e-12)
+
+    # Run ols() with both versions of the cluster variable
+    for a, b in zip(lr.ols(y, X, cov_est='cluster', clustvar=CV), lr.ols(y, X, cov_est='cluster', clustvar=clusters)):
+        assert np.array_equal(a, b)
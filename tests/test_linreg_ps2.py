@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from load import load_module
+
+# Import both problem set copies of linreg.py, which have ols_many()
+copies = [load_module('econ_632/ps2/linreg.py', 'linreg_632_ps2'),
+          load_module('econ_666/ps2/linreg.py', 'linreg_666_ps2')]
+
+
+# Define a function that makes a small data set with m outcomes, some of them missing, and a cluster variable
+def outcome_data(n=120, m=5, k=3, J=15, seed=0):
+    # Get a random number generator
+    rng = np.random.default_rng(seed)
+
+    # Make the RHS variables (with an intercept), the cluster variable, and the outcomes
+    X = np.column_stack([np.ones(n), rng.normal(size=(n, k - 1))])
+    CV = rng.integers(0, J, size=(n, 1))
+    Y = X @ rng.normal(size=(k, m)) + rng.normal(size=(n, m))
+
+    # Knock out some outcomes, in a way that gives two outcomes the same sample and leaves one complete
+    Y[:10, 0] = np.nan
+    Y[:10, 1] = np.nan
+    Y[20:30, 3] = np.nan
+
+    # Return the data
+    return Y, X, CV
+
+
+# ols_many() should give the same results as running ols() on each outcome separately, on its own sample, with the
+# cluster variable given either as raw labels or as the output of cluster_index()
+@pytest.mark.parametrize('lr', copies)
+@pytest.mark.parametrize('cov_est', ['hmsd', 'hc1', 'cluster'])
+@pytest.mark.parametrize('index', [False, True])
+def test_ols_many_matches_ols(lr, cov_est, index):
+    # Get the data
+    Y, X, CV = outcome_data()
+
+    # Run all regressions at once
+    clustvar = lr.cluster_index(CV) if index else CV
+    beta_hat, V_hat, t, p = lr.ols_many(Y, X, cov_est=cov_est, clustvar=clustvar)
+
+    # Go through all outcomes, and compare to ols() on that outcome's sample
+    for j in range(Y.shape[1]):
+        I = ~np.isnan(Y[:, j])
+        b, V, tj, pj = lr.ols(Y[I, j:j+1], X[I, :], cov_est=cov_est, clustvar=CV[I, :])
+        assert np.allclose(beta_hat[:, j:j+1], b, rtol=1e-10, atol=1e-12)
+        assert np.allclose(V_hat[j], V, rtol=1e-10, atol=1e-12)
+        assert np.allclose(t[:, j:j+1], tj, rtol=1e-10, atol=1e-12)
+        assert np.allclose(p[:, j:j+1], pj, rtol=1e-10, atol=1e-12)
@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+from load import load_defs
+from scipy.stats import chi2, f
+
+# Import the functions from the McCall model (importing the file itself would run the whole script)
+mc = load_defs('econ_605/mccall/mccall.py', 'mccall')
+
+
+# Define a function that sets up a wage grid and a discretized wage distribution, like the script does, but smaller
+def wage_setup(n=500):
+    # Set up the wages and the distribution
+    wages = np.linspace(1, 10**6, num=n)
+    f_w = mc.disc_pdf(f(dfn=500, dfd=10), n)
+
+    # Return both
+    return wages, f_w
+
+
+# All methods for the reservation wage should find the same root of h, which should also be where value function
+# iteration ends up (up to the wage grid, since that only looks at wages on it)
+@pytest.mark.parametrize('beta, c', [(.97, 12000), (.9, 0), (.99, 50000)])
+def test_res_wage_methods(beta, c):
+    # Set up the wages
+    wages, f_w = wage_setup()
+
+    # Get the reservation wage with each method
+    w_bar = {method: mc.res_wage(wages, f_w, beta, c, method=method, tol=10**(-8))
+             for method in ['fp', 'newton', 'brent']}
+
+    # Check that they agree, and solve w_bar = (1 - beta)c + beta E[max(w_bar, w)]
+    for method in ['fp', 'brent']:
+        assert np.isclose(w_bar[method], w_bar['newton'], rtol=10**(-9), atol=0)
+    assert np.isclose((1 - beta) * c + beta * np.sum(f_w * np.maximum(w_bar['newton'], wages)), w_bar['newton'],
+                      rtol=10**(-10), atol=0)
+
+    # Run value function iteration until it converges (V_iter() uses the script's f_w and c)
+    mc.f_w, mc.c = f_w, c
+    _, W = mc.V_iter(wages / (1 - beta), wages, beta, 10**5, tol=10**(-6), history='none')
+
+    # Compare the last reservation wage to the direct one
+    assert abs(W[-1] - w_bar['newton']) <= wages[1] - wages[0]
+
+
+# The history options should only change which value functions get kept, not the iteration itself, and with a
+# tolerance, value function iteration should stop early at the same value function
+def test_V_iter_history():
+    # Set up the wages, and the script's f_w and c, which V_iter() uses
+    wages, f_w = wage_setup()
+    beta, T = .97, 200
+    mc.f_w, mc.c = f_w, 12000
+    V_0 = wages / (1 - beta) * .5
+
+    # Iterate with each history option
+    V, W = mc.V_iter(V_0, wages, beta, T)
+    V_k, W_k = mc.V_iter(V_0, wages, beta, T, history='every_k', k=30)
+    V_n, W_n = mc.V_iter(V_0, wages, beta, T, history='none')
+
+    # Compare
+    assert V.shape == (len(wages), T + 1)
+    assert np.array_equal(V_k, V[:, [0, 30, 60, 90, 120, 150, 180, 200]])
+    assert np.array_equal(V_n[:, 0], V[:, -1])
+    assert np.array_equal(W_k, W) and np.array_equal(W_n, W)
+
+    # Iterate with a tolerance, which should stop after fewer sweeps, at a value function within the error bound of
+    # the fixed point
+    V_t, W_t = mc.V_iter(V_0, wages, beta, 10**5, tol=10**(-3), history='none')
+    V_x, W_x = mc.V_iter(V_0, wages, beta, 10**5, tol=10**(-9), history='none')
+    assert len(W_t) < len(W_x) < 10**5
+    assert np.allclose(V_t, V_x, rtol=0, atol=beta / (1 - beta) * 10**(-3))
+
+
+# Both simulation methods should draw durations from the same geometric distribution and accepted wages from the same
+# truncated wage distribution, so with many workers, both histograms should be close to their theoretical counterparts
+# (blocks shouldn't matter either)
+@pytest.mark.parametrize('method', ['geometric', 'draws'])
+def test_sim_spells(method):
+    # Set up the wages, and a reservation wage which rejects about half of the offers
+    wages, f_w = wage_setup(n=50)
+    w_bar = wages[np.searchsorted(np.cumsum(f_w), .5)]
+    acc = wages >= w_bar
+    p = f_w[acc].sum()
+
+    # Simulate, in blocks
+    N = 2 * 10**5
+    d_hist, w_hist = mc.sim_spells(w_bar, wages, f_w, N, method=method, block=7 * 10**4, seed=0)
+
+    # Check that everyone is accounted for, and that nobody accepted a wage below w_bar
+    assert d_hist.sum() == N and w_hist.sum() == N
+    assert np.all(w_hist[~acc] == 0)
+
+    # Compare the mean duration to 1/p, and the accepted wages to f_w conditional on acceptance (both to within a couple
+    # of standard errors)
+    d = np.arange(1, len(d_hist) + 1)
+    assert abs(np.sum(d * d_hist) / N - 1 / p) < 5 * np.sqrt((1 - p) / p**2 / N)
+    assert np.amax(np.abs(w_hist / N - f_w * acc / p)) < 5 * np.sqrt(.25 / N)
+
+
+# The sweep should give the same reservation wages as calling res_wage() for each combination, and acceptance
+# probabilities, durations, and accepted wages consistent with them
+def test_res_wage_sweep():
+    # Set up the wages, and the values to sweep over (one of the distributions is given as a pdf)
+    wages, f_w = wage_setup()
+    betas, cs = [.9, .97, .99], [0, 12000, 50000]
+    dists = [f(dfn=500, dfd=10), chi2(df=3), f_w]
+
+    # Run the sweep
+    sweep = mc.res_wage_sweep(betas, cs, dists, wages, tol=10**(-8))
+    assert len(sweep) == 27
+
+    # Go through all combinations (the table is ordered by distribution, then beta, then c), and compare
+    for i, row in enumerate(sweep.itertuples()):
+        d = dists[i // 9]
+        f_d = mc.disc_pdf(d, len(wages)) if hasattr(d, 'ppf') else d
+        assert np.isclose(row.w_bar, mc.res_wage(wages, f_d, row.beta, row.c, tol=10**(-8)), rtol=10**(-9), atol=0)
+        acc = wages >= row.w_bar
+        assert np.isclose(row.p_acc, f_d[acc].sum())
+        assert np.isclose(row.duration, 1 / row.p_acc)
+        assert np.isclose(row.w_acc, np.sum(f_d[acc] * wages[acc]) / f_d[acc].sum())
+
+
+# If c is at or above the highest wage, no offer gets accepted, so the sweep should report a zero acceptance
+# probability, an infinite duration, and no accepted wage, without any warnings
+@pytest.mark.filterwarnings('error::RuntimeWarning')
+def test_res_wage_sweep_no_acceptance():
+    # Run a sweep where the second value of c is above all wages
+    sweep = mc.res_wage_sweep([.9], [50, 200], [np.ones(50) / 50], np.linspace(10, 100, 50))
+
+    # The first row is an ordinary one, and the second one never accepts
+    assert sweep['p_acc'][0] > 0 and np.isfinite(sweep['duration'][0]) and np.isfinite(sweep['w_acc'][0])
+    assert sweep['w_bar'][1] >= 100
+    assert sweep['p_acc'][1] == 0 and sweep['duration'][1] == np.inf and np.isnan(sweep['w_acc'][1])
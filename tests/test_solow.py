@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from load import load_defs
+
+# Import the functions from the Solow model (importing the file itself would run the whole script)
+so = load_defs('econ_605/solow/solow.py', 'solow')
+
+
+# Both methods of solow_batch() should give the same paths as solow_cobb_douglas() run on each parameter set separately
+@pytest.mark.parametrize('method', ['numpy', 'numba'])
+def test_solow_batch(method):
+    # Set up a small grid of saving rates and population growth rates
+    s_grid, n_grid = (x.flatten() for x in np.meshgrid(np.linspace(.05, .5, num=4), np.linspace(0, .05, num=3)))
+
+    # Get all paths at once
+    batch = so.solow_batch(alpha=.3, n=n_grid, s=s_grid, d=.15, g_A=.03, K_0=1.4, L_0=1.0, A_0=.2, T=50,
+                           method=method)
+
+    # Go through all parameter sets, and compare each series
+    for b in range(len(s_grid)):
+        single = so.solow_cobb_douglas(alpha=.3, n=n_grid[b], s=s_grid[b], d=.15, g_A=.03, K_0=1.4, L_0=1.0, A_0=.2,
+                                       T=50)
+        for x_b, x in zip(batch, single):
+            assert x_b[b].shape == x.shape
+            assert np.allclose(x_b[b], x, rtol=1e-12, atol=0)
+
+
+# solow_paths() should follow the law of motion period by period (with either method), for economies with their own time
+# paths of parameters and shocks, and economies without shocks should converge to the steady state
+@pytest.mark.parametrize('method', ['numpy', 'numba'])
+def test_solow_paths(method):
+    # Set up a policy change in s, and shocks for a few economies
+    T = 200
+    s = np.where(np.arange(T + 1) < T // 2, .05, .1)
+    rng = np.random.default_rng(0)
+    e_A, e_d = rng.normal(scale=.01, size=(2, 3, T + 1))
+    e_A[0], e_d[0] = 0, 0
+
+    # Get the paths
+    paths = so.solow_paths(alpha=.3, n=.02, s=s, d=.1, g_A=.03, K_0=1.4, L_0=1.0, A_0=.2, T=T, e_A=e_A, e_d=e_d,
+                           method=method)
+
+    # Go through all economies, and apply the law of motion one period at a time
+    for b in range(3):
+        k, L, A = np.empty(T + 1), np.empty(T + 1), np.empty(T + 1)
+        k[0], L[0], A[0] = 1.4 / .2, 1.0, .2
+        for t in range(T):
+            k[t + 1] = s[t] * k[t]**.3 + (1 - .02 - .03 - e_A[b, t] - .1 - e_d[b, t]) * k[t]
+            L[t + 1] = 1.02 * L[t]
+            A[t + 1] = (1.03 + e_A[b, t]) * A[t]
+
+        # Compare those, and the other series given k
+        assert np.allclose(paths['k'][b], k, rtol=1e-12, atol=0)
+        assert np.allclose(paths['L'][b], L, rtol=1e-12, atol=0)
+        assert np.allclose(paths['A'][b], A, rtol=1e-12, atol=0)
+        assert np.allclose(paths['Y'][b], A * L * k**.3, rtol=1e-12, atol=0)
+        assert np.allclose(paths['K'][b], A * L * k, rtol=1e-12, atol=0)
+
+    # Without shocks, k should end up at the steady state, and t_conv should be where it gets within tol for good
+    k_star = (.1 / (.02 + .03 + .1))**(1 / .7)
+    assert np.isclose(paths['k_star'][0, -1], k_star)
+    assert abs(np.log(paths['k'][0, -1] / k_star)) < .01
+    gap = np.abs(np.log(paths['k'][0] / paths['k_star'][0]))
+    t_conv = paths['t_conv'][0]
+    assert t_conv > T // 2 and np.all(gap[t_conv:] < .01) and gap[t_conv - 1] >= .01
+
+
+# The half life should only be calculated where the gap closes monotonically (0 < lam < 1), and be NaN where k jumps
+# past k_star (lam >= 1) and inf where the gap doesn't close (lam <= 0), without any warnings of its own
+@pytest.mark.filterwarnings('error::RuntimeWarning')
+def test_solow_paths_half_life():
+    # Set up a depreciation shock in the last period (which doesn't affect k) that gives lam > 1
+    T = 20
+    e_d = np.zeros((2, T + 1))
+    e_d[1, -1] = 1.5
+
+    # Get the paths, and check the half lives
+    paths = so.solow_paths(alpha=.3, n=.02, s=.1, d=.13, g_A=.03, K_0=1.4, L_0=1.0, A_0=.2, T=T, e_d=e_d)
+    lam = .7 * (.02 + .03 + .13)
+    assert np.allclose(paths['half_life'][:, :-1], np.log(2) / -np.log(1 - lam))
+    assert np.isclose(paths['half_life'][0, -1], np.log(2) / -np.log(1 - lam))
+    assert np.isnan(paths['half_life'][1, -1])
+
+    # With n + g + d <= 0, lam <= 0, but the steady state isn't defined either, so ignore the warnings that gives
+    with np.errstate(divide='ignore', invalid='ignore'):
+        paths = so.solow_paths(alpha=.3, n=.02, s=.1, d=[-.05, -.1], g_A=.03, K_0=1.4, L_0=1.0, A_0=.2, T=1)
+    assert np.all(paths['half_life'] == np.inf)